@@ -40,4 +40,103 @@ def kroupa01_norm(m):
     array-like or float
         The normalized IMF value for the given stellar mass(es).
     """
-    return kroupa01_normal(m) / kroupa01_normal(0.08)
\ No newline at end of file
+    return kroupa01_normal(m) / kroupa01_normal(0.08)
+
+# Break points and slopes of the three power-law segments of kroupa01_normal
+KROUPA_BREAKS = (0.08, 0.5)
+KROUPA_SLOPES = (0.3, 1.3, 2.3)
+
+
+def kroupa01_segments(mass_min, mass_max):
+    """
+    Describes the Kroupa (2001) IMF restricted to [mass_min, mass_max] as a set of
+    power-law segments  A * m^{-a}  with their integrated weights.
+
+    Parameters:
+    ----------
+    mass_min : float
+        Minimum stellar mass (in units of Msun).
+    mass_max : float
+        Maximum stellar mass (in units of Msun).
+
+    Returns:
+    -------
+    tuple
+        - lows, highs : np.ndarray
+            Mass limits of each segment inside [mass_min, mass_max].
+        - coeffs, slopes : np.ndarray
+            Normalization A and slope a of each segment (same scale as kroupa01_norm).
+        - cum_weights : np.ndarray
+            Cumulative integral of the IMF at the upper edge of each segment.
+    """
+    edges = np.concatenate(([0.0], KROUPA_BREAKS, [np.inf]))
+    slopes = np.asarray(KROUPA_SLOPES)
+    # Continuity at the break points fixes the normalization of every segment
+    coeffs = kroupa01_norm(edges[1:-1]) * edges[1:-1] ** slopes[1:]
+    coeffs = np.concatenate(([1.0 / kroupa01_normal(0.08)], coeffs))
+
+    lows = np.clip(edges[:-1], mass_min, mass_max)
+    highs = np.clip(edges[1:], mass_min, mass_max)
+    weights = coeffs * (highs ** (1 - slopes) - lows ** (1 - slopes)) / (1 - slopes)
+
+    return lows, highs, coeffs, slopes, np.cumsum(weights)
+
+
+def kroupa01_cdf(m, mass_min, mass_max):
+    """
+    Computes the cumulative distribution function of the Kroupa (2001) IMF
+    normalized over [mass_min, mass_max].
+
+    Parameters:
+    ----------
+    m : array-like or float
+        Stellar mass or array of stellar masses (in units of Msun).
+    mass_min : float
+        Minimum stellar mass (in units of Msun).
+    mass_max : float
+        Maximum stellar mass (in units of Msun).
+
+    Returns:
+    -------
+    array-like or float
+        Probability of drawing a star with mass lower than m.
+    """
+    lows, highs, coeffs, slopes, cum_weights = kroupa01_segments(mass_min, mass_max)
+    m = np.clip(m, mass_min, mass_max)
+
+    seg = np.searchsorted(highs, m, side="left").clip(0, len(highs) - 1)
+    before = np.where(seg > 0, cum_weights[seg - 1], 0.0)
+    partial = coeffs[seg] * (m ** (1 - slopes[seg]) - lows[seg] ** (1 - slopes[seg])) / (1 - slopes[seg])
+
+    return (before + partial) / cum_weights[-1]
+
+
+def kroupa01_ppf(u, mass_min, mass_max):
+    """
+    Inverts the cumulative distribution of the Kroupa (2001) IMF, i.e. maps uniform
+    random numbers in [0, 1) onto stellar masses distributed as the IMF.
+
+    Parameters:
+    ----------
+    u : array-like or float
+        Uniform random number(s) in [0, 1).
+    mass_min : float
+        Minimum stellar mass (in units of Msun).
+    mass_max : float
+        Maximum stellar mass (in units of Msun).
+
+    Returns:
+    -------
+    array-like or float
+        Stellar mass(es) (in units of Msun) whose CDF value equals u.
+    """
+    lows, highs, coeffs, slopes, cum_weights = kroupa01_segments(mass_min, mass_max)
+    target = np.asarray(u) * cum_weights[-1]
+
+    seg = np.searchsorted(cum_weights, target, side="right").clip(0, len(cum_weights) - 1)
+    before = np.where(seg > 0, cum_weights[seg - 1], 0.0)
+    power = 1 - slopes[seg]
+
+    m = (lows[seg] ** power + (target - before) * power / coeffs[seg]) ** (1 / power)
+
+    return np.clip(m, mass_min, mass_max)
@@ -0,0 +1,175 @@
+import json
+import numpy as np
+
+# Remnant classes produced by remnant_classifier
+CLASS_NAMES = ("Main Sequence", "White Dwarf", "Neutron Star", "Black Hole")
+
+# Galaxy age assumed by generate_times (Myr)
+GALAXY_AGE = 13600
+
+
+def _bin_index(values, lo, hi, n_bins):
+    """
+    Index of the uniform bin of [lo, hi] containing each value (-1 outside the range).
+    """
+    idx = np.floor((values - lo) * (n_bins / (hi - lo))).astype(np.intp)
+    # Values exactly on the upper edge go to the last bin, as in np.histogram
+    idx[values == hi] = n_bins - 1
+    idx[(idx < 0) | (idx >= n_bins)] = -1
+    return idx
+
+
+def _bincount(idx, n_bins, weights=None):
+    valid = idx >= 0
+    return np.bincount(idx[valid], weights=None if weights is None else weights[valid], minlength=n_bins)
+
+
+class CatalogAggregates:
+    """
+    Online summary of a stellar catalog: fixed-bin histograms and per-class counters
+    updated chunk by chunk, without keeping the star arrays. With weighted catalogs
+    (stratified sampling) the counts are sums of weights.
+
+    The aggregates of different chunks, shards or runs with the same binning can be
+    merged, and saved to / loaded from a .npz file.
+
+    Parameters
+    ----------
+    mass_min, mass_max : float
+        Mass limits of the run (in units of Msun).
+    n_mass_bins : int
+        Number of log-spaced bins of the initial mass histogram.
+    n_born_bins : int
+        Number of bins of the birth time histogram over [0, GALAXY_AGE] Myr.
+    n_class_bins : int
+        Number of log-spaced bins of the per-remnant initial mass histograms.
+    """
+
+    def __init__(self, mass_min=0.08, mass_max=100, n_mass_bins=150, n_born_bins=150, n_class_bins=100):
+        self.mass_min, self.mass_max = mass_min, mass_max
+        self.mass_edges = np.logspace(np.log10(mass_min), np.log10(mass_max), n_mass_bins + 1)
+        self.born_edges = np.linspace(0, GALAXY_AGE, n_born_bins + 1)
+        self.class_mass_edges = np.logspace(np.log10(mass_min), np.log10(mass_max), n_class_bins + 1)
+
+        n_classes = len(CLASS_NAMES)
+        self.mass_counts = np.zeros(n_mass_bins)
+        self.born_counts = np.zeros(n_born_bins)
+        self.class_mass_counts = np.zeros((n_classes, n_class_bins))
+        self.class_counts = np.zeros(n_classes)
+        # Final mass sums over the stars of each class with a defined final mass
+        self.mass_f_counts = np.zeros(n_classes)
+        self.mass_f_sum = np.zeros(n_classes)
+        self.mass_f_sum2 = np.zeros(n_classes)
+
+    def update(self, chunk):
+        """
+        Adds a chunk of the catalog (dict with 'Mass_i', 'Born_time', 'Object' and
+        'Mass_f' arrays) to the aggregates. If the chunk has a 'Weight' array (stratified
+        sampling), every star counts with its weight.
+        """
+        weights = chunk.get("Weight")
+        log_mass = np.log10(chunk["Mass_i"])
+        log_min, log_max = np.log10(self.mass_min), np.log10(self.mass_max)
+        ind = np.asarray(chunk["Object"], dtype=np.intp)
+        n_classes = len(CLASS_NAMES)
+
+        self.mass_counts += _bincount(_bin_index(log_mass, log_min, log_max, len(self.mass_counts)),
+                                      len(self.mass_counts), weights)
+        self.born_counts += _bincount(_bin_index(chunk["Born_time"], 0, GALAXY_AGE, len(self.born_counts)),
+                                      len(self.born_counts), weights)
+
+        n_class_bins = self.class_mass_counts.shape[1]
+        idx = _bin_index(log_mass, log_min, log_max, n_class_bins)
+        idx[idx >= 0] += ind[idx >= 0] * n_class_bins
+        self.class_mass_counts += _bincount(idx, n_classes * n_class_bins, weights).reshape(n_classes, n_class_bins)
+        self.class_counts += np.bincount(ind, weights=weights, minlength=n_classes)
+
+        mass_f = np.asarray(chunk["Mass_f"], dtype=np.float64)
+        defined = ~np.isnan(mass_f)
+        w = np.ones(int(defined.sum())) if weights is None else weights[defined]
+        self.mass_f_counts += np.bincount(ind[defined], weights=w, minlength=n_classes)
+        self.mass_f_sum += np.bincount(ind[defined], weights=w * mass_f[defined], minlength=n_classes)
+        self.mass_f_sum2 += np.bincount(ind[defined], weights=w * mass_f[defined] ** 2, minlength=n_classes)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the aggregates of another chunk, shard or run with the same binning.
+        """
+        if not (np.array_equal(self.mass_edges, other.mass_edges)
+                and np.array_equal(self.born_edges, other.born_edges)
+                and np.array_equal(self.class_mass_edges, other.class_mass_edges)):
+            raise ValueError("Cannot merge aggregates with different binning.")
+        for name in self._counters():
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        return self
+
+    @property
+    def n_stars(self):
+        return self.class_counts.sum()
+
+    def fractions(self):
+        """
+        Fraction of stars of each class (Main Sequence, WD, NS, BH).
+        """
+        return self.class_counts / max(self.class_counts.sum(), 1)
+
+    def remnant_fractions(self):
+        """
+        Fraction of WD, NS and BH among the remnants (as in pie_plot_remnant).
+        """
+        return self.class_counts[1:] / max(self.class_counts[1:].sum(), 1)
+
+    def mean_final_mass(self):
+        """
+        Mean final mass of each class (NaN for empty classes).
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.mass_f_sum / self.mass_f_counts
+
+    @staticmethod
+    def _counters():
+        return ("mass_counts", "born_counts", "class_mass_counts", "class_counts",
+                "mass_f_counts", "mass_f_sum", "mass_f_sum2")
+
+    def to_dict(self):
+        """
+        JSON-serializable representation of the aggregates.
+        """
+        data = {"mass_min": self.mass_min, "mass_max": self.mass_max,
+                "n_mass_bins": len(self.mass_counts), "n_born_bins": len(self.born_counts),
+                "n_class_bins": self.class_mass_counts.shape[1]}
+        data.update({name: getattr(self, name).tolist() for name in self._counters()})
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuilds aggregates from the output of to_dict (or of a loaded .npz file).
+        """
+        aggregates = cls(float(data["mass_min"]), float(data["mass_max"]), int(data["n_mass_bins"]),
+                         int(data["n_born_bins"]), int(data["n_class_bins"]))
+        for name in cls._counters():
+            setattr(aggregates, name, np.asarray(data[name], dtype=np.float64))
+        return aggregates
+
+    def save(self, path):
+        """
+        Saves the aggregates to a .npz file (or .json if the path ends with .json).
+        """
+        if path.endswith(".json"):
+            with open(path, "w") as f:
+                json.dump(self.to_dict(), f)
+        else:
+            np.savez(path, **self.to_dict())
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads aggregates saved with save.
+        """
+        if path.endswith(".json"):
+            with open(path) as f:
+                return cls.from_dict(json.load(f))
+        with np.load(path) as data:
+            return cls.from_dict(dict(data))
@@ -0,0 +1,327 @@
+import argparse
+import time
+from statistics import NormalDist
+import numpy as np
+from Kroup_func import KROUPA_BREAKS, KROUPA_SLOPES, kroupa01_cdf
+from aggregates import CLASS_NAMES, GALAXY_AGE, CatalogAggregates
+from data_generator import main_sequence_time
+from utils import _BRANCH_EDGES, REMNANT_BRANCHES, remnant_branches, remnant_classifier
+
+# Tolerances of check_aggregates: largest class count or mean final mass deviation (in
+# standard deviations) and smallest p-value of the initial mass histogram chi-square
+MAX_ABS_Z = 5.0
+MIN_CHI2_P = 1e-4
+
+
+class _NormalParameters:
+    """
+    Stand-in for the random generator of the stochastic remnant relations: records
+    the parameters of the normal draw and returns its mean.
+    """
+
+    def __init__(self):
+        self.loc, self.scale = None, None
+
+    def normal(self, loc, scale, size):
+        self.loc, self.scale = loc, scale
+        return np.full(size, float(loc))
+
+
+def _cells(mass_min, mass_max, edges=(), n_grid=64):
+    """
+    Integration cells of the mass range: every segment between the model break
+    points (IMF breaks, main-sequence turn-off, classification and remnant branch
+    limits) and the requested edges is split into n_grid log-spaced cells.
+
+    Returns the cell edges, the cell midpoints (in log mass) and the exact IMF
+    probability of every cell.
+    """
+    turnoff = (main_sequence_time(1.0) / GALAXY_AGE) ** (1 / 2.5)
+    breaks = np.concatenate(([mass_min, mass_max, turnoff, 8, 20], KROUPA_BREAKS, _BRANCH_EDGES, edges))
+    log_breaks = np.unique(np.log10(breaks[(breaks >= mass_min) & (breaks <= mass_max)]))
+    # Merge break points that only differ by rounding (e.g. bin edges from np.logspace)
+    log_breaks = log_breaks[np.concatenate(([True], np.diff(log_breaks) > 1e-12))]
+    steps = np.linspace(0, 1, n_grid + 1)
+    cell_edges = 10 ** np.concatenate([lo + (hi - lo) * steps[:-1] for lo, hi in zip(log_breaks[:-1], log_breaks[1:])]
+                                      + [log_breaks[-1:]])
+    centers = np.sqrt(cell_edges[:-1] * cell_edges[1:])
+    probabilities = np.diff(kroupa01_cdf(cell_edges, mass_min, mass_max))
+    return cell_edges, centers, probabilities
+
+
+def _power_integral(lo, hi, slope):
+    """
+    Integral of m^-slope over [lo, hi] (slope != 1, as for every Kroupa segment).
+    """
+    return (hi ** (1 - slope) - lo ** (1 - slope)) / (1 - slope)
+
+
+def _dead_probability(cell_edges, centers):
+    """
+    Probability that a star of each cell has left the main sequence, averaged
+    exactly over the IMF power law inside the cell.
+
+    Birth times are uniform over the galaxy age, so a star of mass m has left the
+    main sequence with probability 1 - t_MS(m) / age where positive. The turn-off
+    mass is a cell edge, so the expression is either positive or zero in a cell.
+    """
+    lo, hi = cell_edges[:-1], cell_edges[1:]
+    slopes = np.asarray(KROUPA_SLOPES)[np.searchsorted(KROUPA_BREAKS, centers)]
+    ratio = _power_integral(lo, hi, slopes + 2.5) / _power_integral(lo, hi, slopes)
+    p_dead = 1 - main_sequence_time(1.0) / GALAXY_AGE * ratio
+    return np.where(main_sequence_time(centers) < GALAXY_AGE, p_dead, 0.0)
+
+
+def _final_mass_terms(masses, indicators):
+    """
+    Final mass of the stars of every cell for the given indicators: mean, second
+    moment and (loc, scale) of the stochastic branches (NaN where the relation is
+    deterministic or undefined).
+    """
+    mean = np.full(len(masses), np.nan)
+    loc, scale = np.full(len(masses), np.nan), np.full(len(masses), np.nan)
+    branches = remnant_branches(masses, indicators)
+    for code, (_, _, relation) in enumerate(REMNANT_BRANCHES, start=1):
+        idx = np.flatnonzero(branches == code)
+        if len(idx) == 0:
+            continue
+        draw = _NormalParameters()
+        mean[idx] = relation(masses[idx], draw)
+        if draw.scale is not None:
+            loc[idx], scale[idx] = draw.loc, draw.scale
+    second = mean ** 2 + np.where(np.isnan(scale), 0.0, scale) ** 2
+    return mean, second, loc, scale
+
+
+def _model(mass_min, mass_max, edges=(), n_grid=64):
+    """
+    Tabulates the model on the integration cells: for every cell and outcome (alive
+    on the MS, or remnant), its probability, class and final mass terms.
+    """
+    cell_edges, centers, probabilities = _cells(mass_min, mass_max, edges, n_grid)
+    p_dead = _dead_probability(cell_edges, centers)
+
+    dead_class = remnant_classifier(centers, np.ones_like(centers)).astype(int)
+    alive_class = np.zeros(len(centers), dtype=int)
+    outcomes = []
+    for weight, classes in ((probabilities * (1 - p_dead), alive_class), (probabilities * p_dead, dead_class)):
+        mean, second, loc, scale = _final_mass_terms(centers, classes)
+        outcomes.append({"weight": weight, "class": classes, "mean": mean, "second": second,
+                         "loc": loc, "scale": scale})
+    return cell_edges, centers, outcomes
+
+
+def expected_population(mass_min=0.08, mass_max=100, n_grid=64, final_mass_edges=None):
+    """
+    Deterministic expectation values of the simulation: integrates the Kroupa IMF, the
+    uniform birth times, the main-sequence lifetime t_MS = 10^10 yr M^-2.5 and the
+    remnant mass relations on a grid of initial masses, with no random numbers.
+
+    Parameters:
+    ----------
+    mass_min : float
+        Minimum stellar mass (in units of Msun).
+    mass_max : float
+        Maximum stellar mass (in units of Msun).
+    n_grid : int
+        Number of cells between consecutive break points of the model.
+    final_mass_edges : array-like, optional
+        Bin edges of the final mass distribution (default: 200 log-spaced bins over
+        [mass_min, mass_max]).
+
+    Returns:
+    -------
+    dict
+        - 'fractions': probability of each class (Main Sequence, WD, NS, BH).
+        - 'remnant_fractions': fractions of WD, NS and BH among the remnants.
+        - 'mean_final_mass': mean final mass of each class.
+        - 'undefined_fraction': probability of a remnant outside every remnant
+          mass relation (NaN final mass in the catalog).
+        - 'final_mass_edges', 'final_mass_pdf': probability of each final mass bin
+          for each class (shape (4, n_bins)).
+    """
+    if final_mass_edges is None:
+        final_mass_edges = np.logspace(np.log10(mass_min), np.log10(mass_max), 201)
+    final_mass_edges = np.asarray(final_mass_edges, dtype=np.float64)
+    n_classes, n_bins = len(CLASS_NAMES), len(final_mass_edges) - 1
+    _, _, outcomes = _model(mass_min, mass_max, n_grid=n_grid)
+
+    fractions = np.zeros(n_classes)
+    defined, mass_sum = np.zeros(n_classes), np.zeros(n_classes)
+    pdf = np.zeros((n_classes, n_bins))
+    for outcome in outcomes:
+        weight, classes, mean = outcome["weight"], outcome["class"], outcome["mean"]
+        fractions += np.bincount(classes, weights=weight, minlength=n_classes)
+        ok = ~np.isnan(mean)
+        defined += np.bincount(classes[ok], weights=weight[ok], minlength=n_classes)
+        mass_sum += np.bincount(classes[ok], weights=weight[ok] * mean[ok], minlength=n_classes)
+
+        # Deterministic final masses fall in one bin, normal ones spread over the bins
+        fixed = ok & np.isnan(outcome["scale"])
+        bins = np.searchsorted(final_mass_edges, mean[fixed], side="right") - 1
+        inside = (bins >= 0) & (bins < n_bins)
+        np.add.at(pdf, (classes[fixed][inside], bins[inside]), weight[fixed][inside])
+        spread = ok & ~fixed
+        for loc, scale in set(zip(outcome["loc"][spread], outcome["scale"][spread])):
+            cells = spread & (outcome["loc"] == loc) & (outcome["scale"] == scale)
+            bin_probabilities = np.diff([NormalDist(loc, scale).cdf(edge) for edge in final_mass_edges])
+            pdf += np.outer(np.bincount(classes[cells], weights=weight[cells], minlength=n_classes),
+                            bin_probabilities)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_final_mass = mass_sum / defined
+    return {
+        "fractions": fractions,
+        "remnant_fractions": fractions[1:] / fractions[1:].sum(),
+        "mean_final_mass": mean_final_mass,
+        "undefined_fraction": fractions.sum() - defined.sum(),
+        "final_mass_edges": final_mass_edges,
+        "final_mass_pdf": pdf,
+    }
+
+
+def expected_aggregates(n_stars, mass_min=0.08, mass_max=100, n_grid=16, **binning):
+    """
+    Expected value of the CatalogAggregates of an n_stars catalog (histogram counts,
+    class counts and final mass sums), to be compared with Monte Carlo aggregates.
+
+    Parameters:
+    ----------
+    n_stars : float
+        Number of stars of the catalog (or total weight for stratified sampling).
+    mass_min, mass_max : float
+        Mass limits of the run (in units of Msun).
+    n_grid : int
+        Number of cells between consecutive break points and bin edges.
+    **binning
+        n_mass_bins, n_born_bins, n_class_bins of CatalogAggregates.
+
+    Returns:
+    -------
+    CatalogAggregates
+        Aggregates holding the expected (non-integer) counts.
+    """
+    expected = CatalogAggregates(mass_min, mass_max, **binning)
+    edges = np.concatenate((expected.mass_edges, expected.class_mass_edges))
+    _, centers, outcomes = _model(mass_min, mass_max, edges, n_grid)
+
+    n_classes, n_class_bins = expected.class_mass_counts.shape
+    mass_bins = (np.searchsorted(expected.mass_edges, centers, side="right") - 1).clip(0, len(expected.mass_counts) - 1)
+    class_bins = (np.searchsorted(expected.class_mass_edges, centers, side="right") - 1).clip(0, n_class_bins - 1)
+    for outcome in outcomes:
+        weight, classes, mean = n_stars * outcome["weight"], outcome["class"], outcome["mean"]
+        expected.mass_counts += np.bincount(mass_bins, weights=weight, minlength=len(expected.mass_counts))
+        expected.class_mass_counts += np.bincount(classes * n_class_bins + class_bins, weights=weight,
+                                                  minlength=n_classes * n_class_bins).reshape(n_classes, n_class_bins)
+        expected.class_counts += np.bincount(classes, weights=weight, minlength=n_classes)
+        ok = ~np.isnan(mean)
+        expected.mass_f_counts += np.bincount(classes[ok], weights=weight[ok], minlength=n_classes)
+        expected.mass_f_sum += np.bincount(classes[ok], weights=weight[ok] * mean[ok], minlength=n_classes)
+        expected.mass_f_sum2 += np.bincount(classes[ok], weights=weight[ok] * outcome["second"][ok],
+                                            minlength=n_classes)
+    # Birth times are uniform
+    expected.born_counts += n_stars * np.diff(expected.born_edges) / GALAXY_AGE
+    return expected
+
+
+def compare_aggregates(observed, expected=None):
+    """
+    Compares Monte Carlo aggregates with their expectation (correctness oracle).
+
+    Parameters:
+    ----------
+    observed : CatalogAggregates
+        Aggregates of an unweighted Monte Carlo catalog.
+    expected : CatalogAggregates, optional
+        Expected aggregates (default: expected_aggregates with the same binning and
+        number of stars).
+
+    Returns:
+    -------
+    dict
+        - 'class_z': deviation of every class count in binomial standard deviations.
+        - 'mean_final_mass_z': deviation of the mean final mass of every class in
+          standard errors.
+        - 'mass_chi2', 'mass_dof': chi-square of the initial mass histogram (bins
+          with at least 5 expected stars) and its degrees of freedom.
+        - 'max_abs_z': largest absolute class or mean final mass deviation.
+    """
+    if expected is None:
+        expected = expected_aggregates(observed.n_stars, observed.mass_min, observed.mass_max,
+                                       n_mass_bins=len(observed.mass_counts), n_born_bins=len(observed.born_counts),
+                                       n_class_bins=observed.class_mass_counts.shape[1])
+    n = observed.n_stars
+    p = expected.class_counts / expected.n_stars
+    with np.errstate(invalid="ignore", divide="ignore"):
+        class_z = (observed.class_counts - n * p) / np.sqrt(n * p * (1 - p))
+
+        mean = expected.mass_f_sum / expected.mass_f_counts
+        variance = expected.mass_f_sum2 / expected.mass_f_counts - mean ** 2
+        mean_z = (observed.mean_final_mass() - mean) / np.sqrt(np.maximum(variance, 0) / observed.mass_f_counts)
+    # Classes with a single final mass value have no spread
+    mean_z = np.where(np.isclose(observed.mean_final_mass(), mean, rtol=1e-9, atol=0), 0.0, mean_z)
+
+    scale = n / expected.n_stars
+    counts = expected.mass_counts * scale
+    used = counts >= 5
+    chi2 = float(np.sum((observed.mass_counts[used] - counts[used]) ** 2 / counts[used]))
+    z = np.concatenate((class_z, mean_z))
+    return {
+        "class_z": class_z,
+        "mean_final_mass_z": mean_z,
+        "mass_chi2": chi2,
+        "mass_dof": int(used.sum()) - 1,
+        "max_abs_z": float(np.nanmax(np.abs(z))),
+    }
+
+
+def check_aggregates(observed, expected=None, max_abs_z=MAX_ABS_Z, min_p=MIN_CHI2_P):
+    """
+    Checks Monte Carlo aggregates against their expectation (see compare_aggregates)
+    within tolerances, e.g. for a fixed seed in the tests.
+
+    Parameters:
+    ----------
+    observed, expected : CatalogAggregates
+        As in compare_aggregates.
+    max_abs_z : float
+        Largest accepted class count or mean final mass deviation.
+    min_p : float
+        Smallest accepted p-value of the initial mass histogram chi-square
+        (Wilson-Hilferty approximation).
+
+    Returns:
+    -------
+    dict
+        Output of compare_aggregates plus 'mass_chi2_p' and 'passed'.
+    """
+    result = compare_aggregates(observed, expected)
+    dof = max(result["mass_dof"], 1)
+    # (chi2 / dof)^(1/3) is close to normal with mean 1 - 2 / (9 dof)
+    spread = np.sqrt(2 / (9 * dof))
+    z = ((result["mass_chi2"] / dof) ** (1 / 3) - (1 - spread**2)) / spread
+    result["mass_chi2_p"] = 1 - NormalDist().cdf(z)
+    result["passed"] = result["max_abs_z"] <= max_abs_z and result["mass_chi2_p"] >= min_p
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Expected remnant fractions and final masses (no Monte Carlo).")
+    parser.add_argument("--mass-min", type=float, default=0.08, help="minimum mass [Msun] (default: 0.08)")
+    parser.add_argument("--mass-max", type=float, default=100, help="maximum mass [Msun] (default: 100)")
+    parser.add_argument("--n-grid", type=int, default=64, help="cells between break points (default: 64)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    population = expected_population(args.mass_min, args.mass_max, args.n_grid)
+    elapsed = time.perf_counter() - start
+    for i, name in enumerate(CLASS_NAMES):
+        print(f"{name:14s} fraction {population['fractions'][i]:.6e}  "
+              f"mean final mass {population['mean_final_mass'][i]:.4f}")
+    print(f"Remnant fractions (WD, NS, BH): {np.round(population['remnant_fractions'], 6)}")
+    print(f"Computed in {elapsed * 1e3:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from Kroup_func import kroupa01_norm
+from data_generator import generate_star_mass_data, generate_stratified_mass_data, generate_times
+from utils import remnant_classifier, remnant_mass
+from catalog_io import open_catalog_writer
+from pipeline import CATALOG_COLUMNS, allocate_catalog, fill_catalog
+from sfh import burst_sfh, exponential_sfh
+from galaxy import POSITION_DRAWS, SUN, GalaxyModel, sky_direction
+from spatial import SpatialIndex
+
+MASS_MIN, MASS_MAX = 0.08, 100
+
+
+def make_catalog(n, seed=0):
+    """
+    Builds the inputs of every stage for n stars with a fixed seed.
+
+    Returns:
+    -------
+    dict
+        Arrays of the catalog (see pipeline.generate_block) plus 't_out_ms' and the
+        'X', 'Y', 'Z' positions in the default galaxy model.
+    """
+    rng = np.random.default_rng(seed)
+    masses, prob_val = generate_star_mass_data(MASS_MIN, MASS_MAX, n, rng=rng)
+    born_times, t_alive, t_out_ms = generate_times(masses, rng=rng)
+    indicators = remnant_classifier(masses, t_out_ms)
+    final_mass = remnant_mass(masses, indicators, rng=rng)
+    x, y, z = GalaxyModel().place(rng.random((POSITION_DRAWS, n)))
+    return {
+        "Mass_i": masses, "Age": t_alive, "Object": indicators, "Mass_f": final_mass,
+        "Prob": prob_val, "Born_time": born_times, "t_out_ms": t_out_ms, "X": x, "Y": y, "Z": z,
+    }
+
+
+def _write_catalog(catalog, output_format, outdir):
+    with open_catalog_writer(output_format, os.path.join(outdir, f"bench.{output_format}")) as writer:
+        writer.write(catalog)
+
+
+def _fill_catalog(n, float_dtype):
+    catalog = allocate_catalog(n, CATALOG_COLUMNS, float_dtype)
+    return fill_catalog(catalog, n, 1, MASS_MIN, MASS_MAX)
+
+
+def stage_functions(catalog, outdir, plots=False):
+    """
+    Callables timed by the benchmark, one per pipeline stage.
+
+    Parameters:
+    ----------
+    catalog : dict
+        Inputs built by make_catalog.
+    outdir : str
+        Scratch folder for the output stages.
+    plots : bool
+        Also benchmark every plot function.
+
+    Returns:
+    -------
+    dict
+        Stage name -> callable without arguments.
+    """
+    n = len(catalog["Mass_i"])
+    masses, indicators = catalog["Mass_i"], catalog["Object"]
+    # The spatial index is built on the first query run (the best time is kept)
+    index = {}
+
+    def spatial_index():
+        if "index" not in index:
+            index["index"] = SpatialIndex.from_columns(catalog)
+        return index["index"]
+
+    stages = {
+        "kroupa01_norm": lambda: kroupa01_norm(masses),
+        "generate_star_mass_data[inverse]":
+            lambda: generate_star_mass_data(MASS_MIN, MASS_MAX, n, rng=np.random.default_rng(1)),
+        "generate_star_mass_data[rejection]":
+            lambda: generate_star_mass_data(MASS_MIN, MASS_MAX, n, method="rejection", rng=np.random.default_rng(1)),
+        "generate_stratified_mass_data":
+            lambda: generate_stratified_mass_data(MASS_MIN, MASS_MAX, n, rng=np.random.default_rng(1)),
+        "generate_times": lambda: generate_times(masses, rng=np.random.default_rng(1)),
+        "generate_times[exponential]":
+            lambda: generate_times(masses, rng=np.random.default_rng(1), sfh=exponential_sfh(3000.0)),
+        "generate_times[burst]":
+            lambda: generate_times(masses, rng=np.random.default_rng(1), sfh=burst_sfh(((2000.0, 50.0, 30.0),))),
+        "remnant_classifier": lambda: remnant_classifier(masses, catalog["t_out_ms"]),
+        "remnant_mass": lambda: remnant_mass(masses, indicators, rng=np.random.default_rng(1)),
+        # Whole pipeline into a preallocated catalog: peak_bytes / n is the memory
+        # per star of the catalog plus the block-sized temporaries
+        "fill_catalog[float64]": lambda: _fill_catalog(n, np.float64),
+        "fill_catalog[float32]": lambda: _fill_catalog(n, np.float32),
+        "place_stars": lambda: GalaxyModel().place(np.random.default_rng(1).random((POSITION_DRAWS, n))),
+        "spatial_index[build]": lambda: SpatialIndex.from_columns(catalog),
+        "spatial_index[sphere]": lambda: spatial_index().sphere(SUN, 1.0),
+        "spatial_index[cone]": lambda: spatial_index().cone(SUN, sky_direction(0, 0), 2),
+        "write[csv]": lambda: _write_catalog(catalog, "csv", outdir),
+        "write[npy]": lambda: _write_catalog(catalog, "npy", outdir),
+    }
+    if plots:
+        from render import catalog_plot_tasks, render_plot
+        for task in catalog_plot_tasks(MASS_MIN, MASS_MAX):
+            stages[f"plot[{task[1]}]"] = lambda task=task: render_plot(task, catalog, outdir)
+    return stages
+
+
+def time_stage(func, repeat=3):
+    """
+    Times a stage: best wall time over `repeat` runs, then one extra run under
+    tracemalloc for the peak of the memory allocated by the stage.
+
+    Returns:
+    -------
+    tuple
+        (best wall time in seconds, peak allocated bytes)
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(sizes, repeat=3, plots=False, stages=None, verbose=True):
+    """
+    Runs the benchmark of every stage for every catalog size.
+
+    Parameters:
+    ----------
+    sizes : list of int
+        Number of stars of each benchmark.
+    repeat : int
+        Timed runs per stage (the best one is kept).
+    plots : bool
+        Also benchmark the plot functions.
+    stages : list of str, optional
+        Only run the stages whose name contains one of these strings.
+    verbose : bool
+        Print every result.
+
+    Returns:
+    -------
+    dict
+        Machine-readable results: {"meta": {...}, "results": [{"stage", "n", "seconds",
+        "throughput", "peak_bytes", "bytes_per_star"}, ...]}.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as outdir:
+        for n in sizes:
+            catalog = make_catalog(n)
+            for name, func in stage_functions(catalog, outdir, plots).items():
+                if stages and not any(s in name for s in stages):
+                    continue
+                seconds, peak = time_stage(func, repeat)
+                results.append({"stage": name, "n": n, "seconds": seconds,
+                                "throughput": n / seconds if seconds > 0 else float("inf"),
+                                "peak_bytes": peak, "bytes_per_star": peak / n})
+                if verbose:
+                    print(f"{name:45s} N={n:<10d} {seconds:10.4f} s {n / max(seconds, 1e-12):12.3e} stars/s "
+                          f"{peak / 2**20:10.1f} MiB {peak / n:8.1f} B/star")
+
+    meta = {
+        "python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+        "cpu_count": os.cpu_count(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "repeat": repeat,
+    }
+    return {"meta": meta, "results": results}
+
+
+def compare(current, baseline, threshold=0.2):
+    """
+    Compares two benchmark results and lists the regressions.
+
+    Parameters:
+    ----------
+    current, baseline : dict
+        Outputs of run_benchmarks.
+    threshold : float
+        Relative slowdown above which a stage is reported (0.2 = 20 % slower).
+
+    Returns:
+    -------
+    list of dict
+        One entry per stage and size present in both results, with the time ratio
+        current / baseline and a 'regression' flag.
+    """
+    reference = {(r["stage"], r["n"]): r for r in baseline["results"]}
+    rows = []
+    for r in current["results"]:
+        base = reference.get((r["stage"], r["n"]))
+        if base is None:
+            continue
+        ratio = r["seconds"] / base["seconds"] if base["seconds"] > 0 else float("inf")
+        rows.append({"stage": r["stage"], "n": r["n"], "seconds": r["seconds"], "baseline": base["seconds"],
+                     "ratio": ratio, "regression": ratio > 1 + threshold})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the MC_StarGen pipeline.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1e3, 1e4, 1e5, 1e6],
+                        help="catalog sizes (default: 1e3 1e4 1e5 1e6)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage (default: 3)")
+    parser.add_argument("--plots", action="store_true", help="also benchmark the plot functions")
+    parser.add_argument("--stages", nargs="+", help="only run stages containing these names")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown reported as a regression (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks([int(n) for n in args.sizes], args.repeat, args.plots, args.stages)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            rows = compare(results, json.load(f), args.threshold)
+        for row in rows:
+            flag = "REGRESSION" if row["regression"] else ""
+            print(f"{row['stage']:45s} N={row['n']:<10d} {row['baseline']:10.4f} s -> {row['seconds']:10.4f} s "
+                  f"x{row['ratio']:.2f} {flag}")
+        if any(row["regression"] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: exclusive locks only
+    fcntl = None
+    import msvcrt
+
+# Modules whose source determines the catalog, aggregates and plots of a run
+MODEL_FILES = ("Kroup_func.py", "data_generator.py", "utils.py", "pipeline.py", "aggregates.py",
+               "catalog_io.py", "plots.py", "render.py", "sfh.py", "counter_rng.py", "galaxy.py")
+
+MANIFEST_FILE = "manifest.json"
+STATS_FILE = "stats.json"
+
+_CODE_VERSION = None
+
+
+def code_version():
+    """
+    Version of the model code: hash of the source of MODEL_FILES and of the numpy
+    version (which defines the random streams). Any change to the model invalidates
+    the cached results.
+    """
+    global _CODE_VERSION
+    if _CODE_VERSION is None:
+        digest = hashlib.sha256(np.__version__.encode())
+        folder = os.path.dirname(os.path.abspath(__file__))
+        for name in MODEL_FILES:
+            with open(os.path.join(folder, name), "rb") as f:
+                # Line endings do not change the model
+                digest.update(f.read().replace(b"\r\n", b"\n"))
+        _CODE_VERSION = digest.hexdigest()
+    return _CODE_VERSION
+
+
+def cache_key(params):
+    """
+    Content address of a run: hash of its parameters (JSON-serializable dict) and of
+    the model code version.
+    """
+    text = json.dumps({"params": params, "code": code_version()}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _tree_files(path):
+    """
+    Files of a file or directory (paths relative to the current folder).
+    """
+    if not os.path.isdir(path):
+        return [os.path.normpath(path)]
+    return [os.path.normpath(os.path.join(folder, name)) for folder, _, names in os.walk(path) for name in names]
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache of run outputs (catalog, aggregates, plots).
+
+    Every entry is a folder named after the cache key of the run, holding a copy of
+    the output files and a manifest. Entries are published with an atomic rename, read
+    under a shared lock and evicted under an exclusive lock, so several processes can
+    use the same cache. When the total size exceeds max_bytes, the least recently used
+    entries are evicted. Hits, misses and evictions are counted on disk.
+
+    Parameters
+    ----------
+    root : str
+        Cache folder (created if needed).
+    max_bytes : int
+        Size limit of the cache.
+    """
+
+    def __init__(self, root, max_bytes=5 * 2**30):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = os.path.join(root, "entries")
+        self._tmp = os.path.join(root, "tmp")
+        os.makedirs(self._entries, exist_ok=True)
+        os.makedirs(self._tmp, exist_ok=True)
+
+    @contextmanager
+    def _lock(self, name="cache", exclusive=True):
+        with open(os.path.join(self.root, f".{name}.lock"), "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _counters(self):
+        counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        try:
+            with open(os.path.join(self.root, STATS_FILE)) as f:
+                counters.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+        return counters
+
+    def _count(self, event, n=1):
+        with self._lock("stats"):
+            counters = self._counters()
+            counters[event] += n
+            path = os.path.join(self.root, STATS_FILE)
+            with open(path + ".tmp", "w") as f:
+                json.dump(counters, f)
+            os.replace(path + ".tmp", path)
+
+    def stats(self):
+        """
+        Hit/miss/eviction counters of the cache (all processes), plus its current
+        size and number of entries.
+        """
+        stats = self._counters()
+        entries = self._manifests()
+        stats["entries"] = len(entries)
+        stats["bytes"] = sum(manifest["bytes"] for manifest in entries.values())
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / total if total else None
+        return stats
+
+    def _manifests(self):
+        manifests = {}
+        for key in os.listdir(self._entries):
+            try:
+                with open(os.path.join(self._entries, key, MANIFEST_FILE)) as f:
+                    manifests[key] = json.load(f)
+            except (OSError, ValueError):
+                continue
+        return manifests
+
+    def get(self, key, dest="."):
+        """
+        Restores the files of a cached run into dest.
+
+        Parameters:
+        ----------
+        key : str
+            Cache key of the run (see cache_key).
+        dest : str
+            Folder where the output files are restored (with their relative paths).
+
+        Returns:
+        -------
+        dict or None
+            Manifest of the entry (params, files, metadata), or None on a miss.
+        """
+        entry = os.path.join(self._entries, key)
+        with self._lock(exclusive=False):
+            try:
+                with open(os.path.join(entry, MANIFEST_FILE)) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = None
+            if manifest is not None:
+                for name in manifest["files"]:
+                    target = os.path.join(dest, name)
+                    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+                    shutil.copyfile(os.path.join(entry, "files", name), target)
+                # The manifest modification time orders the entries for LRU eviction
+                os.utime(os.path.join(entry, MANIFEST_FILE))
+        self._count("hits" if manifest is not None else "misses")
+        return manifest
+
+    def put(self, key, paths, params=None, metadata=None):
+        """
+        Stores the output files of a run.
+
+        Parameters:
+        ----------
+        key : str
+            Cache key of the run (see cache_key).
+        paths : list of str
+            Output files or folders, relative to the current folder (e.g.
+            "MC_Catalog.csv", "MC_Catalog", "Plots/Pie_plot.pdf").
+        params : dict, optional
+            Run parameters, stored in the manifest.
+        metadata : dict, optional
+            Extra information stored in the manifest.
+
+        Returns:
+        -------
+        bool
+            Whether the entry was stored (False if it is larger than the cache).
+        """
+        files = sorted({name for path in paths for name in _tree_files(path)})
+        size = sum(os.path.getsize(name) for name in files)
+        if size > self.max_bytes:
+            return False
+
+        # Build the entry privately, then publish it with an atomic rename
+        tmp = os.path.join(self._tmp, f"{key}.{uuid.uuid4().hex}")
+        for name in files:
+            target = os.path.join(tmp, "files", name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(name, target)
+        with open(os.path.join(tmp, MANIFEST_FILE), "w") as f:
+            json.dump({"key": key, "params": params, "metadata": metadata, "files": files, "bytes": size,
+                       "created": time.time()}, f)
+
+        with self._lock():
+            try:
+                os.rename(tmp, os.path.join(self._entries, key))
+                stored = True
+            except OSError:
+                # Already stored by another process
+                stored = False
+            evicted = self._evict(keep=key)
+        if not stored:
+            shutil.rmtree(tmp, ignore_errors=True)
+        else:
+            self._count("stores")
+        if evicted:
+            self._count("evictions", evicted)
+        return stored
+
+    def _evict(self, keep=None):
+        """
+        Removes the least recently used entries until the cache fits in max_bytes
+        (called with the exclusive lock held).
+        """
+        manifests = self._manifests()
+        used = {key: os.path.getmtime(os.path.join(self._entries, key, MANIFEST_FILE)) for key in manifests}
+        total = sum(manifest["bytes"] for manifest in manifests.values())
+        evicted = 0
+        for key in sorted(used, key=used.get):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self._entries, key), ignore_errors=True)
+            total -= manifests[key]["bytes"]
+            evicted += 1
+        return evicted
+
+    def clear(self):
+        """
+        Removes every entry of the cache (the statistics are kept).
+        """
+        with self._lock():
+            for key in os.listdir(self._entries):
+                shutil.rmtree(os.path.join(self._entries, key), ignore_errors=True)
@@ -0,0 +1,267 @@
+import numpy as np
+from aggregates import CLASS_NAMES
+from catalog_io import read_catalog
+from pipeline import BLOCK_SIZE, catalog_columns, generate_range
+from spatial import SpatialIndex
+
+
+def _grouped_order(key, ind):
+    """
+    Permutation grouping the stars by class, sorted by key within each class: a sort
+    of the key followed by a stable radix sort of the class codes (faster than
+    np.lexsort).
+    """
+    order = np.argsort(key)
+    return order[np.argsort(ind[order].astype(np.uint8), kind="stable")]
+
+
+class Catalog:
+    """
+    In-memory stellar catalog indexed for fast queries.
+
+    The columns are stored grouped by class ('Object') and sorted by mass within each
+    class, so a class or a mass range of a class is a contiguous slice: it is found by
+    binary search and returned as zero-copy views of the columns. A secondary index
+    sorts the stars of each class by age for age range queries, and per-class counts
+    and extremes are read from the group bounds without scanning the stars.
+
+    Parameters
+    ----------
+    columns : dict
+        Catalog arrays of equal length, with at least 'Object', 'Age' and the sort
+        column (e.g. a chunk from the pipeline, or read_catalog output).
+    sort_by : str
+        Mass column used to sort the stars of each class ('Mass_i' or 'Mass_f').
+    """
+
+    def __init__(self, columns, sort_by="Mass_i"):
+        ind = np.asarray(columns["Object"])
+        order = _grouped_order(np.asarray(columns[sort_by]), ind)
+        self.columns = {name: np.asarray(values)[order] for name, values in columns.items()}
+        self.sort_by = sort_by
+
+        n_classes = len(CLASS_NAMES)
+        # Stars of class i are in [bounds[i], bounds[i + 1])
+        self.bounds = np.concatenate(([0], np.cumsum(np.bincount(ind, minlength=n_classes)[:n_classes])))
+        # Positions of the stars of each class sorted by age (same class bounds)
+        self.age_order = _grouped_order(self.columns["Age"], self.columns["Object"])
+        self._sorted_age = self.columns["Age"][self.age_order]
+        self._spatial_index = None
+
+    @classmethod
+    def from_dataframe(cls, df, sort_by="Mass_i"):
+        """
+        Builds the catalog from the DataFrame returned by main.main.
+        """
+        return cls({column: df[column].to_numpy() for column in df.columns}, sort_by)
+
+    @classmethod
+    def from_file(cls, path, sort_by="Mass_i"):
+        """
+        Builds the catalog from a npy or parquet catalog (see catalog_io.read_catalog).
+        """
+        columns, _ = read_catalog(path)
+        return cls(columns, sort_by)
+
+    def __len__(self):
+        return int(self.bounds[-1])
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def arrays(self):
+        """
+        Columns plus the 'class_bounds' array, for render.catalog_plot_tasks(grouped=True).
+        """
+        return dict(self.columns, class_bounds=self.bounds)
+
+    def class_slice(self, obj):
+        """
+        Slice of the stars of a class.
+        """
+        return slice(int(self.bounds[obj]), int(self.bounds[obj + 1]))
+
+    def mass_slice(self, obj, mass_min=-np.inf, mass_max=np.inf):
+        """
+        Slice of the stars of a class with mass_min <= mass <= mass_max (binary search).
+        """
+        start, stop = self.bounds[obj], self.bounds[obj + 1]
+        masses = self.columns[self.sort_by][start:stop]
+        return slice(int(start + np.searchsorted(masses, mass_min, side="left")),
+                     int(start + np.searchsorted(masses, mass_max, side="right")))
+
+    def view(self, obj, mass_min=-np.inf, mass_max=np.inf):
+        """
+        Zero-copy views of every column for the stars of a class in a mass range.
+        """
+        selection = self.mass_slice(obj, mass_min, mass_max)
+        return {name: values[selection] for name, values in self.columns.items()}
+
+    def count(self, obj, mass_min=-np.inf, mass_max=np.inf):
+        """
+        Number of stars of a class in a mass range, without scanning the stars.
+        """
+        selection = self.mass_slice(obj, mass_min, mass_max)
+        return selection.stop - selection.start
+
+    def age_indices(self, obj, age_min=-np.inf, age_max=np.inf):
+        """
+        Positions of the stars of a class with age_min <= age <= age_max, sorted by
+        age (a zero-copy view of the age index; use take to gather the stars).
+        """
+        start, stop = self.bounds[obj], self.bounds[obj + 1]
+        ages = self._sorted_age[start:stop]
+        return self.age_order[start + np.searchsorted(ages, age_min, side="left"):
+                              start + np.searchsorted(ages, age_max, side="right")]
+
+    def take(self, indices):
+        """
+        Columns of the stars at the given positions (copies).
+        """
+        return {name: values[indices] for name, values in self.columns.items()}
+
+    def spatial_index(self):
+        """
+        SpatialIndex over the 'X', 'Y' and 'Z' positions (catalogs generated with a
+        galaxy model), built on first use. The positions it returns are positions of
+        this catalog, e.g. catalog.take(catalog.spatial_index().sphere(SUN, 1)).
+        """
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex.from_columns(self.columns)
+        return self._spatial_index
+
+    def counts(self):
+        """
+        Number of stars of each class.
+        """
+        return np.diff(self.bounds)
+
+    def age_extremes(self):
+        """
+        Minimum and maximum age of each class (NaN for empty classes).
+
+        Returns:
+        -------
+        tuple
+            (min ages, max ages, positions of the youngest stars, positions of the
+            oldest stars); the positions are -1 for empty classes.
+        """
+        first, last = self.bounds[:-1], self.bounds[1:] - 1
+        empty = last < first
+        youngest = np.where(empty, -1, self.age_order[np.minimum(first, len(self) - 1)])
+        oldest = np.where(empty, -1, self.age_order[np.maximum(last, 0)])
+        ages = self.columns["Age"]
+        return (np.where(empty, np.nan, ages[youngest]), np.where(empty, np.nan, ages[oldest]),
+                youngest, oldest)
+
+    def mass_extremes(self):
+        """
+        Minimum and maximum of the sort mass column of each class (NaN for empty
+        classes).
+        """
+        first, last = self.bounds[:-1], self.bounds[1:] - 1
+        empty = last < first
+        masses = self.columns[self.sort_by]
+        return (np.where(empty, np.nan, masses[np.minimum(first, len(self) - 1)]),
+                np.where(empty, np.nan, masses[np.maximum(last, 0)]))
+
+    def sum(self, column, weights=None):
+        """
+        Per-class sum of a column (NaN values are skipped), one pass over the
+        contiguous groups. weights is the name of a column multiplying the values
+        (e.g. 'Weight' of stratified catalogs).
+        """
+        values = self.columns[column].astype(np.float64, copy=False)
+        if weights is not None:
+            values = values * self.columns[weights]
+        values = np.where(np.isnan(values), 0.0, values)
+        return self._reduce(values)
+
+    def mean(self, column):
+        """
+        Per-class mean of a column, ignoring NaN values (NaN for empty classes).
+        """
+        values = self.columns[column].astype(np.float64, copy=False)
+        defined = ~np.isnan(values)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self._reduce(np.where(defined, values, 0.0)) / self._reduce(defined.astype(np.float64))
+
+    def _reduce(self, values):
+        """
+        Per-class sums of an array in catalog order.
+        """
+        sums = np.zeros(len(self.bounds) - 1)
+        filled = np.diff(self.bounds) > 0
+        if filled.any():
+            # Empty classes have no stars between the starts of their neighbours
+            sums[filled] = np.add.reduceat(values, self.bounds[:-1][filled])
+        return sums
+
+
+class LazyCatalog:
+    """
+    Catalog of a counter-mode run (rng_mode="counter", "inverse" sampler) that is
+    never stored: indexing it generates only the requested stars
+    (pipeline.generate_range), which are the same as at these positions of the full
+    catalog. Slices can be materialized in any order and in any process.
+
+    Parameters
+    ----------
+    N_p : int
+        Number of stars of the run.
+    seed : int
+        Seed of the run.
+    mass_min, mass_max : float
+        Mass limits of the run (in units of Msun).
+    sfh : sfh.StarFormationHistory, optional
+        Star formation history of the run (default: constant SFR).
+    galaxy : galaxy.GalaxyModel, optional
+        Galaxy model of the run, for the 'X', 'Y' and 'Z' positions.
+    columns : tuple of str, optional
+        Columns returned for every slice (default: the catalog columns of the run).
+    """
+
+    def __init__(self, N_p, seed, mass_min=0.08, mass_max=100, sfh=None, galaxy=None, columns=None):
+        self.N_p, self.seed = int(N_p), seed
+        self.mass_min, self.mass_max = mass_min, mass_max
+        self.sfh, self.galaxy = sfh, galaxy
+        self.columns = catalog_columns("inverse", galaxy) if columns is None else tuple(columns)
+
+    def __len__(self):
+        return self.N_p
+
+    def __getitem__(self, key):
+        """
+        Columns of the stars of a slice (dict of arrays), or of one star (dict of
+        scalars) for an integer index.
+        """
+        if isinstance(key, slice):
+            positions = range(self.N_p)[key]
+            if not positions:
+                return self._range(0, 0)
+            first, last = min(positions[0], positions[-1]), max(positions[0], positions[-1])
+            stars = self._range(first, last + 1)
+            if positions.step == 1:
+                return stars
+            selection = slice(positions[0] - first, None, positions.step)
+            return {name: values[selection] for name, values in stars.items()}
+        index = range(self.N_p)[key]
+        return {name: values[0] for name, values in self._range(index, index + 1).items()}
+
+    def _range(self, start, stop):
+        stars = generate_range(self.seed, start, stop, self.mass_min, self.mass_max, sfh=self.sfh, galaxy=self.galaxy)
+        return {name: stars[name] for name in self.columns}
+
+    def chunks(self, chunk_size=16 * BLOCK_SIZE, start=0, stop=None):
+        """
+        Yields the stars [start, stop) in consecutive chunks of chunk_size stars.
+        """
+        stop = self.N_p if stop is None else min(stop, self.N_p)
+        for first in range(start, stop, chunk_size):
+            yield self._range(first, min(first + chunk_size, stop))
+
+    def to_catalog(self, start=0, stop=None, sort_by="Mass_i"):
+        """
+        Indexed in-memory Catalog of the stars [start, stop).
+        """
+        return Catalog(self[start:stop], sort_by)
@@ -0,0 +1,602 @@
+import bz2
+import functools
+import gzip
+import json
+import lzma
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+# Columns of the catalog and their on-disk types
+COLUMN_DTYPES = {
+    "Mass_i": np.dtype("<f8"),
+    "Age": np.dtype("<f8"),
+    "Object": np.dtype("<i8"),
+    "Mass_f": np.dtype("<f8"),
+}
+
+# Columns written only when requested, e.g. the star weights of the stratified sampler
+# or the galactocentric positions (kpc)
+OPTIONAL_COLUMN_DTYPES = {
+    "Weight": np.dtype("<f8"),
+    "X": np.dtype("<f8"),
+    "Y": np.dtype("<f8"),
+    "Z": np.dtype("<f8"),
+}
+
+# Size reserved for the .npy header, so the final shape can be written in place on close
+NPY_HEADER_SIZE = 128
+
+METADATA_FILE = "metadata.json"
+
+# Bytes of the length prefix of the JSON header of every record of a catalog stream
+STREAM_LENGTH_SIZE = 4
+
+
+# Types of the compact catalogs: uint8 classes and float32 masses, ages and weights
+COMPACT_DTYPES = {"f": np.dtype("<f4"), "i": np.dtype("u1")}
+
+
+def _column_dtypes(columns=None, compact=False):
+    """
+    On-disk types of the written columns (COLUMN_DTYPES by default), narrowed to
+    COMPACT_DTYPES for compact catalogs.
+    """
+    known = dict(COLUMN_DTYPES, **OPTIONAL_COLUMN_DTYPES)
+    dtypes = {column: known[column] for column in (COLUMN_DTYPES if columns is None else columns)}
+    if compact:
+        dtypes = {column: COMPACT_DTYPES[dtype.kind] for column, dtype in dtypes.items()}
+    return dtypes
+
+
+def _npy_header(dtype, n_rows):
+    """
+    Builds a version 1.0 .npy header of NPY_HEADER_SIZE bytes for a 1-D array.
+    """
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (dtype.str, n_rows)
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1")
+
+
+class NpyCatalogWriter:
+    """
+    Writes the catalog as a directory with one .npy file per column plus a JSON
+    metadata file. Chunks are appended to the column files and the array shapes are
+    fixed on close, so the columns can be opened with np.load(..., mmap_mode="r")
+    without parsing.
+
+    Parameters
+    ----------
+    path : str
+        Output directory (created if needed).
+    metadata : dict
+        Run metadata (N_p, seed, mass limits...) stored in metadata.json.
+    columns : sequence of str, optional
+        Columns to write (default: the COLUMN_DTYPES columns).
+    compact : bool
+        Store the columns with COMPACT_DTYPES (float32 and uint8).
+    """
+
+    def __init__(self, path, metadata=None, columns=None, compact=False):
+        self.path = path
+        self.metadata = dict(metadata or {})
+        self.dtypes = _column_dtypes(columns, compact)
+        self.n_rows = 0
+        os.makedirs(path, exist_ok=True)
+        self._files = {}
+        for column, dtype in self.dtypes.items():
+            f = open(os.path.join(path, f"{column}.npy"), "wb")
+            f.write(_npy_header(dtype, 0))
+            self._files[column] = f
+
+    def write(self, chunk):
+        """
+        Appends a chunk (dict of arrays with the catalog columns) to the catalog.
+        """
+        for column, dtype in self.dtypes.items():
+            self._files[column].write(np.ascontiguousarray(chunk[column], dtype=dtype).tobytes())
+        self.n_rows += len(chunk["Mass_i"])
+
+    def close(self):
+        """
+        Writes the final shapes and the metadata file.
+        """
+        for column, f in self._files.items():
+            f.seek(0)
+            f.write(_npy_header(self.dtypes[column], self.n_rows))
+            f.close()
+        self._files = {}
+
+        metadata = dict(self.metadata, n_stars=self.n_rows,
+                        columns={column: dtype.str for column, dtype in self.dtypes.items()})
+        with open(os.path.join(self.path, METADATA_FILE), "w") as f:
+            json.dump(metadata, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParquetCatalogWriter:
+    """
+    Writes the catalog as a Parquet file, one row group per chunk. The run metadata
+    is stored in the file schema. Requires pyarrow.
+
+    Parameters
+    ----------
+    path : str
+        Output file.
+    metadata : dict
+        Run metadata (N_p, seed, mass limits...).
+    compression : str
+        Parquet compression codec.
+    columns : sequence of str, optional
+        Columns to write (default: the COLUMN_DTYPES columns).
+    compact : bool
+        Store the columns with COMPACT_DTYPES (float32 and uint8).
+    """
+
+    def __init__(self, path, metadata=None, compression="snappy", columns=None, compact=False):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("The parquet output format requires pyarrow (pip install pyarrow).")
+
+        self._pa = pa
+        self.path = path
+        self.dtypes = _column_dtypes(columns, compact)
+        self.n_rows = 0
+        schema = pa.schema([(column, pa.from_numpy_dtype(dtype)) for column, dtype in self.dtypes.items()])
+        schema = schema.with_metadata({"MC_StarGen": json.dumps(dict(metadata or {}))})
+        self._writer = pq.ParquetWriter(path, schema, compression=compression)
+
+    def write(self, chunk):
+        """
+        Appends a chunk (dict of arrays with the catalog columns) as a row group.
+        """
+        table = self._pa.table({column: np.asarray(chunk[column], dtype=dtype)
+                                for column, dtype in self.dtypes.items()})
+        self._writer.write_table(table)
+        self.n_rows += table.num_rows
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Stream compression of the CSV catalogs and the suffix added to their file name.
+# gzip uses level 6 (as the gzip tool): about twice as fast as level 9 for the same size
+CSV_COMPRESSION = {
+    "gzip": (functools.partial(gzip.open, compresslevel=6), ".gz"),
+    "bz2": (bz2.open, ".bz2"),
+    "xz": (lzma.open, ".xz"),
+}
+
+
+class CsvCatalogWriter:
+    """
+    Writes the catalog as a CSV file, appending one chunk at a time.
+
+    Parameters
+    ----------
+    path : str
+        Output file (overwritten).
+    metadata : dict
+        Ignored, CSV files have no room for metadata.
+    columns : sequence of str, optional
+        Columns to write (default: the COLUMN_DTYPES columns).
+    compact : bool
+        Ignored, the text format does not depend on the column types.
+    compression : str, optional
+        Compress the file as it is written ("gzip", "bz2" or "xz", see
+        CSV_COMPRESSION).
+    """
+
+    def __init__(self, path, metadata=None, columns=None, compact=False, compression=None):
+        # pandas is only imported when a CSV file is actually written
+        import pandas as pd
+
+        if compression is not None and compression not in CSV_COMPRESSION:
+            raise ValueError(f"Unknown CSV compression: {compression} (use one of {', '.join(CSV_COMPRESSION)})")
+        self._pd = pd
+        self.path = path
+        self.columns = list(_column_dtypes(columns))
+        self.n_rows = 0
+        opener = open if compression is None else CSV_COMPRESSION[compression][0]
+        self._file = opener(path, "wt", newline="")
+
+    def write(self, chunk):
+        """
+        Appends a chunk (dict of arrays with the catalog columns) to the file.
+        """
+        df = self._pd.DataFrame({column: chunk[column] for column in self.columns})
+        df.to_csv(self._file, header=(self.n_rows == 0), index=False)
+        self.n_rows += len(df)
+
+    def close(self):
+        if self._file is None:
+            return
+        if self.n_rows == 0:
+            self._pd.DataFrame(columns=self.columns).to_csv(self._file, index=False)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _write_record(file, header, payload=b""):
+    """
+    Writes one record of a catalog stream: the length of the JSON header (4 bytes,
+    little-endian), the header and the payload, in a single write.
+    """
+    text = json.dumps(header).encode()
+    file.write(len(text).to_bytes(STREAM_LENGTH_SIZE, "little") + text + payload)
+
+
+class StreamCatalogWriter:
+    """
+    Writes the catalog to a binary stream (any object with a write method, e.g. a
+    socket or an HTTP response) as a sequence of records: a "catalog" record with the
+    metadata and the column types, one "chunk" record per chunk with the raw column
+    data (in the types of the npy catalogs, column after column) and an "end" record
+    with the number of stars, or an "error" record if the generation failed. Several
+    catalogs can follow each other in the same stream; the stream is left open on
+    close. read_catalog_stream reads it back.
+
+    Parameters
+    ----------
+    file : file-like
+        Binary stream to write to.
+    metadata : dict
+        Run metadata (N_p, seed, mass limits...) sent in the catalog record.
+    columns : sequence of str, optional
+        Columns to write (default: the COLUMN_DTYPES columns).
+    compact : bool
+        Send the columns with COMPACT_DTYPES (float32 and uint8).
+    """
+
+    def __init__(self, file, metadata=None, columns=None, compact=False):
+        self.file = file
+        self.metadata = dict(metadata or {})
+        self.dtypes = _column_dtypes(columns, compact)
+        self.n_rows = 0
+        _write_record(file, {"type": "catalog", "metadata": self.metadata,
+                             "columns": {column: dtype.str for column, dtype in self.dtypes.items()}})
+
+    def write(self, chunk):
+        """
+        Sends a chunk (dict of arrays with the catalog columns).
+        """
+        n = len(chunk["Mass_i"])
+        payload = b"".join(np.ascontiguousarray(chunk[column], dtype=dtype).tobytes()
+                           for column, dtype in self.dtypes.items())
+        _write_record(self.file, {"type": "chunk", "n_rows": n}, payload)
+        self.n_rows += n
+
+    def close(self, error=None):
+        """
+        Ends the catalog with an "end" record, or an "error" record with the given
+        message.
+        """
+        if self.file is None:
+            return
+        if error is None:
+            _write_record(self.file, {"type": "end", "n_stars": self.n_rows})
+        else:
+            _write_record(self.file, {"type": "error", "error": str(error), "n_stars": self.n_rows})
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close(exc)
+
+
+class BackgroundWriter:
+    """
+    Runs the writes of a catalog writer in a background thread, so the next chunk is
+    generated while the previous one is written (file I/O, compression and most of
+    the numpy conversions release the GIL).
+
+    The chunks go through a bounded queue: write() blocks while max_pending chunks
+    are waiting (back-pressure), so at most max_pending + 1 chunks are held besides
+    the one being generated. A chunk is written after write() returns and must not
+    be modified afterwards. An error of the writer thread stops the writing and is
+    raised once, by the next write() or by close().
+
+    Parameters
+    ----------
+    writer : catalog writer
+        Writer with write(chunk) and close() methods (see open_catalog_writer).
+    max_pending : int
+        Size of the queue of chunks waiting to be written.
+    """
+
+    def __init__(self, writer, max_pending=2):
+        self.writer = writer
+        self.busy_time = 0.0  # time spent writing, in the writer thread
+        self.wait_time = 0.0  # time the producer was blocked by a full queue or close()
+        self._error = None
+        self._raised = False
+        self._queue = queue.Queue(maxsize=max(1, max_pending))
+        self._thread = threading.Thread(target=self._run, name="catalog-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def n_rows(self):
+        return self.writer.n_rows
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                return
+            # After an error the queue is still drained, so write() never blocks forever
+            if self._error is None:
+                start = time.perf_counter()
+                try:
+                    self.writer.write(chunk)
+                except BaseException as error:
+                    self._error = error
+                self.busy_time += time.perf_counter() - start
+
+    def _raise(self):
+        # The error is kept (no more chunks are written) but raised only once
+        if self._error is not None and not self._raised:
+            self._raised = True
+            raise self._error
+
+    def write(self, chunk):
+        """
+        Queues a chunk (dict of arrays with the catalog columns) for writing.
+        """
+        self._raise()
+        start = time.perf_counter()
+        self._queue.put(chunk)
+        self.wait_time += time.perf_counter() - start
+
+    def close(self):
+        """
+        Waits for the queued chunks to be written and closes the writer.
+        """
+        if self._thread is None:
+            return
+        start = time.perf_counter()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self.wait_time += time.perf_counter() - start
+        try:
+            self._raise()
+        finally:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+CATALOG_WRITERS = {
+    "csv": CsvCatalogWriter,
+    "npy": NpyCatalogWriter,
+    "parquet": ParquetCatalogWriter,
+}
+
+# Default output path of every format
+CATALOG_PATHS = {
+    "csv": "MC_Catalog.csv",
+    "npy": "MC_Catalog",
+    "parquet": "MC_Catalog.parquet",
+}
+
+
+def catalog_path(output_format, compression=None):
+    """
+    Default output path of a catalog: CATALOG_PATHS, plus the suffix of the
+    compression for CSV files (e.g. MC_Catalog.csv.gz).
+    """
+    if output_format == "csv" and compression is not None:
+        return CATALOG_PATHS["csv"] + CSV_COMPRESSION[compression][1]
+    return CATALOG_PATHS[output_format]
+
+
+def open_catalog_writer(output_format, path=None, metadata=None, columns=None, compact=False, compression=None,
+                        background=0):
+    """
+    Opens a chunked catalog writer.
+
+    Parameters:
+    ----------
+    output_format : str
+        "csv", "npy" (directory of memory-mappable .npy columns) or "parquet".
+    path : str, optional
+        Output path. Defaults to catalog_path(output_format, compression).
+    metadata : dict, optional
+        Run metadata stored with the binary formats.
+    columns : sequence of str, optional
+        Columns to write (default: the COLUMN_DTYPES columns; add "Weight" for
+        weighted catalogs).
+    compact : bool
+        Write the binary formats with uint8 classes and float32 floats (half the
+        size of the default float64/int64 columns).
+    compression : str, optional
+        "gzip", "bz2" or "xz" for CSV files; a Parquet codec (e.g. "zstd", "gzip",
+        "none", default "snappy"). npy catalogs stay uncompressed so they can be
+        memory-mapped.
+    background : int
+        If > 0, the chunks are written by a BackgroundWriter thread with this many
+        chunks queued at most.
+
+    Returns:
+    -------
+    Writer with write(chunk) and close() methods, usable as a context manager.
+    """
+    if output_format not in CATALOG_WRITERS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    options = {"columns": columns, "compact": compact}
+    if compression is not None:
+        if output_format == "npy":
+            raise ValueError("npy catalogs are memory-mappable and cannot be compressed; use csv or parquet.")
+        options["compression"] = compression
+    writer = CATALOG_WRITERS[output_format](path or catalog_path(output_format, compression), metadata, **options)
+    return BackgroundWriter(writer, background) if background > 0 else writer
+
+
+def read_catalog(path, mmap_mode="r"):
+    """
+    Opens a catalog written in the npy or parquet format.
+
+    Parameters:
+    ----------
+    path : str
+        Catalog directory (npy) or file (parquet).
+    mmap_mode : str or None
+        Memory-map mode passed to np.load for the npy format ("r" by default, None
+        to load the columns in memory).
+
+    Returns:
+    -------
+    tuple
+        - columns : dict
+            Arrays of the catalog columns.
+        - metadata : dict
+            Run metadata.
+    """
+    if os.path.isdir(path):
+        with open(os.path.join(path, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        columns = {column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode=mmap_mode)
+                   for column in metadata["columns"]}
+        return columns, metadata
+
+    import pyarrow.parquet as pq
+    table = pq.read_table(path)
+    metadata = json.loads(table.schema.metadata[b"MC_StarGen"])
+    metadata["n_stars"] = table.num_rows
+    return {column: table[column].to_numpy() for column in table.column_names}, metadata
+
+
+def _read_exactly(file, n, eof_ok=False):
+    """
+    Reads n bytes from a stream (None if eof_ok and the stream ended before them).
+    """
+    data = bytearray(n)
+    view = memoryview(data)
+    received = 0
+    while received < n:
+        size = file.readinto(view[received:])
+        if not size:
+            if eof_ok and received == 0:
+                return None
+            raise EOFError("Truncated catalog stream.")
+        received += size
+    return data
+
+
+def iter_catalog_stream(file):
+    """
+    Reads the records of a catalog stream (see StreamCatalogWriter) as they arrive.
+
+    Parameters:
+    ----------
+    file : file-like
+        Binary stream with a readinto method (file, socket file, HTTP response).
+
+    Yields:
+    ------
+    tuple
+        - header : dict
+            Header of the record, with its "type": "catalog" (with the "metadata"
+            and the "columns" types), "chunk", "end" or "error".
+        - columns : dict or None
+            Arrays of the columns of a chunk record (None for the other records).
+    """
+    dtypes = {}
+    while True:
+        prefix = _read_exactly(file, STREAM_LENGTH_SIZE, eof_ok=True)
+        if prefix is None:
+            return
+        header = json.loads(_read_exactly(file, int.from_bytes(prefix, "little")))
+        columns = None
+        if header["type"] == "catalog":
+            dtypes = {column: np.dtype(dtype) for column, dtype in header["columns"].items()}
+        elif header["type"] == "chunk":
+            n = header["n_rows"]
+            data = _read_exactly(file, n * sum(dtype.itemsize for dtype in dtypes.values()))
+            columns, offset = {}, 0
+            for column, dtype in dtypes.items():
+                columns[column] = np.frombuffer(data, dtype=dtype, count=n, offset=offset)
+                offset += n * dtype.itemsize
+        yield header, columns
+
+
+def read_catalog_stream(file):
+    """
+    Reads every catalog of a catalog stream (see StreamCatalogWriter).
+
+    Parameters:
+    ----------
+    file : file-like
+        Binary stream with a readinto method.
+
+    Returns:
+    -------
+    list of tuple
+        (columns, metadata) of every catalog, in order, as returned by read_catalog.
+    """
+    catalogs = []
+    for header, columns in iter_catalog_stream(file):
+        if header["type"] == "catalog":
+            metadata, dtypes, chunks = header["metadata"], header["columns"], []
+        elif header["type"] == "chunk":
+            chunks.append(columns)
+        elif header["type"] == "error":
+            raise RuntimeError(f"The catalog stream failed: {header['error']}")
+        elif header["type"] == "end":
+            catalog = {column: np.concatenate([chunk[column] for chunk in chunks]) if chunks
+                       else np.empty(0, dtype=dtype) for column, dtype in dtypes.items()}
+            catalogs.append((catalog, dict(metadata, n_stars=header["n_stars"], columns=dtypes)))
+    return catalogs
+
+
+def export_csv(path, csv_path="MC_Catalog.csv", chunk_size=1_000_000):
+    """
+    Exports a binary catalog to CSV, chunk by chunk.
+
+    Parameters:
+    ----------
+    path : str
+        Catalog directory (npy) or file (parquet).
+    csv_path : str
+        Output CSV file.
+    chunk_size : int
+        Number of rows converted at a time.
+
+    Returns:
+    -------
+    int
+        Number of rows written.
+    """
+    columns, _ = read_catalog(path)
+    n_rows = len(columns["Mass_i"])
+    with CsvCatalogWriter(csv_path, columns=list(columns)) as writer:
+        for start in range(0, n_rows, chunk_size):
+            writer.write({column: values[start:start + chunk_size] for column, values in columns.items()})
+    return n_rows
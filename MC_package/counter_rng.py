@@ -0,0 +1,64 @@
+import numpy as np
+
+# Uniform draws of every star in counter mode, one Philox block (4 x 64 bits) per star
+# and stream. Stream 0: IMF quantile, IMF height (Prob), birth time quantile and final
+# mass quantile of the stochastic NS branches
+DRAWS_PER_STAR = 4
+
+# Stream of the draws of the galactic positions (see galaxy.GalaxyModel.place)
+POSITION_STREAM = 1
+
+
+def star_key(seed, stream=0):
+    """
+    Philox key (2 x 64 bits) of a stream of a run, derived from the user seed: the
+    stream-th pair of words of its seed sequence.
+    """
+    state = np.random.SeedSequence(seed).generate_state(2 * (stream + 1), dtype=np.uint64)
+    return state[2 * stream:]
+
+
+class StarStream:
+    """
+    Counter-based random numbers of the stars of a run, from star index start on.
+
+    The draws of star i are the Philox block of counter i under the key of the seed:
+    they only depend on the seed and the index, so any range of stars is generated
+    on its own (in any process and order) without drawing the stars before it. Pass
+    it as the rng of pipeline.generate_block to generate the stars [start, start + n)
+    ("inverse" sampler only).
+
+    Parameters
+    ----------
+    seed : int
+        User seed of the run.
+    start : int
+        Index of the first star.
+    """
+
+    def __init__(self, seed, start=0):
+        self.seed = seed
+        self.start = int(start)
+
+    def __repr__(self):
+        return f"StarStream(seed={self.seed!r}, start={self.start})"
+
+    def uniforms(self, n, stream=0):
+        """
+        Uniform draws of the stars [start, start + n).
+
+        Parameters:
+        ----------
+        n : int
+            Number of stars.
+        stream : int
+            Independent stream of draws (0 for the stellar evolution, POSITION_STREAM
+            for the positions), so optional stages do not change the other draws.
+
+        Returns:
+        -------
+        np.ndarray
+            (n, DRAWS_PER_STAR) array in [0, 1), one row per star.
+        """
+        bit_generator = np.random.Philox(key=star_key(self.seed, stream), counter=self.start)
+        return np.random.Generator(bit_generator).random((n, DRAWS_PER_STAR))
@@ -1,10 +1,21 @@
 import numpy as np
-from Kroup_func import kroupa01_norm
+from Kroup_func import kroupa01_cdf, kroupa01_norm, kroupa01_ppf
 
-def generate_star_mass_data(mass_min, mass_max, N_p):
+# Default mass strata of the stratified sampler: the NS (8-20 Msun) and BH (> 20 Msun)
+# ranges of remnant_classifier, each receiving a quarter of the stars
+STRATA_EDGES = (8, 20)
+STRATA_FRACTIONS = (0.5, 0.25, 0.25)
+
+def generate_star_mass_data(mass_min, mass_max, N_p, method="inverse", rng=None, uniforms=None):
     """
     Generates simulated stellar mass data using the Kroupa (2001) Initial Mass Function (IMF).
 
+    Two sampling methods are available:
+    - "inverse": inverts the closed-form CDF of the three Kroupa power-law segments,
+      returning exactly N_p stars in one vectorized pass.
+    - "rejection": draws N_p uniform masses on [mass_min, mass_max] and keeps those
+      that pass the IMF acceptance test (kept for comparison).
+
     Parameters:
     ----------
     mass_min : float
@@ -12,7 +23,15 @@ def generate_star_mass_data(mass_min, mass_max, N_p):
     mass_max : float
         Maximum stellar mass to generate (in units of Msun).
     N_p : int
-        Total number of stars to simulate.
+        Number of stars to generate ("inverse") or to simulate before applying
+        the IMF filter ("rejection").
+    method : str
+        Sampling method, "inverse" (default) or "rejection".
+    rng : np.random.Generator, optional
+        Random generator to draw from. Defaults to the global np.random state.
+    uniforms : tuple of array-like, optional
+        Uniform draws in [0, 1) of the IMF quantiles and of the heights under the IMF,
+        N_p each, used instead of rng (counter-based generation, "inverse" only).
 
     Returns:
     -------
@@ -22,17 +41,110 @@ def generate_star_mass_data(mass_min, mass_max, N_p):
         - prob_val : array-like
             Probability values associated with the generated stellar masses.
     """
-    random_p = np.random.uniform(0, 1, N_p)
+    rng = np.random if rng is None else rng
+
+    if method == "inverse":
+        if uniforms is None:
+            uniforms = (rng.uniform(0, 1, N_p), rng.uniform(0, 1, N_p))
+        quantiles, heights = uniforms
+        M_in = kroupa01_ppf(quantiles, mass_min, mass_max)
+        # Uniform height under the IMF curve, as for the stars accepted by rejection
+        prob_val = heights * kroupa01_norm(M_in)
+
+        return M_in, prob_val
+
+    if method != "rejection":
+        raise ValueError(f"Unknown sampling method: {method}")
+    if uniforms is not None:
+        raise ValueError("Counter-based generation needs the inverse sampling method.")
+
+    random_p = rng.uniform(0, 1, N_p)
     
-    random_mass = np.random.uniform(mass_min, mass_max, N_p)
+    random_mass = rng.uniform(mass_min, mass_max, N_p)
 
-    M_in = random_mass[random_p < kroupa01_norm(random_mass)]
-    prob_val = random_p[random_p < kroupa01_norm(random_mass)]
+    accepted = random_p < kroupa01_norm(random_mass)
+    M_in = random_mass[accepted]
+    prob_val = random_p[accepted]
 
     return M_in, prob_val
 
 
-def generate_times(masses):
+def generate_stratified_mass_data(mass_min, mass_max, N_p, edges=STRATA_EDGES, fractions=STRATA_FRACTIONS,
+                                  rng=None):
+    """
+    Generates stellar masses from the Kroupa (2001) IMF with stratified sampling: the
+    mass range is split at `edges` and each stratum receives a chosen fraction of the
+    N_p stars, so rare massive stars can be oversampled. Every star carries the
+    statistical weight (IMF probability of its stratum / fraction of stars drawn in
+    it) x N_p, so weighted counts estimate the numbers of an N_p-star IMF sample.
+
+    Parameters:
+    ----------
+    mass_min : float
+        Minimum stellar mass to generate (in units of Msun).
+    mass_max : float
+        Maximum stellar mass to generate (in units of Msun).
+    N_p : int
+        Number of stars to generate.
+    edges : sequence of float
+        Inner limits of the mass strata (in units of Msun).
+    fractions : sequence of float
+        Fraction of the stars drawn in each of the len(edges) + 1 strata.
+    rng : np.random.Generator, optional
+        Random generator to draw from. Defaults to the global np.random state.
+
+    Returns:
+    -------
+    tuple
+        - M_in : array-like
+            Stellar masses, grouped by stratum.
+        - prob_val : array-like
+            Probability values associated with the generated stellar masses.
+        - weights : array-like
+            Statistical weight of each star (the weights sum to N_p).
+    """
+    if len(fractions) != len(edges) + 1:
+        raise ValueError("fractions needs one value per mass stratum (len(edges) + 1).")
+    rng = np.random if rng is None else rng
+
+    cdf = kroupa01_cdf(np.clip(np.concatenate(([mass_min], edges, [mass_max])), mass_min, mass_max),
+                       mass_min, mass_max)
+    probabilities = np.diff(cdf)
+    # Strata outside [mass_min, mass_max] get no stars
+    fractions = np.where(probabilities > 0, fractions, 0.0)
+    fractions = fractions / fractions.sum()
+    n_strata = np.diff(np.round(np.concatenate(([0], np.cumsum(fractions))) * N_p)).astype(np.intp)
+
+    stratum = np.repeat(np.arange(len(n_strata)), n_strata)
+    u = cdf[stratum] + rng.uniform(0, 1, N_p) * probabilities[stratum]
+    M_in = kroupa01_ppf(u, mass_min, mass_max)
+    prob_val = rng.uniform(0, 1, N_p) * kroupa01_norm(M_in)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stratum_weights = np.where(n_strata > 0, probabilities * N_p / n_strata, 0.0)
+    weights = stratum_weights[stratum]
+
+    return M_in, prob_val, weights
+
+
+def main_sequence_time(masses):
+    """
+    Main-sequence lifetime t_MS = 10^10 yr (M/Msun)^-2.5.
+
+    Parameters:
+    ----------
+    masses : array-like
+        Stellar masses (in units of Msun).
+
+    Returns:
+    -------
+    array-like
+        Main-sequence lifetimes (in Myr).
+    """
+    return ((10**10) / (masses**2.5)) * 1e-6  # in MYr
+
+
+def generate_times(masses, rng=None, sfh=None, uniforms=None):
     """
     Generates times related to stellar evolution based on stellar masses.
 
@@ -40,6 +152,15 @@ def generate_times(masses):
     ----------
     masses : array-like
         Array or list of generated stellar masses (in units of Msun).
+    rng : np.random.Generator, optional
+        Random generator to draw from. Defaults to the global np.random state.
+    sfh : sfh.StarFormationHistory, optional
+        Star formation history the birth times are drawn from (one uniform draw
+        per star, by inverse-CDF lookup). Defaults to a constant SFR, i.e. uniform
+        birth times.
+    uniforms : array-like, optional
+        Uniform draws in [0, 1) of the birth times, one per star, used instead of
+        rng (counter-based generation).
 
     Returns:
     -------
@@ -53,9 +174,16 @@ def generate_times(masses):
             if t_out_ms<0, the star is out of the MS, i.e. t_alive > t_ms.
     """
     
-    born_time = np.random.uniform(0, 13600, len(masses))
+    rng = np.random if rng is None else rng
+
+    if uniforms is not None:
+        born_time = 13600 * uniforms if sfh is None else sfh.ppf(uniforms)
+    elif sfh is None:
+        born_time = rng.uniform(0, 13600, len(masses))
+    else:
+        born_time = sfh.sample(len(masses), rng)
     
-    t_ms = ((10**10) / (masses**2.5)) * 1e-6  # in MYr
+    t_ms = main_sequence_time(masses)
     
     t_alive = 13600 - born_time
     
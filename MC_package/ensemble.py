@@ -0,0 +1,269 @@
+import argparse
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+import numpy as np
+from aggregates import CLASS_NAMES, CatalogAggregates
+from catalog_io import open_catalog_writer
+from pipeline import block_rng, block_sizes, catalog_columns, generate_block, make_block_buffers
+
+# Work arrays of the current worker process, reused by all its runs
+_WORKER_BUFFERS = {}
+
+
+def expand_grid(seeds, N_p, mass_min=(0.08,), mass_max=(100,), sampler=("inverse",)):
+    """
+    Builds the list of runs of an ensemble: every seed for every combination of the
+    parameters.
+
+    Parameters:
+    ----------
+    seeds : iterable of int
+        Seeds of the runs.
+    N_p : int or iterable of int
+        Number(s) of stars per run.
+    mass_min, mass_max : float or iterable of float
+        Mass limits (in units of Msun).
+    sampler : str or iterable of str
+        IMF sampling method(s).
+
+    Returns:
+    -------
+    list of dict
+        One dict per run with keys 'seed', 'N_p', 'mass_min', 'mass_max' and 'sampler'.
+    """
+    def as_tuple(value):
+        return (value,) if np.isscalar(value) else tuple(value)
+
+    runs = []
+    for n, lo, hi, method in itertools.product(as_tuple(N_p), as_tuple(mass_min), as_tuple(mass_max),
+                                               as_tuple(sampler)):
+        for seed in seeds:
+            runs.append({"seed": int(seed), "N_p": int(n), "mass_min": float(lo), "mass_max": float(hi),
+                         "sampler": method})
+    return runs
+
+
+def run_member(run, catalog_dir=None, output="npy"):
+    """
+    Runs one member of the ensemble in the current process and returns its
+    aggregates. The work arrays of the process are reused between members.
+
+    Parameters:
+    ----------
+    run : dict
+        Parameters of the run (see expand_grid).
+    catalog_dir : str, optional
+        If given, the full catalog of the run is also written in this folder.
+    output : str
+        Catalog format when catalog_dir is given.
+
+    Returns:
+    -------
+    tuple
+        (run, CatalogAggregates of the run)
+    """
+    if "buffers" not in _WORKER_BUFFERS:
+        _WORKER_BUFFERS["buffers"] = make_block_buffers()
+    buffers = _WORKER_BUFFERS["buffers"]
+
+    aggregates = CatalogAggregates(run["mass_min"], run["mass_max"])
+    writer = None
+    if catalog_dir is not None:
+        name = f"MC_Catalog_N{run['N_p']}_m{run['mass_min']:g}-{run['mass_max']:g}_{run['sampler']}_seed{run['seed']}"
+        writer = open_catalog_writer(output, os.path.join(catalog_dir, name + ("" if output == "npy" else f".{output}")),
+                                     metadata=run, columns=catalog_columns(run["sampler"]))
+    try:
+        for block, n in enumerate(block_sizes(run["N_p"])):
+            chunk = generate_block(n, block_rng(run["seed"], block), run["mass_min"], run["mass_max"],
+                                   run["sampler"], buffers=buffers)
+            aggregates.update(chunk)
+            if writer is not None:
+                writer.write(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return run, aggregates
+
+
+def _run_member(args):
+    return run_member(*args)
+
+
+def _interval(values, confidence):
+    """
+    Mean, standard deviation and normal confidence interval of the mean over runs
+    (axis 0), ignoring NaN.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = np.sum(~np.isnan(values), axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nanmean(values, axis=0) if values.size else np.nan
+        std = np.nanstd(values, axis=0, ddof=1) if len(values) > 1 else np.zeros_like(mean)
+        half = NormalDist().inv_cdf(0.5 + confidence / 2) * std / np.sqrt(n)
+    return {"mean": mean, "std": std, "ci_low": mean - half, "ci_high": mean + half}
+
+
+def _band(histograms, confidence):
+    """
+    Per-bin median and central `confidence` band of normalized histograms over runs.
+    """
+    histograms = np.asarray(histograms, dtype=np.float64)
+    totals = histograms.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        density = np.where(totals > 0, histograms / totals, np.nan)
+    low, median, high = np.nanpercentile(density, [50 * (1 - confidence), 50, 50 * (1 + confidence)], axis=0)
+    return {"low": low, "median": median, "high": high}
+
+
+def summarize(members, confidence=0.95):
+    """
+    Merges the aggregates of the runs that share the same parameters (all but the
+    seed) into summary statistics with confidence intervals.
+
+    Parameters:
+    ----------
+    members : list of tuple
+        (run, CatalogAggregates) pairs returned by run_member.
+    confidence : float
+        Confidence level of the intervals and histogram bands.
+
+    Returns:
+    -------
+    list of dict
+        For each parameter set: 'params', 'seeds', 'n_runs', the pooled 'aggregates'
+        (CatalogAggregates of all runs), and mean/std/confidence interval over runs
+        of the class 'fractions', the 'remnant_fractions' and the 'mean_final_mass'
+        per class, plus median/low/high bands of the normalized initial mass
+        histogram ('mass_hist_band', with 'edges') and of the per-class histograms
+        ('class_mass_hist_band', with 'edges').
+    """
+    groups = {}
+    for run, aggregates in members:
+        key = tuple(sorted((k, v) for k, v in run.items() if k != "seed"))
+        groups.setdefault(key, []).append((run["seed"], aggregates))
+
+    summaries = []
+    for key, group in groups.items():
+        seeds = [seed for seed, _ in group]
+        runs = [aggregates for _, aggregates in group]
+        pooled = CatalogAggregates(runs[0].mass_min, runs[0].mass_max)
+        for aggregates in runs:
+            pooled.merge(aggregates)
+
+        summaries.append({
+            "params": dict(key),
+            "seeds": seeds,
+            "n_runs": len(runs),
+            "aggregates": pooled,
+            "fractions": _interval([a.fractions() for a in runs], confidence),
+            "remnant_fractions": _interval([a.remnant_fractions() for a in runs], confidence),
+            "mean_final_mass": _interval([a.mean_final_mass() for a in runs], confidence),
+            "mass_hist_band": dict(_band([a.mass_counts for a in runs], confidence), edges=pooled.mass_edges),
+            "class_mass_hist_band": dict(_band([a.class_mass_counts for a in runs], confidence),
+                                         edges=pooled.class_mass_edges),
+        })
+    return summaries
+
+
+def run_ensemble(runs, workers=1, confidence=0.95, catalog_dir=None, output="npy"):
+    """
+    Runs an ensemble of simulations (e.g. many seeds and parameter sets) on a pool of
+    worker processes and returns the merged summary statistics. Only the aggregates
+    of each run are kept; full catalogs are written only when catalog_dir is given.
+
+    Parameters:
+    ----------
+    runs : list of dict
+        Runs to execute (see expand_grid).
+    workers : int
+        Number of worker processes (runs are distributed over them; each run is
+        generated in a single process).
+    confidence : float
+        Confidence level of the intervals and histogram bands.
+    catalog_dir : str, optional
+        Folder where the full catalog of every run is persisted.
+    output : str
+        Catalog format ("npy", "csv" or "parquet") when catalog_dir is given.
+
+    Returns:
+    -------
+    list of dict
+        Summary of every parameter set (see summarize).
+    """
+    if catalog_dir is not None:
+        os.makedirs(catalog_dir, exist_ok=True)
+    tasks = [(run, catalog_dir, output) for run in runs]
+    if workers <= 1:
+        members = [_run_member(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            members = list(executor.map(_run_member, tasks))
+    return summarize(members, confidence)
+
+
+def summary_to_dict(summary):
+    """
+    JSON-serializable version of a summary returned by run_ensemble.
+    """
+    def convert(value):
+        if isinstance(value, CatalogAggregates):
+            return value.to_dict()
+        if isinstance(value, dict):
+            return {k: convert(v) for k, v in value.items()}
+        if isinstance(value, np.ndarray):
+            return np.where(np.isnan(value), None, value).tolist() if value.dtype.kind == "f" else value.tolist()
+        if isinstance(value, float) and np.isnan(value):
+            return None
+        return value
+    return convert(summary)
+
+
+def parse_seeds(text):
+    """
+    Parses seeds given as '1-20' or '1,5,9'.
+    """
+    seeds = []
+    for part in text.split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            seeds.extend(range(int(first), int(last) + 1))
+        else:
+            seeds.append(int(part))
+    return seeds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an ensemble of MC_StarGen simulations and merge their statistics.")
+    parser.add_argument("n_stars", type=float, nargs="+", help="number(s) of stars per run")
+    parser.add_argument("--seeds", type=parse_seeds, default=list(range(10)), help="seeds, e.g. 1-20 or 1,5,9")
+    parser.add_argument("--mass-min", type=float, nargs="+", default=[0.08], help="minimum mass(es) [Msun]")
+    parser.add_argument("--mass-max", type=float, nargs="+", default=[100], help="maximum mass(es) [Msun]")
+    parser.add_argument("--sampler", nargs="+", default=["inverse"], choices=["inverse", "rejection", "stratified"])
+    parser.add_argument("-w", "--workers", type=int, default=1, help="worker processes (default: 1)")
+    parser.add_argument("--confidence", type=float, default=0.95, help="confidence level (default: 0.95)")
+    parser.add_argument("--catalog-dir", help="persist the full catalog of every run in this folder")
+    parser.add_argument("-f", "--format", choices=["csv", "npy", "parquet"], default="npy",
+                        help="format of the persisted catalogs (default: npy)")
+    parser.add_argument("-o", "--output", default="MC_Ensemble.json", help="summary JSON file")
+    args = parser.parse_args(argv)
+
+    runs = expand_grid(args.seeds, [int(n) for n in args.n_stars], args.mass_min, args.mass_max, args.sampler)
+    summaries = run_ensemble(runs, args.workers, args.confidence, args.catalog_dir, args.format)
+
+    for summary in summaries:
+        fractions = summary["fractions"]
+        print(f"{summary['params']} ({summary['n_runs']} runs)")
+        for i, name in enumerate(CLASS_NAMES):
+            print(f"  {name:14s} fraction {fractions['mean'][i]:.5f} "
+                  f"[{fractions['ci_low'][i]:.5f}, {fractions['ci_high'][i]:.5f}]  "
+                  f"mean final mass {summary['mean_final_mass']['mean'][i]:.4f}")
+    with open(args.output, "w") as f:
+        json.dump([summary_to_dict(summary) for summary in summaries], f)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
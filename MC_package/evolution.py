@@ -0,0 +1,301 @@
+import argparse
+import json
+import time
+import numpy as np
+from aggregates import CLASS_NAMES, GALAXY_AGE
+from data_generator import generate_star_mass_data, generate_stratified_mass_data, generate_times, main_sequence_time
+from pipeline import BLOCK_SIZE, block_rng, block_sizes
+from utils import remnant_classifier, remnant_mass
+
+
+def _remnant_rng(seed, block):
+    """
+    Random generator of the final masses of one block of stars in turn-off order,
+    independent of the generation streams of block_rng.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(block, 1)))
+
+
+def draw_population(N_p, seed, mass_min=0.08, mass_max=100, sampler="inverse", sfh=None):
+    """
+    Draws the initial masses and birth times of a run, with the random streams of the
+    pipeline: for a given seed the stars are those of main.main.
+
+    Parameters:
+    ----------
+    N_p : int
+        Number of stars to generate (IMF trials for rejection sampling).
+    seed : int
+        Custom seed to the random numbers.
+    mass_min : float
+        Minimum stellar mass (in units of Msun).
+    mass_max : float
+        Maximum stellar mass (in units of Msun).
+    sampler : str
+        IMF sampling method, "inverse", "rejection" or "stratified".
+    sfh : sfh.StarFormationHistory, optional
+        Star formation history of the birth times (default: constant SFR).
+
+    Returns:
+    -------
+    tuple
+        - masses : np.ndarray
+            Initial masses (in units of Msun).
+        - born_times : np.ndarray
+            Birth times (in Myr).
+        - weights : np.ndarray or None
+            Star weights of the stratified sampler.
+    """
+    masses, born_times, weights = [], [], []
+    for block, n in enumerate(block_sizes(N_p)):
+        rng = block_rng(seed, block)
+        if sampler == "stratified":
+            block_masses, _, block_weights = generate_stratified_mass_data(mass_min, mass_max, n, rng=rng)
+            weights.append(block_weights)
+        else:
+            block_masses, _ = generate_star_mass_data(mass_min, mass_max, n, method=sampler, rng=rng)
+        masses.append(block_masses)
+        born_times.append(generate_times(block_masses, rng=rng, sfh=sfh)[0])
+    if not masses:
+        return np.empty(0), np.empty(0), (np.empty(0) if sampler == "stratified" else None)
+    return np.concatenate(masses), np.concatenate(born_times), (np.concatenate(weights) if weights else None)
+
+
+class PopulationEvolution:
+    """
+    Stellar population drawn once and followed through a series of galaxy ages
+    (epochs), without redrawing it.
+
+    A star exists from its birth time and leaves the main sequence at its turn-off
+    time, birth time + t_MS; its remnant class and final mass only depend on its
+    initial mass. The stars are sorted once by birth time and by turn-off time, so
+    between two epochs only the stars born or turned off in between are visited, and
+    the counts at an epoch are found by binary search. The final masses are computed
+    lazily, for the blocks of BLOCK_SIZE stars (in turn-off order) reached by the
+    latest epoch, each with its own random stream: they do not depend on the list of
+    epochs.
+
+    Parameters
+    ----------
+    masses : array-like
+        Initial masses (in units of Msun).
+    born_times : array-like
+        Birth times (in Myr).
+    seed : int
+        Seed of the random streams of the final masses.
+    weights : array-like, optional
+        Statistical weight of every star (stratified sampling).
+    """
+
+    def __init__(self, masses, born_times, seed=0, weights=None):
+        self.masses = np.asarray(masses, dtype=np.float64)
+        self.born_times = np.asarray(born_times, dtype=np.float64)
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.float64)
+        self.seed = seed
+
+        self.birth_order = np.argsort(self.born_times)
+        self.sorted_born = self.born_times[self.birth_order]
+
+        turnoff = self.born_times + main_sequence_time(self.masses)
+        self.death_order = np.argsort(turnoff)
+        self.sorted_turnoff = turnoff[self.death_order]
+        # Stars in turn-off order: initial mass, class once out of the MS, final mass
+        self._dead_masses = self.masses[self.death_order]
+        self.remnant_class = remnant_classifier(self._dead_masses, np.ones(len(self)))
+        self.final_mass = np.full(len(self), np.nan)
+        self._n_final = 0
+
+    @classmethod
+    def generate(cls, N_p, seed, mass_min=0.08, mass_max=100, sampler="inverse", sfh=None):
+        """
+        Draws the population of a run (see draw_population).
+        """
+        masses, born_times, weights = draw_population(N_p, seed, mass_min, mass_max, sampler, sfh)
+        return cls(masses, born_times, seed, weights)
+
+    def __len__(self):
+        return len(self.masses)
+
+    def n_born(self, age):
+        """
+        Number of stars born at the galaxy age (in Myr).
+        """
+        return int(np.searchsorted(self.sorted_born, age, side="right"))
+
+    def n_dead(self, age):
+        """
+        Number of stars out of the main sequence at the galaxy age, i.e. with
+        t_out_ms = age - born_time - t_MS > 0 as in generate_times.
+        """
+        return int(np.searchsorted(self.sorted_turnoff, age, side="left"))
+
+    def _final_masses(self, n_dead):
+        """
+        Computes the final masses of the first n_dead stars in turn-off order, one
+        whole block at a time.
+        """
+        while self._n_final < n_dead:
+            block = self._n_final // BLOCK_SIZE
+            stars = slice(block * BLOCK_SIZE, min((block + 1) * BLOCK_SIZE, len(self)))
+            self.final_mass[stars] = remnant_mass(self._dead_masses[stars], self.remnant_class[stars],
+                                                  rng=_remnant_rng(self.seed, block))
+            self._n_final = stars.stop
+
+    def evolve(self, ages):
+        """
+        Follows the population through the epochs, in increasing order. Each epoch
+        only visits the stars born or turned off since the previous one.
+
+        Parameters:
+        ----------
+        ages : iterable of float
+            Galaxy ages (in Myr), sorted before use.
+
+        Yields:
+        ------
+        dict
+            - 'age': galaxy age (Myr).
+            - 'n_born': number of stars born.
+            - 'class_counts': stars of each class (Main Sequence, WD, NS, BH),
+              sums of weights for weighted populations.
+            - 'mass_f_counts', 'mass_f_sum': per-class number of stars with a defined
+              final mass and the sum of their final masses (MS stars keep their
+              initial mass).
+        """
+        n_classes = len(CLASS_NAMES)
+        n_born = n_dead = 0
+        born_weight = born_mass = dead_mass = 0.0
+        dead_counts = np.zeros(n_classes)
+        mass_f_counts, mass_f_sum = np.zeros(n_classes), np.zeros(n_classes)
+
+        for age in sorted(ages):
+            new_born, new_dead = self.n_born(age), self.n_dead(age)
+
+            births = self.birth_order[n_born:new_born]
+            w = np.ones(len(births)) if self.weights is None else self.weights[births]
+            born_weight += w.sum()
+            born_mass += w @ self.masses[births]
+
+            # Stars leaving the main sequence since the previous epoch
+            self._final_masses(new_dead)
+            deaths = slice(n_dead, new_dead)
+            classes, final = self.remnant_class[deaths], self.final_mass[deaths]
+            w = np.ones(len(classes)) if self.weights is None else self.weights[self.death_order[deaths]]
+            dead_counts += np.bincount(classes, weights=w, minlength=n_classes)
+            dead_mass += w @ self._dead_masses[deaths]
+            defined = ~np.isnan(final)
+            mass_f_counts += np.bincount(classes[defined], weights=w[defined], minlength=n_classes)
+            mass_f_sum += np.bincount(classes[defined], weights=w[defined] * final[defined], minlength=n_classes)
+            n_born, n_dead = new_born, new_dead
+
+            alive = born_weight - dead_counts.sum()
+            class_counts = dead_counts.copy()
+            class_counts[0] += alive
+            state_counts, state_sum = mass_f_counts.copy(), mass_f_sum.copy()
+            state_counts[0] += alive
+            state_sum[0] += born_mass - dead_mass
+            yield {"age": age, "n_born": n_born, "class_counts": class_counts,
+                   "mass_f_counts": state_counts, "mass_f_sum": state_sum}
+
+    def time_series(self, ages):
+        """
+        Class fractions and mean final masses at every epoch.
+
+        Parameters:
+        ----------
+        ages : iterable of float
+            Galaxy ages (in Myr).
+
+        Returns:
+        -------
+        dict
+            Arrays with one row per epoch, in increasing age order: 'ages',
+            'n_born', 'class_counts', 'fractions' (Main Sequence, WD, NS, BH),
+            'remnant_fractions' (WD, NS, BH among the remnants) and
+            'mean_final_mass' (NaN for empty classes).
+        """
+        states = list(self.evolve(ages))
+        counts = np.array([state["class_counts"] for state in states]).reshape(-1, len(CLASS_NAMES))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_final_mass = (np.array([state["mass_f_sum"] for state in states]) /
+                               np.array([state["mass_f_counts"] for state in states])).reshape(counts.shape)
+        return {
+            "ages": np.array([state["age"] for state in states], dtype=np.float64),
+            "n_born": np.array([state["n_born"] for state in states], dtype=np.int64),
+            "class_counts": counts,
+            "fractions": counts / np.maximum(counts.sum(axis=1, keepdims=True), 1),
+            "remnant_fractions": counts[:, 1:] / np.maximum(counts[:, 1:].sum(axis=1, keepdims=True), 1),
+            "mean_final_mass": mean_final_mass,
+        }
+
+    def snapshot(self, age=GALAXY_AGE):
+        """
+        Catalog of the stars born at a galaxy age, as generated by the pipeline for
+        that age ('Mass_i', 'Age', 'Object', 'Mass_f', 'Born_time', plus 'Weight'
+        for weighted populations), in birth order.
+        """
+        n_dead = self.n_dead(age)
+        self._final_masses(n_dead)
+        dead = np.arange(len(self)) < n_dead
+        objects = np.empty(len(self), dtype=np.uint8)
+        objects[self.death_order] = np.where(dead, self.remnant_class, 0)
+        final_mass = np.empty(len(self))
+        final_mass[self.death_order] = np.where(dead, self.final_mass, self._dead_masses)
+
+        born = self.birth_order[:self.n_born(age)]
+        catalog = {
+            "Mass_i": self.masses[born],
+            "Age": age - self.born_times[born],
+            "Object": objects[born],
+            "Mass_f": final_mass[born],
+            "Born_time": self.born_times[born],
+        }
+        if self.weights is not None:
+            catalog["Weight"] = self.weights[born]
+        return catalog
+
+
+def parse_ages(text):
+    """
+    Parses a list of galaxy ages: "1000,5000,13600" or "START:STOP:NUM" (NUM evenly
+    spaced ages, both ends included).
+    """
+    if text.count(":") == 2:
+        start, stop, num = text.split(":")
+        return list(np.linspace(float(start), float(stop), int(num)))
+    return [float(age) for age in text.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evolve one MC_StarGen population through a series of galaxy ages.")
+    parser.add_argument("n_stars", type=int, help="number of stars (IMF trials with --sampler rejection)")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="seed of the random numbers (default: 0)")
+    parser.add_argument("--ages", type=parse_ages, default=parse_ages(f"100:{GALAXY_AGE}:100"),
+                        help=f"galaxy ages in Myr, START:STOP:NUM or a comma list (default: 100:{GALAXY_AGE}:100)")
+    parser.add_argument("--sampler", choices=["inverse", "rejection", "stratified"], default="inverse",
+                        help="IMF sampling method (default: inverse)")
+    parser.add_argument("--sfh", default="constant", metavar="SPEC", help="star formation history (see main.py)")
+    parser.add_argument("-o", "--output", default="MC_Evolution.json", help="time series JSON file")
+    args = parser.parse_args(argv)
+
+    from sfh import parse_sfh
+    start = time.perf_counter()
+    population = PopulationEvolution.generate(args.n_stars, args.seed, sampler=args.sampler,
+                                              sfh=None if args.sfh == "constant" else parse_sfh(args.sfh))
+    drawn = time.perf_counter()
+    series = population.time_series(args.ages)
+    evolved = time.perf_counter()
+
+    print(f"{len(population)} stars drawn and sorted in {drawn - start:.3f} s, "
+          f"{len(series['ages'])} epochs evolved in {evolved - drawn:.3f} s")
+    for age, fractions in zip(series["ages"][::max(1, len(series["ages"]) // 10)],
+                              series["fractions"][::max(1, len(series["ages"]) // 10)]):
+        print(f"  {age:8.1f} Myr  " + "  ".join(f"{name} {f:.5f}" for name, f in zip(CLASS_NAMES, fractions)))
+    with open(args.output, "w") as f:
+        json.dump({key: np.where(np.isnan(value), None, value).tolist() if value.dtype.kind == "f" else value.tolist()
+                   for key, value in series.items()}, f)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
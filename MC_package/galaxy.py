@@ -0,0 +1,168 @@
+import numpy as np
+
+# Galactocentric frame (kpc): Galactic center at the origin, disk in the x-y plane and
+# the Sun on the -x axis, slightly above the plane (Bland-Hawthorn & Gerhard 2016)
+R_SUN = 8.2
+Z_SUN = 0.025
+SUN = np.array([-R_SUN, 0.0, Z_SUN])
+
+# Columns added to the catalog by the placement stage (galactocentric, kpc)
+POSITION_COLUMNS = ("X", "Y", "Z")
+
+# Uniform draws per star: component, radius, azimuth and height (or polar angle)
+POSITION_DRAWS = 4
+
+# Points of the inverse radial cumulative tables of the disks (uniform in quantile)
+RADIAL_GRID_SIZE = 2**14 + 1
+
+# Default Milky Way model: stellar mass fractions of the components, scale lengths and
+# heights of the exponential disks and scale radius and axis ratio of the Hernquist
+# bulge (kpc), and truncation radius of all components
+DEFAULT_GALAXY = {
+    "thin_fraction": 0.75, "thin_length": 2.6, "thin_height": 0.3,
+    "thick_fraction": 0.08, "thick_length": 2.0, "thick_height": 0.9,
+    "bulge_fraction": 0.17, "bulge_scale": 0.5, "bulge_q": 0.5,
+    "radius": 25.0,
+}
+
+
+class GalaxyModel:
+    """
+    Stellar density model of the Milky Way used to place the stars: a thin and a
+    thick exponential disk, rho ~ exp(-R / length - |z| / height), and a flattened
+    Hernquist bulge, rho ~ 1 / (r (r + scale)^3) with z scaled by q, all truncated at
+    `radius` from the Galactic center.
+
+    Every star is placed from POSITION_DRAWS uniform draws (place): one chooses the
+    component by its mass fraction and the others are inverted analytically (bulge
+    radius, heights, angles) or through a cumulative table (disk radii), so the
+    stage is a few vectorized passes over the stars.
+
+    Parameters
+    ----------
+    **params : float
+        Overrides of the DEFAULT_GALAXY parameters, e.g. thin_length=3.0 or
+        bulge_fraction=0 (the fractions are normalized).
+    """
+
+    def __init__(self, **params):
+        unknown = set(params) - set(DEFAULT_GALAXY)
+        if unknown:
+            raise ValueError(f"Unknown galaxy parameters: {', '.join(sorted(unknown))} "
+                             f"(use {', '.join(DEFAULT_GALAXY)})")
+        self.params = dict(DEFAULT_GALAXY, **{name: float(value) for name, value in params.items()})
+        p = self.params
+        fractions = np.array([p["thin_fraction"], p["thick_fraction"], p["bulge_fraction"]])
+        if np.any(fractions < 0) or fractions.sum() <= 0:
+            raise ValueError("The component fractions must be non-negative and not all zero.")
+        scales = [p["thin_length"], p["thin_height"], p["thick_length"], p["thick_height"], p["bulge_scale"],
+                  p["bulge_q"], p["radius"]]
+        if min(scales) <= 0:
+            raise ValueError("The scale lengths, heights, bulge scale, q and radius must be positive.")
+        # Upper limits of the quantiles of the thin disk, thick disk and bulge
+        self._cumulative = np.cumsum(fractions / fractions.sum())[:-1]
+
+        # Inverse radial cumulative tables of the disks on a uniform quantile grid (a
+        # draw falls in its cell without search). The surface density is
+        # exp(-R / length), so the radii follow R exp(-R / length) up to the
+        # truncation radius; the cumulative is inverted on a finer radius grid
+        radii = np.linspace(0, p["radius"], 4 * RADIAL_GRID_SIZE)
+        quantiles = np.linspace(0, 1, RADIAL_GRID_SIZE)
+        self._disk_radii = []
+        for length in (p["thin_length"], p["thick_length"]):
+            x = radii / length
+            cdf = -np.expm1(-x) - x * np.exp(-x)
+            self._disk_radii.append(np.interp(quantiles, cdf / cdf[-1], radii))
+        # Hernquist enclosed mass fraction (r / (r + a))^2 at the truncation radius
+        self._bulge_edge = p["radius"] / (p["radius"] + p["bulge_scale"])
+
+    @property
+    def name(self):
+        """
+        Description of the model (stored in the run metadata): "default" or the
+        parameters that differ from DEFAULT_GALAXY.
+        """
+        changed = [f"{name}={value:g}" for name, value in self.params.items() if value != DEFAULT_GALAXY[name]]
+        return ",".join(changed) or "default"
+
+    def __repr__(self):
+        return f"GalaxyModel({self.name!r})"
+
+    def place(self, uniforms):
+        """
+        Galactocentric positions of the stars from their uniform draws.
+
+        Parameters:
+        ----------
+        uniforms : array-like
+            (POSITION_DRAWS, n) uniform draws in [0, 1), one column per star:
+            component, radius, azimuth and height (or polar angle of the bulge).
+
+        Returns:
+        -------
+        tuple
+            x, y, z positions (in kpc) of the n stars.
+        """
+        u_component, u_radius, u_phi, u_height = np.asarray(uniforms, dtype=np.float64)
+        p = self.params
+        component = np.searchsorted(self._cumulative, u_component, side="right")
+        radius = np.empty(len(u_component))
+        z = np.empty(len(u_component))
+
+        for i, name in enumerate(("thin", "thick")):
+            stars = np.flatnonzero(component == i)
+            cell = u_radius[stars] * (RADIAL_GRID_SIZE - 1)
+            j = cell.astype(np.intp)
+            table = self._disk_radii[i]
+            radius[stars] = table[j] + (cell - j) * (table[j + 1] - table[j])
+            # Laplace distribution of z, from a draw moved off 0 so that |w| < 1
+            w = 2 * u_height[stars] - 1 + 2.0**-53
+            z[stars] = -np.sign(w) * p[f"{name}_height"] * np.log1p(-np.abs(w))
+
+        stars = np.flatnonzero(component == 2)
+        # Inverse of the Hernquist enclosed mass, (r / (r + a))^2 = u
+        s = np.sqrt(u_radius[stars]) * self._bulge_edge
+        r = p["bulge_scale"] * s / (1 - s)
+        cos_theta = 2 * u_height[stars] - 1
+        radius[stars] = r * np.sqrt(1 - cos_theta**2)
+        z[stars] = p["bulge_q"] * r * cos_theta
+
+        phi = 2 * np.pi * u_phi
+        return radius * np.cos(phi), radius * np.sin(phi), z
+
+
+def parse_galaxy(spec):
+    """
+    Builds a GalaxyModel from a command line specification: "default", or
+    comma-separated overrides of DEFAULT_GALAXY such as
+    "thin_length=3,bulge_fraction=0.2".
+    """
+    if spec in (None, "", "default"):
+        return GalaxyModel()
+    try:
+        params = dict(item.split("=") for item in spec.split(","))
+        return GalaxyModel(**{name.strip(): float(value) for name, value in params.items()})
+    except ValueError as error:
+        raise ValueError(f"Invalid galaxy specification: {spec!r} ({error})") from error
+
+
+def sky_direction(l, b):
+    """
+    Unit vector(s) of the galactocentric frame pointing to the Galactic longitude l
+    and latitude b (in degrees) as seen from the Sun (l = 0 towards the Galactic
+    center; the small tilt of the plane due to Z_SUN is neglected).
+    """
+    l, b = np.radians(l), np.radians(b)
+    return np.stack((np.cos(b) * np.cos(l), np.cos(b) * np.sin(l), np.sin(b)), axis=-1)
+
+
+def galactic_coordinates(x, y, z):
+    """
+    Heliocentric distance (kpc), Galactic longitude l in [0, 360) and latitude b
+    (degrees) of galactocentric positions (see sky_direction).
+    """
+    dx, dy, dz = np.asarray(x) - SUN[0], np.asarray(y) - SUN[1], np.asarray(z) - SUN[2]
+    distance = np.sqrt(dx**2 + dy**2 + dz**2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        b = np.degrees(np.arcsin(dz / distance))
+    return distance, np.degrees(np.arctan2(dy, dx)) % 360, b
@@ -0,0 +1,174 @@
+import cProfile
+import io
+import json
+import pstats
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+
+def _peak_rss_kb():
+    """
+    High-water marks of the resident set size (in kB) of this process and of the
+    largest of its finished children, over their lifetime.
+    """
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+class Instrumentation:
+    """
+    Records wall time, CPU time and memory of every stage of a run, plus run metrics
+    (acceptance rate, star counts per class...).
+
+    Stages with the same name are accumulated (e.g. the IMF sampling of every block).
+    The report can be written to JSON or passed to a callback.
+
+    The resident memory of a stage is reported as 'rss_growth_kb', how much the stage
+    raised the peak RSS of its process (summed over its calls), and
+    'process_peak_rss_kb' / 'children_peak_rss_kb', the peak RSS of the process and
+    of its largest finished child when the stage ended (lifetime high-water marks,
+    not specific to the stage).
+
+    Parameters
+    ----------
+    trace_memory : bool
+        Also record the peak of the memory traced by tracemalloc during each stage
+        (slows the run down).
+    profile_stage : str, optional
+        Name of a stage to capture with cProfile (only in the calling process).
+    callback : callable, optional
+        Called with the report dict by emit().
+    """
+
+    def __init__(self, trace_memory=False, profile_stage=None, callback=None):
+        self.trace_memory = trace_memory
+        self.profile_stage = profile_stage
+        self.callback = callback
+        self.stages = {}
+        self.metrics = {}
+        self._profiler = cProfile.Profile() if profile_stage else None
+        # Open stages: [peak traced memory seen so far]
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager timing one execution of a stage.
+        """
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if self._stack:
+                # Keep the peak of the enclosing stage before resetting it for this one
+                self._stack[-1] = max(self._stack[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._stack.append(0)
+        profile = self._profiler is not None and name == self.profile_stage
+        if profile:
+            self._profiler.enable()
+
+        rss_before = _peak_rss_kb()[0]
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            if profile:
+                self._profiler.disable()
+            peak = self._stack.pop()
+            if self.trace_memory:
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                if self._stack:
+                    self._stack[-1] = max(self._stack[-1], peak)
+            rss, children_rss = _peak_rss_kb()
+            self._add(name, {"calls": 1, "wall_s": wall, "cpu_s": cpu, "peak_traced_bytes": peak,
+                             "rss_growth_kb": rss - rss_before, "process_peak_rss_kb": rss,
+                             "children_peak_rss_kb": children_rss})
+
+    def _add(self, name, record):
+        entry = self.stages.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_traced_bytes": 0,
+                                              "rss_growth_kb": 0, "process_peak_rss_kb": 0,
+                                              "children_peak_rss_kb": 0})
+        for key in ("calls", "wall_s", "cpu_s", "rss_growth_kb"):
+            entry[key] += record[key]
+        for key in ("peak_traced_bytes", "process_peak_rss_kb", "children_peak_rss_kb"):
+            entry[key] = max(entry[key], record[key])
+
+    def merge(self, stages):
+        """
+        Adds the stage records of another Instrumentation (e.g. from a worker process).
+        """
+        for name, record in stages.items():
+            self._add(name, record)
+
+    def record(self, name, value):
+        """
+        Stores a run metric (must be JSON-serializable).
+        """
+        self.metrics[name] = value
+
+    def report(self):
+        """
+        Report of the run: {"stages": {...}, "metrics": {...}}.
+        """
+        return {"stages": self.stages, "metrics": self.metrics}
+
+    def to_json(self, path=None):
+        """
+        Returns the report as JSON, and writes it to path if given.
+        """
+        text = json.dumps(self.report(), indent=2)
+        if path:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def emit(self):
+        """
+        Passes the report to the callback, if any.
+        """
+        if self.callback is not None:
+            self.callback(self.report())
+
+    def profile_stats(self, sort="cumulative", limit=25):
+        """
+        Text summary of the cProfile capture of profile_stage.
+        """
+        if self._profiler is None:
+            return ""
+        out = io.StringIO()
+        pstats.Stats(self._profiler, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def dump_profile(self, path):
+        """
+        Saves the cProfile capture (readable with pstats or snakeviz).
+        """
+        if self._profiler is not None:
+            self._profiler.dump_stats(path)
+
+
+class NullInstrumentation:
+    """
+    Disabled instrumentation: every call is a no-op, so the pipeline pays only one
+    attribute lookup and an empty context manager per stage.
+    """
+
+    _context = nullcontext()
+
+    def stage(self, name):
+        return self._context
+
+    def merge(self, stages):
+        pass
+
+    def record(self, name, value):
+        pass
+
+    def emit(self):
+        pass
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
@@ -1,11 +1,46 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
+import os
 import time
-from data_generator import generate_star_mass_data, generate_times
-from utils import remnant_classifier, remnant_mass
-from plots import plot_mass, plot_born_times_histogram, plot_mass_histogram, plot_mass_histogram_per_remnant,plot_mass_vs_age,pie_plot,pie_plot_remnant
-def main(N_p,Xseed,plots):
+
+
+def _process_age():
+    """
+    Seconds since the process was created, from /proc (Linux, 10 ms resolution), or
+    None where /proc is not available.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # starttime (field 22, clock ticks after boot); the name field may hold spaces
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+# References of the cold-start time: interpreter startup (process creation to here)
+# and import of the pipeline (from here to the start of the run)
+_INTERPRETER_STARTUP = _process_age()
+_IMPORT_START = time.perf_counter()
+
+import argparse
+import numpy as np
+from aggregates import CLASS_NAMES, CatalogAggregates
+from pipeline import (BLOCK_SIZE, WEIGHTED_SAMPLERS, allocate_catalog, catalog_columns, catalog_layout,
+                      catalog_nbytes, fill_catalog, iter_catalog_chunks, run_aggregates)
+from catalog_io import BackgroundWriter, catalog_path, export_csv, open_catalog_writer, read_catalog
+from cache import ResultCache, cache_key
+from sfh import parse_sfh
+from galaxy import parse_galaxy
+from instrumentation import NULL_INSTRUMENTATION, Instrumentation
+from render import (aggregate_arrays, aggregate_plot_tasks, catalog_plot_tasks, release_shared_buffer, render_plots,
+                    shared_buffer)
+
+# matplotlib/seaborn (through render -> plots) and pandas are imported only when plots
+# or a DataFrame are actually produced.
+
+
+def main(N_p,Xseed,plots,sampler="inverse",chunk_size=None,workers=1,output="csv",csv_export=False,aggregate_only=False,plot_workers=None,instrument=None,cache=None,compact=False,sfh=None,compression=None,write_queue=2,rng_mode="block",galaxy=None):
     """
     Main function to generate a stellar catalog based on the Kroupa IMF and produce optional plots.
 
@@ -22,95 +57,351 @@ def main(N_p,Xseed,plots):
       - Ini. mass vs age
       - Pie plot
       - Pie plot for remnant
-    6. Save the generated catalog as a CSV file.
+    6. Save the generated catalog as a CSV file, or in a binary columnar format
+       (npy columns or Parquet) with an optional CSV export.
 
     Parameters:
     ----------
     N_p : int
-        Number of stars to simulate before applying the Kroupa IMF filter.
+        Number of stars to generate (or to simulate before applying the Kroupa IMF
+        filter when sampler="rejection").
     Xseed: int
         Custom seed to the randoms numbers
     plots : bool
         Whether to generate and save additional plots (True/False).
+    sampler : str
+        IMF sampling method: "inverse" (exactly N_p stars), "rejection"
+        (N_p trials filtered by the IMF) or "stratified" (N_p stars with the NS and
+        BH mass ranges oversampled; every star gets a statistical 'Weight' column
+        and the histograms, fractions and plots are weighted).
+    chunk_size : int, optional
+        If given, the catalog is generated and appended to the CSV file one chunk
+        of this many stars at a time, keeping peak memory flat. The catalog for a
+        given seed does not depend on the chunk size. Plots are not available in
+        this mode.
+    workers : int
+        Number of processes generating the catalog in parallel. The catalog for a
+        given seed is bit-identical for any number of workers.
+    output : str
+        Catalog format: "csv" (MC_Catalog.csv), "npy" (MC_Catalog/ directory of
+        memory-mappable .npy columns with a JSON metadata file) or "parquet"
+        (MC_Catalog.parquet, requires pyarrow).
+    csv_export : bool
+        With a binary output format, also export the catalog to MC_Catalog.csv.
+    aggregate_only : bool
+        Do not build the per-star catalog: only the summary histograms and remnant
+        counters are accumulated block by block (constant memory for any N_p) and
+        saved to MC_Aggregates.npz. Plots are drawn from the aggregates (the two
+        scatter plots need the catalog and are skipped).
+    plot_workers : int, optional
+        Number of processes rendering the plots concurrently (one per plot by
+        default, up to the number of CPUs). The rendering time of every plot is
+        reported.
+    instrument : Instrumentation, optional
+        Records wall/CPU time and memory of every stage (IMF sampling, time
+        generation, classification, remnant mass, aggregation, plotting, I/O) and
+        the run metrics (acceptance rate, stars per class). Its report is emitted
+        to its callback at the end of the run.
+    cache : ResultCache, optional
+        On-disk cache of the outputs. The run is identified by a hash of its
+        parameters (N_p, seed, mass limits, sampler, plots, output format) and of the
+        model code version; on a hit the catalog or aggregates and the plots are
+        restored from the cache instead of being computed. The chunk size and the
+        numbers of workers do not change the outputs and are not part of the key.
+    compact : bool
+        Store the masses, ages and weights as float32 instead of float64, in memory
+        and in the binary catalogs (the classes are always uint8 in memory). The
+        stars are the same, rounded to single precision.
+    sfh : sfh.StarFormationHistory, optional
+        Star formation history the birth times are drawn from (see sfh.parse_sfh),
+        e.g. exponentially declining or bursty. Defaults to a constant SFR.
+    compression : str, optional
+        Compression of the catalog: "gzip", "bz2" or "xz" for CSV (written to
+        MC_Catalog.csv.gz...), or a Parquet codec. npy catalogs are not compressed.
+    write_queue : int
+        The catalog is written by a background thread fed through a queue of at
+        most this many chunks, so generation (or plotting) overlaps with the writes
+        and memory stays bounded. 0 writes in the calling thread.
+    rng_mode : str
+        "block" (default): one random generator per block of stars. "counter":
+        counter-based draws keyed by the seed and the star index ("inverse" sampler
+        only), so any slice of the catalog can be regenerated on its own
+        (pipeline.generate_range, catalog.LazyCatalog). The two modes give different
+        (equally distributed) stars.
+    galaxy : galaxy.GalaxyModel, optional
+        Milky Way density model (see galaxy.parse_galaxy): the stars are placed in it
+        and the catalog gets their 'X', 'Y' and 'Z' galactocentric positions (kpc),
+        e.g. for catalog.Catalog.spatial_index queries.
 
     Returns:
     -------
-    pd.DataFrame
-        A DataFrame containing the generated stellar catalog with the following columns:
+    pd.DataFrame, CatalogAggregates or None
+        The aggregates when aggregate_only is set, otherwise a DataFrame (None when
+        chunk_size is given) containing the generated stellar catalog with the following columns:
         - 'Mass_i': Initial stellar mass.
         - 'Age': Stellar age (Myr).
         - 'Object': Type of stellar remnant (e.g., white dwarf, neutron star, black hole).
         - 'Mass_f': Final stellar mass after evolution.
+        - 'Weight': Statistical weight of the star (stratified sampling only).
+        - 'X', 'Y', 'Z': Galactocentric position (kpc, with a galaxy model only).
     """
     start_time = time.time()
-    # Define the seed
-    np.random.seed(Xseed)
+    instr = NULL_INSTRUMENTATION if instrument is None else instrument
     # Define minimum and maximum stellar mass limits
     mass_min, mass_max = 0.08, 100
 
-    # Generate stellar masses and associated probabilities
-    masses, prob_val = generate_star_mass_data(mass_min, mass_max, N_p)
-    print(f"Out of {N_p} initial stars, {len(masses)} satisfy the Kroupa (2001) IMF distribution.")
-
-    # Simulate stellar formation times and calculate lifetimes
-    born_times, t_alive, t_out_ms = generate_times(masses)
-
-    # Classify stars based on masses and remaining main-sequence lifetimes
-    indicators = remnant_classifier(masses, t_out_ms)
-
-    # Compute the final mass of each star after evolution
-    final_mass = remnant_mass(masses, indicators)
-
-    
-
-    # Generate and save plots if requested
-    if plots:
-        plt.figure(figsize=(10, 6))
-        plot_mass(masses, prob_val, mass_min, mass_max)
-        plt.savefig("Plots/mass_distribution_scatter.pdf", format="pdf", dpi=300)
-        plt.close()
-
-        plt.figure(figsize=(10, 6))
-        plot_mass_histogram(masses)
-        plt.savefig("Plots/mass_distribution_histogram.pdf", format="pdf", dpi=300)
-        plt.close()
-
-        plt.figure(figsize=(10, 6))
-        plot_mass_histogram_per_remnant(masses,indicators)
-        plt.savefig("Plots/plot_mass_hist_per_remnant.pdf", format="pdf", dpi=300)
-        plt.close()
-
-        plt.figure(figsize=(10, 6))
-        plot_mass_vs_age(final_mass,t_alive,indicators)
-        plt.savefig("Plots/plot_mass_age.pdf", format="pdf", dpi=300)
-        plt.close()
-
-        plt.figure(figsize=(10, 6))
-        plot_born_times_histogram(born_times)
-        plt.savefig("Plots/Born_time_histogram.pdf", format="pdf", dpi=300)
-        plt.close()
-
-        plt.figure(figsize=(10, 6))
-        pie_plot(indicators)
-        plt.savefig("Plots/Pie_plot.pdf", format="pdf", dpi=300)
-        plt.close()
-
-        plt.figure(figsize=(10, 6))
-        pie_plot_remnant(indicators)
-        plt.savefig("Plots/Pie_plot_remnant.pdf", format="pdf", dpi=300)
-        plt.close()
-
-    # Create a DataFrame for the stellar catalog
-    df = pd.DataFrame({
-        "Mass_i": masses,
-        "Age": t_alive,
-        "Object": indicators,
-        "Mass_f": final_mass
-    })
-
-    # Save the DataFrame to a CSV file
-    df.to_csv("MC_Catalog.csv", index=False)
+    metadata = {"N_p": N_p, "seed": Xseed, "mass_min": mass_min, "mass_max": mass_max, "sampler": sampler,
+                "compact": bool(compact), "sfh": "constant" if sfh is None else sfh.name, "rng_mode": rng_mode,
+                "galaxy": None if galaxy is None else galaxy.name}
+    stats = {}
+    # Without chunk_size, split the run into one shard per worker
+    shard_size = chunk_size or max(BLOCK_SIZE, -(-N_p // workers))
+    columns = catalog_columns(sampler, galaxy)
+
+    if rng_mode == "counter" and sampler != "inverse":
+        raise ValueError("The counter random number mode needs the inverse sampler.")
+    if chunk_size is not None and plots and not aggregate_only:
+        raise ValueError("Plots need the full catalog in memory; run without chunk_size or with aggregate_only.")
+
+    key = None
+    if cache is not None:
+        params = dict(metadata, plots=bool(plots), output=output, csv_export=bool(csv_export),
+                      aggregate_only=bool(aggregate_only), sfh_table=None if sfh is None else sfh.digest(),
+                      compression=compression)
+        key = cache_key(params)
+        with instr.stage("cache"):
+            manifest = cache.get(key)
+        instr.record("cache", "hit" if manifest is not None else "miss")
+        if manifest is not None:
+            print(f"Outputs restored from the cache (key {key[:12]})")
+            finish_run(start_time, instr, manifest["metadata"]["stats"])
+            return load_result(output, aggregate_only, chunk_size, columns, compression, compact)
+
+    if aggregate_only:
+        plot_tasks = aggregate_plot_tasks() if plots else []
+        aggregates = run_aggregates(N_p, Xseed, shard_size, mass_min, mass_max, sampler, stats, workers, instr,
+                                    sfh, rng_mode)
+        report_sampling(N_p, sampler, stats)
+        with instr.stage("io"):
+            aggregates.save("MC_Aggregates.npz")
+        if plots:
+            with instr.stage("plotting"):
+                render_plots(aggregate_arrays(aggregates), plot_tasks, workers=plot_workers)
+        result = aggregates
+    elif chunk_size is not None:
+        plot_tasks = []
+        # Stream every chunk through the pipeline and append it to the catalog
+        chunks = iter_catalog_chunks(N_p, Xseed, shard_size, mass_min, mass_max, sampler, stats, workers, instr,
+                                     sfh, rng_mode, galaxy)
+        # The writer thread writes the previous chunks while the next one is generated
+        writer = open_catalog_writer(output, metadata=metadata, columns=columns, compact=compact,
+                                     compression=compression, background=write_queue)
+        try:
+            for chunk in chunks:
+                with instr.stage("io"):
+                    writer.write(chunk)
+        finally:
+            with instr.stage("io"):
+                writer.close()
+        report_writer(writer, instr)
+        if csv_export and output != "csv":
+            with instr.stage("io"):
+                export_csv(catalog_path(output, compression))
+        report_sampling(N_p, sampler, stats)
+        result = None
+    else:
+        plot_tasks = catalog_plot_tasks(mass_min, mass_max, sampler in WEIGHTED_SAMPLERS) if plots else []
+        # Generate masses, times, remnant types and final masses for all stars, every
+        # stage writing in place into a single preallocated buffer
+        buffer_columns = columns + (("Prob", "Born_time") if plots else ())
+        float_dtype = np.float32 if compact else np.float64
+        # With plot workers, the buffer is a shared file mapping they read without a copy
+        shared = None
+        if plots and plot_workers != 1:
+            shared = shared_buffer(catalog_layout(N_p, buffer_columns, float_dtype)[2])
+        catalog = allocate_catalog(N_p, buffer_columns, float_dtype, shared)
+        catalog = fill_catalog(catalog, N_p, Xseed, mass_min, mass_max, sampler, stats, workers, instr, shard_size,
+                               sfh, rng_mode, galaxy)
+        report_sampling(N_p, sampler, stats)
+        report_memory(catalog, instr)
+
+        # Save the catalog in the requested format, in the background while the plots
+        # are rendered
+        writer = open_catalog_writer(output, metadata=metadata, columns=columns, compact=compact,
+                                     compression=compression, background=write_queue)
+        try:
+            with instr.stage("io"):
+                writer.write(catalog)
+
+            # Generate and save plots if requested
+            if plots:
+                with instr.stage("plotting"):
+                    plot_times = render_plots(catalog, plot_tasks, workers=plot_workers, shared=shared)
+                instr.record("plot_times_s", plot_times)
+        finally:
+            if shared is not None:
+                release_shared_buffer(shared)
+            with instr.stage("io"):
+                writer.close()
+        report_writer(writer, instr)
+
+        with instr.stage("io"):
+            # Create a DataFrame for the stellar catalog
+            import pandas as pd
+            # The DataFrame columns are views of the buffer (no copy)
+            result = pd.DataFrame({column: catalog[column] for column in columns}, copy=False)
+            if csv_export and output != "csv":
+                result.to_csv("MC_Catalog.csv", index=False)
+
+    if cache is not None:
+        paths = ["MC_Aggregates.npz"] if aggregate_only else [catalog_path(output, compression)]
+        if csv_export and output != "csv" and not aggregate_only:
+            paths.append("MC_Catalog.csv")
+        paths.extend(os.path.join("Plots", task[0]) for task in plot_tasks)
+        run_stats = {"n_trials": int(stats.get("n_trials", 0)), "n_stars": int(stats.get("n_stars", 0)),
+                     "class_counts": [int(c) for c in stats.get("class_counts", np.zeros(4, dtype=int))]}
+        with instr.stage("cache"):
+            cache.put(key, paths, params, {"stats": run_stats})
+
+    finish_run(start_time, instr, stats)
+
+    return result
 
+
+def load_result(output, aggregate_only, chunk_size, columns, compression=None, compact=False):
+    """
+    Loads the return value of main from the outputs restored from the cache, with the
+    column types of a fresh run (uint8 'Object', float32 floats if compact) whatever
+    the types stored in the catalog file.
+
+    Parameters:
+    ----------
+    output : str
+        Catalog format of the run.
+    aggregate_only : bool
+        Whether the run only produced aggregates.
+    chunk_size : int or None
+        Chunk size of the run (streamed runs return None).
+    columns : tuple of str
+        Columns of the catalog.
+    compression : str, optional
+        Compression of the catalog.
+    compact : bool
+        Whether the run used float32 floats.
+
+    Returns:
+    -------
+    pd.DataFrame, CatalogAggregates or None
+        Same as main.
+    """
+    if aggregate_only:
+        return CatalogAggregates.load("MC_Aggregates.npz")
+    if chunk_size is not None:
+        return None
+    import pandas as pd
+    dtypes = catalog_layout(0, columns, np.float32 if compact else np.float64)[0]
+    if output == "csv":
+        # The default float parser of read_csv can be off by one ulp
+        return pd.read_csv(catalog_path(output, compression), float_precision="round_trip").astype(dtypes)
+    arrays, _ = read_catalog(catalog_path(output, compression), mmap_mode=None)
+    return pd.DataFrame({column: arrays[column].astype(dtype, copy=False) for column, dtype in dtypes.items()})
+
+
+def finish_run(start_time, instr, stats):
+    """
+    Records the run metrics, emits the instrumentation report and prints the
+    execution time.
+
+    Parameters:
+    ----------
+    start_time : float
+        Start time of the run, as returned by time.time().
+    instr : Instrumentation or NullInstrumentation
+        Instrumentation of the run.
+    stats : dict
+        Sampling statistics accumulated by the pipeline.
+    """
+    n_trials, n_stars = stats.get("n_trials", 0), stats.get("n_stars", 0)
+    instr.record("n_trials", int(n_trials))
+    instr.record("n_stars", int(n_stars))
+    instr.record("acceptance_rate", n_stars / n_trials if n_trials else None)
+    counts = stats.get("class_counts", np.zeros(4, dtype=int))
+    instr.record("class_counts", dict(zip(CLASS_NAMES, (int(c) for c in counts))))
+    instr.record("total_wall_s", time.time() - start_time)
+    instr.emit()
+
+    report_execution_time(start_time)
+
+
+def report_sampling(N_p, sampler, stats):
+    """
+    Prints the number of stars drawn from the IMF and the sampling throughput.
+
+    Parameters:
+    ----------
+    N_p : int
+        Number of requested stars (IMF trials for rejection sampling).
+    sampler : str
+        IMF sampling method, "inverse", "rejection" or "stratified".
+    stats : dict
+        Sampling statistics accumulated by the pipeline ("sampling_time", "n_stars").
+    """
+    n_stars = stats.get("n_stars", 0)
+    if sampler == "rejection":
+        print(f"Out of {N_p} initial stars, {n_stars} satisfy the Kroupa (2001) IMF distribution.")
+    elif sampler == "stratified":
+        print(f"{n_stars} weighted stars sampled from the Kroupa (2001) IMF with oversampled NS/BH mass ranges.")
+    else:
+        print(f"{n_stars} stars sampled from the Kroupa (2001) IMF distribution.")
+    print(f"IMF sampling throughput: {n_stars / max(stats.get('sampling_time', 0.0), 1e-9):.3e} accepted stars/s")
+
+
+def report_writer(writer, instr):
+    """
+    Records the time the background writer spent writing ("writer_busy_s") and the
+    time generation waited for it ("writer_wait_s").
+
+    Parameters:
+    ----------
+    writer : catalog writer
+        Closed writer of the run (nothing is recorded without a background thread).
+    instr : Instrumentation or NullInstrumentation
+        Instrumentation of the run.
+    """
+    if isinstance(writer, BackgroundWriter):
+        instr.record("writer_busy_s", writer.busy_time)
+        instr.record("writer_wait_s", writer.wait_time)
+
+
+def report_memory(catalog, instr):
+    """
+    Prints and records the memory held by the in-memory catalog, in bytes per star.
+
+    Parameters:
+    ----------
+    catalog : dict
+        Columns of the catalog (views of the allocate_catalog buffer).
+    instr : Instrumentation or NullInstrumentation
+        Records "catalog_bytes" and "catalog_bytes_per_star".
+    """
+    n_stars = len(catalog["Mass_i"])
+    nbytes = catalog_nbytes(catalog)
+    instr.record("catalog_bytes", nbytes)
+    instr.record("catalog_bytes_per_star", nbytes / n_stars if n_stars else None)
+    if n_stars:
+        print(f"Catalog memory: {nbytes / 2**20:.1f} MiB ({nbytes / n_stars:.0f} bytes/star, "
+              f"{', '.join(f'{name} {values.dtype}' for name, values in catalog.items())})")
+
+
+def report_execution_time(start_time):
+    """
+    Prints the elapsed time since start_time.
+
+    Parameters:
+    ----------
+    start_time : float
+        Start time of the run, as returned by time.time().
+    """
     elapsed_time = time.time() - start_time
     hours, remainder = divmod(elapsed_time, 3600)
     minutes, seconds = divmod(remainder, 60)
@@ -118,16 +409,105 @@ def main(N_p,Xseed,plots):
 
     print("Execution completed successfully...")
 
-    return df
+
+def parse_args(argv=None):
+    """
+    Parses the command line. Without the number of stars, the parameters are asked
+    interactively as in previous versions.
+
+    Parameters:
+    ----------
+    argv : list of str, optional
+        Command line arguments (defaults to sys.argv[1:]).
+
+    Returns:
+    -------
+    argparse.Namespace
+        Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Monte Carlo generator of stellar populations (Kroupa 2001 IMF).")
+    parser.add_argument("n_stars", type=int, nargs="?",
+                        help="number of stars to generate (IMF trials with --sampler rejection)")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="seed of the random numbers (default: 0)")
+    parser.add_argument("-p", "--plots", action="store_true", help="generate the diagnostic plots in Plots/")
+    parser.add_argument("--sampler", choices=["inverse", "rejection", "stratified"], default="inverse",
+                        help="IMF sampling method (default: inverse)")
+    parser.add_argument("--sfh", default="constant", metavar="SPEC",
+                        help="star formation history: constant, exponential:TAU, delayed:TAU, "
+                             "burst:T/W/A[,T/W/A...][:BASE] or table:PATH (times in Myr, default: constant)")
+    parser.add_argument("--rng", choices=["block", "counter"], default="block",
+                        help="random numbers: one generator per block, or counter-based per star index so any "
+                             "slice can be regenerated alone (inverse sampler only, default: block)")
+    parser.add_argument("--galaxy", nargs="?", const="default", metavar="SPEC",
+                        help="place the stars in the Milky Way (X, Y, Z columns in kpc): default, or overrides "
+                             "such as thin_length=3,bulge_fraction=0.2")
+    parser.add_argument("-f", "--format", choices=["csv", "npy", "parquet"], default="csv",
+                        help="catalog format (default: csv)")
+    parser.add_argument("--csv-export", action="store_true", help="also export binary catalogs to CSV")
+    parser.add_argument("--compression", metavar="CODEC",
+                        help="compress the catalog: gzip, bz2 or xz for csv, a codec (e.g. zstd) for parquet")
+    parser.add_argument("--write-queue", type=int, default=2,
+                        help="chunks queued for the background writer thread, 0 to write synchronously (default: 2)")
+    parser.add_argument("--compact", action="store_true",
+                        help="float32 masses, ages and weights in memory and in binary catalogs")
+    parser.add_argument("-c", "--chunk-size", type=int, default=None,
+                        help="stream the catalog in chunks of this many stars")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="generation processes (default: 1)")
+    parser.add_argument("--plot-workers", type=int, default=None, help="plot rendering processes")
+    parser.add_argument("--aggregate-only", action="store_true",
+                        help="only compute histograms and remnant counts (MC_Aggregates.npz)")
+    parser.add_argument("--profile-json", metavar="PATH",
+                        help="write per-stage timings, memory and run metrics to this JSON file")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="record tracemalloc peaks per stage (with --profile-json)")
+    parser.add_argument("--profile-stage", metavar="STAGE",
+                        help="capture one stage with cProfile (e.g. remnant_mass) and print the top entries")
+    parser.add_argument("--cache-dir", metavar="DIR",
+                        help="reuse the outputs of identical runs stored in this cache folder")
+    parser.add_argument("--cache-size", type=float, default=5,
+                        help="size limit of the cache in GiB, least recently used runs are evicted (default: 5)")
+    parser.add_argument("--cache-stats", action="store_true", help="print the cache hit/miss statistics")
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    # Prompt the user for the number of stars to simulate
-    N_p = int(input("Enter the number of stars to simulate: "))
-    Xseed = int(input("Custom Seed: "))
-    # Prompt the user to decide whether to generate additional plots
-    plots = input("Generate additional plots? (y/n): ")
-    plots = True if plots.lower() == "y" else False
+    args = parse_args()
+    import_time = time.perf_counter() - _IMPORT_START
+    if _INTERPRETER_STARTUP is None:
+        print(f"Cold start: {import_time:.3f} s to import the pipeline (interpreter startup not measured)")
+    else:
+        print(f"Cold start: {_INTERPRETER_STARTUP:.3f} s of interpreter startup, {import_time:.3f} s to import "
+              "the pipeline")
+
+    if args.n_stars is None:
+        # Prompt the user for the number of stars to simulate
+        args.n_stars = int(input("Enter the number of stars to simulate: "))
+        args.seed = int(input("Custom Seed: "))
+        # Prompt the user to decide whether to generate additional plots
+        plots = input("Generate additional plots? (y/n): ")
+        args.plots = True if plots.lower() == "y" else False
+
+    instrument = None
+    if args.profile_json or args.trace_memory or args.profile_stage:
+        instrument = Instrumentation(trace_memory=args.trace_memory, profile_stage=args.profile_stage)
+
+    cache = None
+    if args.cache_dir:
+        cache = ResultCache(args.cache_dir, max_bytes=int(args.cache_size * 2**30))
 
     # Execute the main function
-    main(N_p, Xseed, plots)
+    main(args.n_stars, args.seed, args.plots, sampler=args.sampler, chunk_size=args.chunk_size,
+         workers=args.workers, output=args.format, csv_export=args.csv_export,
+         aggregate_only=args.aggregate_only, plot_workers=args.plot_workers, instrument=instrument, cache=cache,
+         compact=args.compact, sfh=None if args.sfh == "constant" else parse_sfh(args.sfh),
+         compression=args.compression, write_queue=args.write_queue, rng_mode=args.rng,
+         galaxy=None if args.galaxy is None else parse_galaxy(args.galaxy))
+
+    if instrument is not None:
+        if args.profile_json:
+            instrument.to_json(args.profile_json)
+        if args.profile_stage:
+            print(instrument.profile_stats())
+
+    if cache is not None and args.cache_stats:
+        print(f"Cache statistics: {cache.stats()}")
@@ -0,0 +1,633 @@
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from aggregates import CatalogAggregates
+from counter_rng import POSITION_STREAM, StarStream
+from galaxy import POSITION_COLUMNS, POSITION_DRAWS
+from instrumentation import NULL_INSTRUMENTATION, Instrumentation
+from data_generator import generate_star_mass_data, generate_stratified_mass_data, generate_times
+from utils import remnant_classifier, remnant_mass
+
+# Number of stars (or IMF trials for rejection sampling) drawn from one random stream.
+# Every block has its own generator spawned from the user seed, so the catalog for a
+# given seed does not depend on how the blocks are grouped into chunks.
+BLOCK_SIZE = 2**16
+
+# Columns written to the catalog, in order
+CATALOG_COLUMNS = ("Mass_i", "Age", "Object", "Mass_f")
+
+# Samplers that attach a statistical weight to every star (extra 'Weight' column)
+WEIGHTED_SAMPLERS = ("stratified",)
+
+# Random number modes: one generator per block ("block"), or counter-based draws
+# keyed by the seed and the star index ("counter", see counter_rng.StarStream)
+RNG_MODES = ("block", "counter")
+
+
+def catalog_columns(sampler, galaxy=None):
+    """
+    Columns of the catalog written for a sampling method, plus the positions when the
+    stars are placed in a galaxy model.
+    """
+    columns = CATALOG_COLUMNS + ("Weight",) if sampler in WEIGHTED_SAMPLERS else CATALOG_COLUMNS
+    return columns + POSITION_COLUMNS if galaxy is not None else columns
+
+
+def block_rng(seed, block, rng_mode="block"):
+    """
+    Creates the independent random generator of one block of the simulation.
+
+    Parameters:
+    ----------
+    seed : int
+        User seed of the run.
+    block : int
+        Index of the block.
+    rng_mode : str
+        "block" or "counter" (see RNG_MODES).
+
+    Returns:
+    -------
+    np.random.Generator or StarStream
+        Generator spawned from the user seed for this block, or in counter mode the
+        counter-based draws of its stars (from star block * BLOCK_SIZE on).
+    """
+    if rng_mode == "counter":
+        return StarStream(seed, block * BLOCK_SIZE)
+    if rng_mode != "block":
+        raise ValueError(f"Unknown random number mode: {rng_mode} (use one of {', '.join(RNG_MODES)})")
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(block,)))
+
+
+def generate_block(n, rng, mass_min, mass_max, sampler="inverse", stats=None, instr=None, buffers=None, out=None,
+                   sfh=None, galaxy=None):
+    """
+    Runs the full pipeline (mass, times, classification, remnant mass and optionally
+    position) for one block.
+
+    Parameters:
+    ----------
+    n : int
+        Number of stars (or IMF trials for rejection sampling) in the block.
+    rng : np.random.Generator or counter_rng.StarStream
+        Random generator of the block, or the counter-based draws of its stars
+        ("inverse" sampler only).
+    mass_min : float
+        Minimum stellar mass (in units of Msun).
+    mass_max : float
+        Maximum stellar mass (in units of Msun).
+    sampler : str
+        IMF sampling method, "inverse", "rejection" or "stratified" (oversampled
+        NS/BH mass strata with per-star weights, see generate_stratified_mass_data).
+    stats : dict, optional
+        If given, the IMF sampling time, the number of IMF trials, the number of
+        stars and the star counts per class are accumulated in it under the keys
+        "sampling_time", "n_trials", "n_stars" and "class_counts".
+    instr : Instrumentation, optional
+        Records the "imf_sampling", "time_generation", "classification",
+        "remnant_mass" and "positions" stages.
+    buffers : dict, optional
+        Preallocated work arrays reused across blocks (see make_block_buffers). The
+        returned 'Mass_f' is then a view of a buffer, valid until the next block.
+    out : dict, optional
+        Catalog columns to fill in place from their first element (e.g. views of an
+        allocate_catalog buffer), with room for every star of the block. The
+        classifier and the remnant masses are written directly into them and the
+        other stages are stored in their dtype (e.g. float32); the returned arrays
+        are views of out.
+    sfh : sfh.StarFormationHistory, optional
+        Star formation history of the birth times (default: constant SFR).
+    galaxy : galaxy.GalaxyModel, optional
+        Density model the stars are placed in (GalaxyModel.place), with draws taken
+        after all the others (or from their own stream in counter mode), so the
+        other columns do not change.
+
+    Returns:
+    -------
+    dict
+        Arrays of the block: the catalog columns ('Mass_i', 'Age', 'Object', 'Mass_f')
+        plus 'Prob' (IMF probability values) and 'Born_time' (Myr). The "stratified"
+        sampler adds the 'Weight' of every star, and a galaxy model the 'X', 'Y' and
+        'Z' positions.
+    """
+    instr = NULL_INSTRUMENTATION if instr is None else instr
+
+    weights = None
+    draws = None
+    sampling_start = time.perf_counter()
+    with instr.stage("imf_sampling"):
+        if isinstance(rng, StarStream):
+            if sampler != "inverse":
+                raise ValueError(f"Counter-based generation needs the inverse sampler, not {sampler}.")
+            # One row of draws per star: IMF quantile, Prob, birth time and NS mass
+            draws = rng.uniforms(n).T
+        if sampler == "stratified":
+            masses, prob_val, weights = generate_stratified_mass_data(mass_min, mass_max, n, rng=rng)
+        else:
+            masses, prob_val = generate_star_mass_data(mass_min, mass_max, n, method=sampler, rng=rng,
+                                                       uniforms=None if draws is None else draws[:2])
+    sampling_time = time.perf_counter() - sampling_start
+
+    with instr.stage("time_generation"):
+        born_times, t_alive, t_out_ms = generate_times(masses, rng=rng, sfh=sfh,
+                                                       uniforms=None if draws is None else draws[2])
+    k = len(masses)
+    with instr.stage("classification"):
+        indicators = remnant_classifier(masses, t_out_ms, out=None if out is None else out["Object"][:k])
+    with instr.stage("remnant_mass"):
+        mass_out = None
+        if out is not None:
+            mass_out = out["Mass_f"][:k]
+        elif buffers is not None:
+            mass_out = buffers["Mass_f"][:k]
+        final_mass = remnant_mass(masses, indicators, rng=rng, out=mass_out,
+                                  branch_out=None if buffers is None else buffers["branch"][:k],
+                                  uniforms=None if draws is None else draws[3])
+
+    positions = None
+    if galaxy is not None:
+        with instr.stage("positions"):
+            if draws is None:
+                uniforms = rng.random((POSITION_DRAWS, k))
+            else:
+                uniforms = rng.uniforms(k, POSITION_STREAM).T
+            positions = galaxy.place(uniforms)
+
+    if stats is not None:
+        merge_stats(stats, {"sampling_time": sampling_time, "n_trials": n, "n_stars": len(masses),
+                            "class_counts": np.bincount(indicators, minlength=4)})
+
+    block = {
+        "Mass_i": masses,
+        "Age": t_alive,
+        "Object": indicators,
+        "Mass_f": final_mass,
+        "Prob": prob_val,
+        "Born_time": born_times,
+    }
+    if weights is not None:
+        block["Weight"] = weights
+    if positions is not None:
+        block.update(zip(POSITION_COLUMNS, positions))
+    if out is not None:
+        for name in out:
+            if name not in ("Object", "Mass_f"):
+                out[name][:k] = block[name]
+        block = {name: values[:k] for name, values in out.items()}
+    return block
+
+
+def make_block_buffers(size=BLOCK_SIZE):
+    """
+    Allocates the work arrays generate_block can reuse from one block to the next.
+
+    Parameters:
+    ----------
+    size : int
+        Largest number of stars per block.
+
+    Returns:
+    -------
+    dict
+        'Mass_f' (float64) and 'branch' (uint8) arrays of the given size.
+    """
+    return {"Mass_f": np.empty(size), "branch": np.empty(size, dtype=np.uint8)}
+
+
+def catalog_layout(n, columns=CATALOG_COLUMNS, float_dtype=np.float64):
+    """
+    Layout of an allocate_catalog buffer.
+
+    Returns:
+    -------
+    tuple
+        Column types, byte offsets of the columns and total size (in bytes).
+    """
+    dtypes = {column: np.dtype(np.uint8 if column == "Object" else float_dtype) for column in columns}
+    offsets, size = {}, 0
+    for column, dtype in dtypes.items():
+        offsets[column] = size
+        # Keep every column 8-byte aligned
+        size += -(-n * dtype.itemsize // 8) * 8
+    return dtypes, offsets, size
+
+
+def allocate_catalog(n, columns=CATALOG_COLUMNS, float_dtype=np.float64, buffer=None):
+    """
+    Allocates a catalog as a single preallocated columnar buffer: one uint8 block
+    holding every column back to back, each column being a view of it. 'Object' is
+    uint8 and the other columns use float_dtype (float32 halves the masses and ages).
+
+    Parameters:
+    ----------
+    n : int
+        Number of stars (IMF trials for rejection sampling, as an upper bound).
+    columns : sequence of str
+        Columns of the catalog (e.g. catalog_columns(sampler) plus 'Prob' and
+        'Born_time' for the plots).
+    float_dtype : dtype
+        Type of the floating point columns, np.float64 or np.float32.
+    buffer : writable buffer, optional
+        Memory the columns are laid out in, of at least catalog_layout(...)[2] bytes
+        (e.g. render.shared_buffer, so the plot workers read the catalog without a
+        copy). A new array by default.
+
+    Returns:
+    -------
+    dict
+        Column name -> array of length n, all views of the same buffer.
+    """
+    dtypes, offsets, size = catalog_layout(n, columns, float_dtype)
+    if buffer is None:
+        buffer = np.empty(size, dtype=np.uint8)
+    elif memoryview(buffer).nbytes < size:
+        raise ValueError(f"The catalog needs a buffer of {size} bytes, not {memoryview(buffer).nbytes}.")
+    return {column: np.ndarray(n, dtype=dtype, buffer=buffer, offset=offsets[column])
+            for column, dtype in dtypes.items()}
+
+
+def fill_catalog(catalog, N_p, seed, mass_min=0.08, mass_max=100, sampler="inverse", stats=None, workers=1,
+                 instr=None, chunk_size=16 * BLOCK_SIZE, sfh=None, rng_mode="block", galaxy=None):
+    """
+    Generates the stellar catalog into the columns of allocate_catalog.
+
+    With one worker every block writes its stars in place at its position in the
+    buffer: the full-size columns are never copied (no concatenation and, with
+    pd.DataFrame(..., copy=False), no DataFrame copy); only block-sized temporaries
+    are allocated. With several workers each chunk received from the pool is copied
+    once into the buffer. The stars are the same as with iter_catalog_chunks.
+
+    Parameters:
+    ----------
+    catalog : dict
+        Columns from allocate_catalog with room for N_p stars.
+    N_p : int
+        Number of stars to generate (IMF trials for rejection sampling).
+    seed : int
+        Custom seed to the random numbers.
+    mass_min : float
+        Minimum stellar mass (in units of Msun).
+    mass_max : float
+        Maximum stellar mass (in units of Msun).
+    sampler : str
+        IMF sampling method, "inverse", "rejection" or "stratified" (the stratified
+        sampler also fills the 'Weight' column, see catalog_columns).
+    stats : dict, optional
+        Accumulator for sampling statistics (see generate_block).
+    workers : int
+        Number of generation processes.
+    instr : Instrumentation, optional
+        Records the pipeline stages.
+    chunk_size : int
+        Number of stars (or trials) per shard of the process pool.
+    sfh : sfh.StarFormationHistory, optional
+        Star formation history of the birth times (default: constant SFR).
+    rng_mode : str
+        "block" (default) or "counter" (counter-based draws keyed by the seed and the
+        star index, "inverse" sampler only; see RNG_MODES).
+    galaxy : galaxy.GalaxyModel, optional
+        If given, the stars are placed in the Milky Way after the remnant masses and
+        the catalog needs the 'X', 'Y' and 'Z' galactocentric positions (kpc).
+
+    Returns:
+    -------
+    dict
+        Views of the filled part of the columns (shorter than N_p for rejection
+        sampling).
+    """
+    n_stars = 0
+    if workers <= 1:
+        buffers = make_block_buffers()
+        for block, n in enumerate(block_sizes(N_p)):
+            out = {name: values[n_stars:] for name, values in catalog.items()}
+            chunk = generate_block(n, block_rng(seed, block, rng_mode), mass_min, mass_max, sampler, stats, instr,
+                                   buffers=buffers, out=out, sfh=sfh, galaxy=galaxy)
+            n_stars += len(chunk["Mass_i"])
+    else:
+        for chunk in iter_catalog_chunks(N_p, seed, chunk_size, mass_min, mass_max, sampler, stats, workers, instr,
+                                         sfh, rng_mode, galaxy):
+            k = len(chunk["Mass_i"])
+            for name, values in catalog.items():
+                values[n_stars:n_stars + k] = chunk[name]
+            n_stars += k
+    return {name: values[:n_stars] for name, values in catalog.items()}
+
+
+def catalog_nbytes(catalog):
+    """
+    Bytes held by the columns of a catalog (dict of arrays).
+    """
+    return sum(values.nbytes for values in catalog.values())
+
+
+def block_sizes(N_p):
+    """
+    Splits N_p into blocks of BLOCK_SIZE (the last block may be smaller).
+
+    Parameters:
+    ----------
+    N_p : int
+        Total number of stars (or IMF trials).
+
+    Returns:
+    -------
+    list of int
+        Size of every block, in order.
+    """
+    n_full, rest = divmod(N_p, BLOCK_SIZE)
+    return [BLOCK_SIZE] * n_full + ([rest] if rest else [])
+
+
+def concat_chunks(chunks):
+    """
+    Concatenates a list of chunks (dicts of arrays) column by column.
+
+    Parameters:
+    ----------
+    chunks : list of dict
+        Chunks with the same keys.
+
+    Returns:
+    -------
+    dict
+        Single chunk with the concatenated arrays.
+    """
+    return {key: np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+
+
+def generate_blocks(seed, first, sizes, mass_min, mass_max, sampler="inverse", instr=None, sfh=None,
+                    rng_mode="block", galaxy=None):
+    """
+    Generates a run of consecutive blocks and concatenates them into one chunk.
+
+    This is the unit of work of the process pool: it only depends on its arguments, so
+    a shard gives the same stars whichever process runs it.
+
+    Parameters:
+    ----------
+    seed : int
+        Custom seed to the random numbers.
+    first : int
+        Index of the first block of the shard.
+    sizes : list of int
+        Size of every block of the shard.
+    mass_min : float
+        Minimum stellar mass (in units of Msun).
+    mass_max : float
+        Maximum stellar mass (in units of Msun).
+    sampler : str
+        IMF sampling method, "inverse", "rejection" or "stratified" (the stratified
+        sampler adds the 'Weight' column, see catalog_columns).
+    instr : Instrumentation or True, optional
+        Instrumentation of the stages. In a worker process, True records the stages
+        locally and returns them in stats["stages"].
+    sfh : sfh.StarFormationHistory, optional
+        Star formation history of the birth times (default: constant SFR).
+    rng_mode : str
+        "block" (default) or "counter" (counter-based draws keyed by the seed and the
+        star index, "inverse" sampler only; see RNG_MODES).
+    galaxy : galaxy.GalaxyModel, optional
+        If given, the stars are placed in the Milky Way after the remnant masses and
+        the chunks get the 'X', 'Y' and 'Z' galactocentric positions (kpc).
+
+    Returns:
+    -------
+    tuple
+        - chunk : dict
+            Arrays of the shard (see generate_block).
+        - stats : dict
+            Sampling statistics of the shard (see generate_block).
+    """
+    stats = {}
+    local = Instrumentation() if instr is True else instr
+    blocks = [
+        generate_block(n, block_rng(seed, first + i, rng_mode), mass_min, mass_max, sampler, stats, local, sfh=sfh,
+                       galaxy=galaxy)
+        for i, n in enumerate(sizes)
+    ]
+    if instr is True:
+        stats["stages"] = local.stages
+    return (blocks[0] if len(blocks) == 1 else concat_chunks(blocks)), stats
+
+
+def generate_range(seed, start, stop, mass_min=0.08, mass_max=100, instr=None, sfh=None, galaxy=None):
+    """
+    Generates the stars [start, stop) of a counter-mode run ("inverse" sampler) on
+    their own: they are the same stars as at these positions of the full catalog,
+    without generating any star before them. Ranges can be generated in any order or
+    process, e.g. for lazy slices or shards that do not follow the block grid.
+
+    Parameters:
+    ----------
+    seed : int
+        Custom seed to the random numbers.
+    start, stop : int
+        First and last (excluded) star indices.
+    mass_min : float
+        Minimum stellar mass (in units of Msun).
+    mass_max : float
+        Maximum stellar mass (in units of Msun).
+    instr : Instrumentation, optional
+        Records the pipeline stages.
+    sfh : sfh.StarFormationHistory, optional
+        Star formation history of the birth times (default: constant SFR).
+    galaxy : galaxy.GalaxyModel, optional
+        If given, the stars are placed in the Milky Way after the remnant masses and
+        the stars get the 'X', 'Y' and 'Z' galactocentric positions (kpc).
+
+    Returns:
+    -------
+    dict
+        Arrays of the stars (see generate_block), generated BLOCK_SIZE stars at a time.
+    """
+    starts = range(start, stop, BLOCK_SIZE) or [start]
+    blocks = [
+        generate_block(max(0, min(BLOCK_SIZE, stop - first)), StarStream(seed, first), mass_min, mass_max,
+                       instr=instr, sfh=sfh, galaxy=galaxy)
+        for first in starts
+    ]
+    return blocks[0] if len(blocks) == 1 else concat_chunks(blocks)
+
+
+def iter_catalog_chunks(N_p, seed, chunk_size=16 * BLOCK_SIZE, mass_min=0.08, mass_max=100,
+                        sampler="inverse", stats=None, workers=1, instr=None, sfh=None, rng_mode="block",
+                        galaxy=None):
+    """
+    Generates the stellar catalog one fixed-size chunk at a time, so peak memory does
+    not depend on N_p.
+
+    The chunk size is rounded to a whole number of blocks (at least one). The stars
+    generated for a given seed are the same for any chunk size and number of workers.
+
+    Parameters:
+    ----------
+    N_p : int
+        Number of stars to generate (IMF trials for rejection sampling).
+    seed : int
+        Custom seed to the random numbers.
+    chunk_size : int
+        Number of stars (or trials) per chunk.
+    mass_min : float
+        Minimum stellar mass (in units of Msun).
+    mass_max : float
+        Maximum stellar mass (in units of Msun).
+    sampler : str
+        IMF sampling method, "inverse", "rejection" or "stratified" (the stratified
+        sampler adds the 'Weight' column, see catalog_columns).
+    stats : dict, optional
+        Accumulator for sampling statistics (see generate_block). With several
+        workers, "sampling_time" is summed over the workers.
+    workers : int
+        Number of processes generating chunks in parallel. Chunks are still
+        yielded in order, with at most 2 * workers chunks in flight.
+    instr : Instrumentation, optional
+        Records the pipeline stages. With several workers the stage times are
+        measured in the workers and summed (cProfile and tracemalloc only cover
+        the calling process).
+    sfh : sfh.StarFormationHistory, optional
+        Star formation history of the birth times (default: constant SFR). Its
+        cumulative table is sent to the workers with the shards.
+    rng_mode : str
+        "block" (default) or "counter" (counter-based draws keyed by the seed and the
+        star index, "inverse" sampler only; see RNG_MODES).
+    galaxy : galaxy.GalaxyModel, optional
+        If given, the stars are placed in the Milky Way after the remnant masses and
+        the chunks get the 'X', 'Y' and 'Z' galactocentric positions (kpc).
+
+    Yields:
+    ------
+    dict
+        Arrays of the chunk (see generate_block).
+    """
+    shards = make_shards(N_p, seed, chunk_size, mass_min, mass_max, sampler, shard_instr(instr, workers), sfh,
+                         rng_mode, galaxy)
+    for chunk, shard_stats in run_shards(generate_blocks, shards, workers):
+        merge_stats(stats, shard_stats, instr)
+        yield chunk
+
+
+def make_shards(N_p, seed, chunk_size, mass_min, mass_max, sampler, instr=None, sfh=None, rng_mode="block",
+                galaxy=None):
+    """
+    Groups the blocks of a run into shards of chunk_size stars (rounded to whole
+    blocks), given as argument tuples for generate_blocks / aggregate_blocks.
+    """
+    blocks_per_chunk = max(1, chunk_size // BLOCK_SIZE)
+    sizes = block_sizes(N_p)
+    return [
+        (seed, first, sizes[first:first + blocks_per_chunk], mass_min, mass_max, sampler, instr, sfh, rng_mode,
+         galaxy)
+        for first in range(0, len(sizes), blocks_per_chunk)
+    ]
+
+
+def shard_instr(instr, workers):
+    """
+    Instrumentation argument of the shards: the object itself in the calling process,
+    True in worker processes when instrumentation is enabled.
+    """
+    if workers <= 1 or not isinstance(instr, Instrumentation):
+        return instr
+    return True
+
+
+def run_shards(func, shards, workers=1):
+    """
+    Applies func to every shard, in a process pool when workers > 1, and yields the
+    results in shard order with at most 2 * workers shards in flight.
+    """
+    if workers <= 1:
+        for shard in shards:
+            yield func(*shard)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for shard in shards:
+            pending.append(executor.submit(func, *shard))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def aggregate_blocks(seed, first, sizes, mass_min, mass_max, sampler="inverse", instr=None, sfh=None,
+                     rng_mode="block", galaxy=None):
+    """
+    Generates the blocks of a shard one at a time and only keeps their aggregates.
+
+    Parameters:
+    ----------
+    Same as generate_blocks.
+
+    Returns:
+    -------
+    tuple
+        - aggregates : CatalogAggregates
+            Histograms and per-class counters of the shard.
+        - stats : dict
+            Sampling statistics of the shard (see generate_block).
+    """
+    stats = {}
+    local = Instrumentation() if instr is True else instr
+    aggregates = CatalogAggregates(mass_min, mass_max)
+    for i, n in enumerate(sizes):
+        chunk = generate_block(n, block_rng(seed, first + i, rng_mode), mass_min, mass_max, sampler, stats, local,
+                               sfh=sfh, galaxy=galaxy)
+        with (local or NULL_INSTRUMENTATION).stage("aggregation"):
+            aggregates.update(chunk)
+    if instr is True:
+        stats["stages"] = local.stages
+    return aggregates, stats
+
+
+def run_aggregates(N_p, seed, chunk_size=16 * BLOCK_SIZE, mass_min=0.08, mass_max=100,
+                   sampler="inverse", stats=None, workers=1, instr=None, sfh=None, rng_mode="block"):
+    """
+    Runs the pipeline in aggregate-only mode: the summary histograms and per-class
+    counters are updated block by block and the star arrays are never kept, so
+    memory stays constant for any N_p.
+
+    Parameters:
+    ----------
+    Same as iter_catalog_chunks.
+
+    Returns:
+    -------
+    CatalogAggregates
+        Aggregates of the whole run. The counts are the same for any chunk size and
+        number of workers (the final mass sums up to rounding).
+    """
+    aggregates = CatalogAggregates(mass_min, mass_max)
+    shards = make_shards(N_p, seed, chunk_size, mass_min, mass_max, sampler, shard_instr(instr, workers), sfh,
+                         rng_mode)
+    for shard_aggregates, shard_stats in run_shards(aggregate_blocks, shards, workers):
+        aggregates.merge(shard_aggregates)
+        merge_stats(stats, shard_stats, instr)
+    return aggregates
+
+
+def merge_stats(stats, other, instr=None):
+    """
+    Adds the sampling statistics of a shard to an accumulator.
+
+    Parameters:
+    ----------
+    stats : dict or None
+        Accumulator (nothing is done if None).
+    other : dict
+        Statistics of the shard. Stage records of a worker ("stages") are merged
+        into instr instead.
+    instr : Instrumentation, optional
+        Instrumentation of the run.
+    """
+    if "stages" in other:
+        other = dict(other)
+        stages = other.pop("stages")
+        if instr is not None:
+            instr.merge(stages)
+    if stats is None:
+        return
+    for key, value in other.items():
+        stats[key] = stats.get(key, 0) + value
@@ -2,9 +2,74 @@ from Kroup_func import kroupa01_norm
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
+from matplotlib.colors import LinearSegmentedColormap, LogNorm
 
+# Above this number of points the scatter plots are drawn as rasterized 2D histograms
+DENSITY_THRESHOLD = 200_000
 
-def plot_mass(masses, prob_val, mass_min, mass_max):
+# Number of bins per axis of the density images
+DENSITY_BINS = 200
+
+
+def _group_by_class(ind, n_classes=4):
+    """
+    Groups star indices by class in one pass (stable radix sort of the class codes).
+
+    Returns the grouped indices and the [start, end) bounds of each class.
+    """
+    order = np.argsort(np.asarray(ind, dtype=np.uint8), kind="stable")
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(ind, minlength=n_classes)[:n_classes])))
+    return order, bounds
+
+
+def _class_groups(ind, bounds=None, n_classes=4):
+    """
+    Selection of the stars of each class: zero-copy slices when the stars are already
+    grouped by class (bounds from catalog.Catalog), index arrays otherwise.
+    """
+    if bounds is not None:
+        return [slice(int(bounds[i]), int(bounds[i + 1])) for i in range(n_classes)]
+    order, bounds = _group_by_class(ind, n_classes)
+    return [order[bounds[i]:bounds[i + 1]] for i in range(n_classes)]
+
+
+def _density_image(ax, x, y, x_edges, y_edges, color, weights=None):
+    """
+    Draws the 2D histogram of (x, y) as a rasterized image, empty cells transparent.
+    """
+    counts, _, _ = np.histogram2d(x, y, bins=(x_edges, y_edges), weights=weights)
+    counts = np.ma.masked_equal(counts.T, 0)
+    if counts.count() == 0:
+        return
+    cmap = LinearSegmentedColormap.from_list("density", ["white", color])
+    vmin = 1 if weights is None else counts.min()
+    ax.pcolormesh(x_edges, y_edges, counts, cmap=cmap, norm=LogNorm(vmin=vmin, vmax=max(counts.max(), 2 * vmin)),
+                  rasterized=True)
+
+
+def _log_edges(values, n_bins=DENSITY_BINS):
+    """
+    Log-spaced bin edges covering the finite positive values.
+    """
+    values = values[np.isfinite(values) & (values > 0)]
+    if len(values) == 0:
+        return np.logspace(-1, 1, n_bins + 1)
+    lo, hi = values.min(), values.max()
+    return np.logspace(np.log10(lo), np.log10(hi if hi > lo else lo * 1.01), n_bins + 1)
+
+
+def _class_counts(ind, weights=None, bounds=None, n_classes=4):
+    """
+    Number (or total weight) of the stars of each class.
+    """
+    if bounds is None:
+        return np.bincount(ind, weights=weights, minlength=n_classes)[:n_classes]
+    if weights is None:
+        return np.diff(bounds)
+    return np.array([np.sum(weights[group]) for group in _class_groups(ind, bounds, n_classes)])
+
+
+def plot_mass(masses, prob_val, mass_min, mass_max, ax=None, density_threshold=DENSITY_THRESHOLD):
     """
     Generates a plot comparing the normalized Kroupa initial mass function (IMF)
     to the generated masses.
@@ -19,26 +84,37 @@ def plot_mass(masses, prob_val, mass_min, mass_max):
         Minimum mass for generating the IMF.
     mass_max : float
         Maximum mass for generating the IMF.
+    ax : matplotlib.axes.Axes, optional
+        Axes to draw on. Defaults to the current pyplot axes.
+    density_threshold : int
+        Above this number of stars, the generated stars are drawn as a rasterized
+        2D histogram in log-log space instead of individual markers.
 
     Returns:
     -------
     int
         Returns 0 upon completion.
     """
+    ax = plt.gca() if ax is None else ax
     mass_model = np.logspace(np.log10(mass_min), np.log10(mass_max), 400)
     pdf_kroupa = kroupa01_norm(mass_model)
 
-    plt.plot(mass_model, pdf_kroupa, label='Normalized Kroupa01 IMF')
-    plt.scatter(masses, prob_val, label='Generated Stars', s=2, c="black")
-    plt.yscale('log')
-    plt.xscale('log')
-    plt.legend(loc='best', prop=dict(size=8))
-    plt.xlabel('Mass [$M_\odot$]')
-    plt.ylabel(r'Norm. Mass Function $\xi(m)\Delta m$')
+    ax.plot(mass_model, pdf_kroupa, label='Normalized Kroupa01 IMF')
+    if len(masses) > density_threshold:
+        _density_image(ax, masses, prob_val, _log_edges(masses), _log_edges(prob_val), "black")
+        ax.scatter([], [], label='Generated Stars', s=2, c="black")
+    else:
+        ax.scatter(masses, prob_val, label='Generated Stars', s=2, c="black")
+    ax.set_yscale('log')
+    ax.set_xscale('log')
+    # 'best' would test the legend position against every cell of the density image
+    ax.legend(loc='upper right' if len(masses) > density_threshold else 'best', prop=dict(size=8))
+    ax.set_xlabel('Mass [$M_\odot$]')
+    ax.set_ylabel(r'Norm. Mass Function $\xi(m)\Delta m$')
     return 0
 
 
-def plot_mass_histogram(masses):
+def plot_mass_histogram(masses, ax=None, weights=None):
     """
     Generates a histogram of stellar masses in logarithmic scale.
 
@@ -46,19 +122,28 @@ def plot_mass_histogram(masses):
     ----------
     masses : array-like
         Array or list of generated stellar masses.
+    ax : matplotlib.axes.Axes, optional
+        Axes to draw on. Defaults to the current pyplot axes.
+    weights : array-like, optional
+        Statistical weight of each star (stratified sampling).
 
     Returns:
     -------
     int
         Returns 0 upon completion.
     """
-    sns.histplot(np.log10(masses), color="blue", bins=150, kde=False, alpha=0.5)
-    plt.title("Generated Mass Distribution")
-    plt.xlabel("Log. Mass [$M_\odot$]")
+    ax = plt.gca() if ax is None else ax
+    if weights is None:
+        sns.histplot(np.log10(masses), color="blue", bins=150, kde=False, alpha=0.5, ax=ax)
+    else:
+        sns.histplot({"x": np.log10(masses), "weights": weights}, x="x", weights="weights", color="blue",
+                     bins=150, kde=False, alpha=0.5, ax=ax)
+    ax.set_title("Generated Mass Distribution")
+    ax.set_xlabel("Log. Mass [$M_\odot$]")
     return 0
 
 
-def plot_born_times_histogram(born_time):
+def plot_born_times_histogram(born_time, ax=None, weights=None):
     """
     Generates a histogram of stellar birth times.
 
@@ -66,19 +151,120 @@ def plot_born_times_histogram(born_time):
     ----------
     born_time : array-like
         Array or list of stellar birth times.
+    ax : matplotlib.axes.Axes, optional
+        Axes to draw on. Defaults to the current pyplot axes.
+    weights : array-like, optional
+        Statistical weight of each star (stratified sampling).
+
+    Returns:
+    -------
+    int
+        Returns 0 upon completion.
+    """
+    ax = plt.gca() if ax is None else ax
+    if weights is None:
+        sns.histplot(born_time, color="green", bins=150, kde=False, alpha=0.5, ax=ax)
+    else:
+        sns.histplot({"x": born_time, "weights": weights}, x="x", weights="weights", color="green",
+                     bins=150, kde=False, alpha=0.5, ax=ax)
+    ax.set_title("Generated Born Time Distribution")
+    ax.set_xlabel("Born Time [Myr]")
+    return 0
+
+
+def plot_mass_histogram_binned(mass_edges, counts, ax=None):
+    """
+    Generates the histogram of stellar masses in logarithmic scale from pre-binned
+    counts (e.g. CatalogAggregates.mass_counts).
+
+    Parameters:
+    ----------
+    mass_edges : array-like
+        Log-spaced mass bin edges (in units of Msun).
+    counts : array-like
+        Number of stars in each bin.
+    ax : matplotlib.axes.Axes, optional
+        Axes to draw on. Defaults to the current pyplot axes.
+
+    Returns:
+    -------
+    int
+        Returns 0 upon completion.
+    """
+    ax = plt.gca() if ax is None else ax
+    log_edges = np.log10(mass_edges)
+    binned = {"x": 0.5 * (log_edges[1:] + log_edges[:-1]), "counts": counts}
+    sns.histplot(binned, x="x", weights="counts", bins=log_edges.tolist(), color="blue", kde=False, alpha=0.5, ax=ax)
+    ax.set_title("Generated Mass Distribution")
+    ax.set_xlabel(r"Log. Mass [$M_\odot$]")
+    return 0
+
+
+def plot_born_times_histogram_binned(born_edges, counts, ax=None):
+    """
+    Generates the histogram of stellar birth times from pre-binned counts
+    (e.g. CatalogAggregates.born_counts).
+
+    Parameters:
+    ----------
+    born_edges : array-like
+        Birth time bin edges (in Myr).
+    counts : array-like
+        Number of stars in each bin.
+    ax : matplotlib.axes.Axes, optional
+        Axes to draw on. Defaults to the current pyplot axes.
 
     Returns:
     -------
     int
         Returns 0 upon completion.
     """
-    sns.histplot(born_time, color="green", bins=150, kde=False, alpha=0.5)
-    plt.title("Generated Born Time Distribution")
-    plt.xlabel("Born Time [Myr]")
+    ax = plt.gca() if ax is None else ax
+    binned = {"x": 0.5 * (born_edges[1:] + born_edges[:-1]), "counts": counts}
+    sns.histplot(binned, x="x", weights="counts", bins=np.asarray(born_edges).tolist(), color="green", kde=False, alpha=0.5, ax=ax)
+    ax.set_title("Generated Born Time Distribution")
+    ax.set_xlabel("Born Time [Myr]")
     return 0
 
 
-def plot_mass_histogram_per_remnant(masses,ind):
+def plot_mass_histogram_per_remnant_binned(mass_edges, class_counts, ax=None):
+    """
+    Plots the histograms of initial masses for the different stellar remnant types
+    from pre-binned counts (e.g. CatalogAggregates.class_mass_counts).
+
+    Parameters
+    ----------
+    mass_edges : array-like
+        Log-spaced mass bin edges (in units of Msun).
+    class_counts : array-like
+        Counts of shape (4, n_bins) for Main Sequence, White Dwarf, Neutron Star
+        and Black Hole.
+    ax : matplotlib.axes.Axes, optional
+        Axes to draw on. Defaults to the current pyplot axes.
+
+    Returns
+    -------
+    int
+        Returns 0 upon completion.
+    """
+    ax = plt.gca() if ax is None else ax
+    centers = np.sqrt(mass_edges[1:] * mass_edges[:-1])
+    colors = ['blue', 'red', 'green', 'purple']
+    labels = ['Main Sequence', 'White Dwarf', 'Neutron Star', 'Black Hole']
+    for i in range(4):
+        if np.sum(class_counts[i]) > 0:
+            ax.hist(centers, bins=mass_edges, weights=class_counts[i], histtype='step', density=True,
+                     color=colors[i], alpha=0.5, label=labels[i])
+    ax.set_yscale('log')
+    ax.set_xscale('log')
+    ax.set_xlabel(r'Initial Mass [$M_\odot$]')
+    ax.set_ylabel('Counts')
+    ax.legend(loc='best', prop={'size': 6.5})
+    ax.set_title("Mass distribution per remnant")
+    return 0
+
+
+def plot_mass_histogram_per_remnant(masses,ind,ax=None,weights=None,bounds=None):
     """
     Plots histograms of initial masses for different stellar remnant types
     with logarithmic scales on both axes.
@@ -93,27 +279,37 @@ def plot_mass_histogram_per_remnant(masses,ind):
         - 1: White Dwarf
         - 2: Neutron Star
         - 3: Black Hole
+    ax : matplotlib.axes.Axes, optional
+        Axes to draw on. Defaults to the current pyplot axes.
+    weights : array-like, optional
+        Statistical weight of each star (stratified sampling).
+    bounds : array-like, optional
+        Class bounds of a catalog grouped by class (catalog.Catalog.bounds): the
+        classes are read as contiguous slices instead of being searched.
 
     Returns
     -------
     int
         Returns 0 upon completion.
     """
+    ax = plt.gca() if ax is None else ax
+    groups = _class_groups(ind, bounds)
+    w = (lambda k: None) if weights is None else (lambda k: weights[groups[k]])
     
-    plt.hist(masses[ind==0], bins=100, histtype='step',density=True, color='blue', alpha=0.5, label='Main Sequence')
-    plt.hist(masses[ind==1], bins=25,histtype='step', density=True, color='red', alpha=0.5, label='White Dwarf')
-    plt.hist(masses[ind==2], bins=25,histtype='step', density=True, color='green', alpha=0.5, label='Neutron Star')
-    plt.hist(masses[ind==3], bins=10, histtype='step',density=True, color='purple', alpha=0.5, label='Black Hole')
-    plt.yscale('log')
-    plt.xscale('log')
-    plt.xlabel('Initial Mass [$M_\odot$]')
-    plt.ylabel('Counts')
-    plt.legend(loc='best', prop={'size': 6.5})
-    plt.title("Mass distribution per remnant")
+    ax.hist(masses[groups[0]], bins=100, weights=w(0), histtype='step',density=True, color='blue', alpha=0.5, label='Main Sequence')
+    ax.hist(masses[groups[1]], bins=25, weights=w(1), histtype='step', density=True, color='red', alpha=0.5, label='White Dwarf')
+    ax.hist(masses[groups[2]], bins=25, weights=w(2), histtype='step', density=True, color='green', alpha=0.5, label='Neutron Star')
+    ax.hist(masses[groups[3]], bins=10, weights=w(3), histtype='step',density=True, color='purple', alpha=0.5, label='Black Hole')
+    ax.set_yscale('log')
+    ax.set_xscale('log')
+    ax.set_xlabel('Initial Mass [$M_\odot$]')
+    ax.set_ylabel('Counts')
+    ax.legend(loc='best', prop={'size': 6.5})
+    ax.set_title("Mass distribution per remnant")
     return 0
 
 
-def plot_mass_vs_age(masses,ages,ind):
+def plot_mass_vs_age(masses,ages,ind,ax=None,density_threshold=DENSITY_THRESHOLD,weights=None,bounds=None):
     """
     Plots the mass versus age of stars, categorized by remnant type, with special markers 
     highlighting the oldest and youngest stars in each category.
@@ -130,6 +326,17 @@ def plot_mass_vs_age(masses,ages,ind):
         - 1: White Dwarf
         - 2: Neutron Star
         - 3: Black Hole
+    ax : matplotlib.axes.Axes, optional
+        Axes to draw on. Defaults to the current pyplot axes.
+    density_threshold : int
+        Above this number of stars, each category is drawn as a rasterized 2D
+        histogram (linear age, log mass) instead of individual markers.
+    weights : array-like, optional
+        Statistical weight of each star (stratified sampling), used by the density
+        images.
+    bounds : array-like, optional
+        Class bounds of a catalog grouped by class (catalog.Catalog.bounds): the
+        classes are read as contiguous slices instead of being searched.
 
     Returns
     -------
@@ -137,6 +344,7 @@ def plot_mass_vs_age(masses,ages,ind):
 
 
     """
+    ax = plt.gca() if ax is None else ax
 
     
     color_map = {
@@ -151,36 +359,50 @@ def plot_mass_vs_age(masses,ages,ind):
 
     categories = ['Main Sequence', 'White Dwarf', 'Neutron Star', 'Black Hole']
 
+    # Group the stars by category once; the oldest/youngest markers use the same groups
+    masses, ages = np.asarray(masses), np.asarray(ages)
+    groups = _class_groups(ind, bounds)
+    density = len(masses) > density_threshold
+    if density:
+        age_edges = np.linspace(np.min(ages), np.max(ages), DENSITY_BINS + 1) if len(ages) else np.linspace(0, 1, 2)
+        mass_edges = _log_edges(masses)
+
     for i, category in enumerate(categories):
-        plt.scatter(ages[ind == i], masses[ind == i], alpha=0.6, label=category, color=colors[i], s=10)
+        group = groups[i]
+        if density:
+            _density_image(ax, ages[group], masses[group], age_edges, mass_edges, colors[i],
+                           None if weights is None else np.asarray(weights)[group])
+            ax.scatter([], [], alpha=0.6, label=category, color=colors[i], s=10)
+        else:
+            ax.scatter(ages[group], masses[group], alpha=0.6, label=category, color=colors[i], s=10)
 
     
     for i in range(4):
-        cat_ages = ages[ind == i]
-        cat_masses = masses[ind == i]
+        cat_ages = ages[groups[i]]
+        cat_masses = masses[groups[i]]
         if len(cat_ages) > 0:  
             oldest_idx = np.argmax(cat_ages)
             youngest_idx = np.argmin(cat_ages)
 
             if i==1:
-                plt.scatter(cat_ages[oldest_idx], cat_masses[oldest_idx], color=colors[i],edgecolor="black",marker="*", s=80, label=f'Oldest {categories[i]}')
-                plt.scatter(cat_ages[youngest_idx], cat_masses[youngest_idx], color=colors[i],edgecolor="black",marker="D", s=30, label=f'Youngest {categories[i]}')
+                ax.scatter(cat_ages[oldest_idx], cat_masses[oldest_idx], color=colors[i],edgecolor="black",marker="*", s=80, label=f'Oldest {categories[i]}')
+                ax.scatter(cat_ages[youngest_idx], cat_masses[youngest_idx], color=colors[i],edgecolor="black",marker="D", s=30, label=f'Youngest {categories[i]}')
 
             else:
-                plt.scatter(cat_ages[oldest_idx], cat_masses[oldest_idx], color=colors[i],edgecolor="black",marker="*", s=80)
-                plt.scatter(cat_ages[youngest_idx], cat_masses[youngest_idx], color=colors[i],edgecolor="black",marker="D", s=30)
+                ax.scatter(cat_ages[oldest_idx], cat_masses[oldest_idx], color=colors[i],edgecolor="black",marker="*", s=80)
+                ax.scatter(cat_ages[youngest_idx], cat_masses[youngest_idx], color=colors[i],edgecolor="black",marker="D", s=30)
 
     
-    plt.xscale('linear')  
-    plt.xlabel('Age [Myr]')
-    plt.ylabel('Final Mass [$M_\odot$]')
-    plt.yscale("log")
-    plt.legend(loc='upper center')
-    plt.title('Age vs Mass for Stellar Categories')
+    ax.set_xscale('linear')  
+    ax.set_xlabel('Age [Myr]')
+    ax.set_ylabel('Final Mass [$M_\odot$]')
+    ax.set_yscale("log")
+    ax.legend(loc='upper center')
+    ax.set_title('Age vs Mass for Stellar Categories')
     return 0
 
 
-def pie_plot(ind):
+def pie_plot(ind, ax=None, weights=None, bounds=None):
     """
     Plots a pie chart showing the distribution of different stellar categories in the input array 'ind'.
 
@@ -192,12 +414,43 @@ def pie_plot(ind):
         - 1: White Dwarf
         - 2: Neutron Star
         - 3: Black Hole
+    ax : matplotlib.axes.Axes, optional
+        Axes to draw on. Defaults to the current pyplot axes.
+    weights : array-like, optional
+        Statistical weight of each star (stratified sampling).
+    bounds : array-like, optional
+        Class bounds of a catalog grouped by class (catalog.Catalog.bounds): the
+        classes are read as contiguous slices instead of being searched.
 
     Returns
     -------
     Returns 0 upon completion.
 
     """
+    ax = plt.gca() if ax is None else ax
+    counts = _class_counts(ind, weights, bounds)
+    return pie_plot_counts(counts, ax)
+
+
+def pie_plot_counts(counts, ax=None):
+    """
+    Plots a pie chart of the stellar categories from their counts (e.g. the class
+    counts of CatalogAggregates).
+
+    Parameters
+    ----------
+    counts : array-like
+        Number of stars of each category: Main Sequence, White Dwarf, Neutron Star
+        and Black Hole.
+    ax : matplotlib.axes.Axes, optional
+        Axes to draw on. Defaults to the current pyplot axes.
+
+    Returns
+    -------
+    Returns 0 upon completion.
+
+    """
+    ax = plt.gca() if ax is None else ax
     color_map = {
         'Main Sequence': 'grey',
         'White Dwarf': 'blue',
@@ -206,11 +459,10 @@ def pie_plot(ind):
     }
     colors = [color_map[category] for category in ['Main Sequence', 'White Dwarf', 'Neutron Star', 'Black Hole']]
     categories = ['Main Sequence', 'White Dwarf', 'Neutron Star', 'Black Hole']
-    counts = [(ind == 0).sum(), (ind == 1).sum(), (ind == 2).sum(), (ind == 3).sum()]
     fractions = np.array(counts) / sum(counts)
     
     
-    wedges, texts, autotexts = plt.pie(fractions, labels=categories, autopct='%1.1f%%', colors=colors)
+    wedges, texts, autotexts = ax.pie(fractions, labels=categories, autopct='%1.1f%%', colors=colors)
     
     
     for i, category in enumerate(categories):
@@ -222,10 +474,10 @@ def pie_plot(ind):
             autotexts[i].set_position((1.1, -0.08))  
             texts[i].set_position((1.25, -0.08))
 
-    plt.title('Fraction of Stellar Categories in the Simulation')
+    ax.set_title('Fraction of Stellar Categories in the Simulation')
     return 0
 
-def pie_plot_remnant(ind):
+def pie_plot_remnant(ind, ax=None, weights=None, bounds=None):
     """
     Plots a pie chart showing the distribution of stellar remnant categories (excluding Main Sequence) in the input array 'ind'.
 
@@ -236,13 +488,42 @@ def pie_plot_remnant(ind):
         - 1: White Dwarf
         - 2: Neutron Star
         - 3: Black Hole
-    
+    ax : matplotlib.axes.Axes, optional
+        Axes to draw on. Defaults to the current pyplot axes.
+    weights : array-like, optional
+        Statistical weight of each star (stratified sampling).
+    bounds : array-like, optional
+        Class bounds of a catalog grouped by class (catalog.Catalog.bounds): the
+        classes are read as contiguous slices instead of being searched.
+
     Returns
     -------
     Returns 0 upon completion.
 
 
     """
+    ax = plt.gca() if ax is None else ax
+    counts = _class_counts(ind, weights, bounds)[1:]
+    return pie_plot_remnant_counts(counts, ax)
+
+
+def pie_plot_remnant_counts(counts, ax=None):
+    """
+    Plots a pie chart of the stellar remnant categories from their counts.
+
+    Parameters
+    ----------
+    counts : array-like
+        Number of White Dwarfs, Neutron Stars and Black Holes.
+    ax : matplotlib.axes.Axes, optional
+        Axes to draw on. Defaults to the current pyplot axes.
+
+    Returns
+    -------
+    Returns 0 upon completion.
+
+    """
+    ax = plt.gca() if ax is None else ax
     color_map = {
         'White Dwarf': 'blue',
         'Neutron Star': 'green',
@@ -250,9 +531,8 @@ def pie_plot_remnant(ind):
     }
     colors = [color_map[category] for category in ['White Dwarf', 'Neutron Star', 'Black Hole']]
     categories = ['White Dwarf', 'Neutron Star', 'Black Hole']
-    counts = [(ind == 1).sum(), (ind == 2).sum(), (ind == 3).sum()]
     fractions = np.array(counts) / sum(counts) 
 
-    plt.pie(fractions, labels=categories, autopct='%1.1f%%', colors=colors)
-    plt.title('Fraction of Stellar Categories (Excluding Main Sequence)')
+    ax.pie(fractions, labels=categories, autopct='%1.1f%%', colors=colors)
+    ax.set_title('Fraction of Stellar Categories (Excluding Main Sequence)')
     return 0
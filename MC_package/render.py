@@ -0,0 +1,260 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+# Folder of the shared_buffer files: /dev/shm (memory) on Linux, the temporary folder
+# elsewhere
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Shared memory segments and files attached by a rendering worker, kept open for the
+# worker lifetime
+_ATTACHED = {}
+
+
+def catalog_plot_tasks(mass_min, mass_max, weighted=False, grouped=False):
+    """
+    Diagnostic plots of a full catalog.
+
+    Parameters:
+    ----------
+    mass_min : float
+        Minimum stellar mass of the run (in units of Msun).
+    mass_max : float
+        Maximum stellar mass of the run (in units of Msun).
+    weighted : bool
+        The catalog has star weights ('Weight' array, stratified sampling): the
+        histograms, density images and pie charts are weighted.
+    grouped : bool
+        The arrays come from catalog.Catalog.arrays() (stars grouped by class, with
+        a 'class_bounds' array): the per-class plots use slices instead of searching
+        every class.
+
+    Returns:
+    -------
+    list of tuple
+        (output file, plot function in plots.py, catalog arrays passed as positional
+        arguments, or as keyword arguments when written "keyword=array", keyword
+        arguments) for each of the seven plots.
+    """
+    weights = ("weights=Weight",) if weighted else ()
+    by_class = weights + (("bounds=class_bounds",) if grouped else ())
+    return [
+        ("mass_distribution_scatter.pdf", "plot_mass", ("Mass_i", "Prob"),
+         {"mass_min": mass_min, "mass_max": mass_max}),
+        ("mass_distribution_histogram.pdf", "plot_mass_histogram", ("Mass_i",) + weights, {}),
+        ("plot_mass_hist_per_remnant.pdf", "plot_mass_histogram_per_remnant", ("Mass_i", "Object") + by_class, {}),
+        ("plot_mass_age.pdf", "plot_mass_vs_age", ("Mass_f", "Age", "Object") + by_class, {}),
+        ("Born_time_histogram.pdf", "plot_born_times_histogram", ("Born_time",) + weights, {}),
+        ("Pie_plot.pdf", "pie_plot", ("Object",) + by_class, {}),
+        ("Pie_plot_remnant.pdf", "pie_plot_remnant", ("Object",) + by_class, {}),
+    ]
+
+
+def _array_arguments(array_names):
+    """
+    Splits the array names of a task into (keyword or None, array name) pairs.
+    """
+    return [tuple(name.split("=", 1)) if "=" in name else (None, name) for name in array_names]
+
+
+def aggregate_plot_tasks():
+    """
+    Diagnostic plots that can be drawn from CatalogAggregates (see aggregate_arrays).
+
+    Returns:
+    -------
+    list of tuple
+        Same layout as catalog_plot_tasks.
+    """
+    return [
+        ("mass_distribution_histogram.pdf", "plot_mass_histogram_binned", ("mass_edges", "mass_counts"), {}),
+        ("plot_mass_hist_per_remnant.pdf", "plot_mass_histogram_per_remnant_binned",
+         ("class_mass_edges", "class_mass_counts"), {}),
+        ("Born_time_histogram.pdf", "plot_born_times_histogram_binned", ("born_edges", "born_counts"), {}),
+        ("Pie_plot.pdf", "pie_plot_counts", ("class_counts",), {}),
+        ("Pie_plot_remnant.pdf", "pie_plot_remnant_counts", ("remnant_counts",), {}),
+    ]
+
+
+def aggregate_arrays(aggregates):
+    """
+    Arrays of CatalogAggregates used by aggregate_plot_tasks.
+    """
+    return {
+        "mass_edges": aggregates.mass_edges, "mass_counts": aggregates.mass_counts,
+        "class_mass_edges": aggregates.class_mass_edges, "class_mass_counts": aggregates.class_mass_counts,
+        "born_edges": aggregates.born_edges, "born_counts": aggregates.born_counts,
+        "class_counts": aggregates.class_counts, "remnant_counts": aggregates.class_counts[1:],
+    }
+
+
+def render_plot(task, arrays, outdir="Plots"):
+    """
+    Draws one plot on its own Figure (no pyplot state) and saves it to PDF.
+
+    Parameters:
+    ----------
+    task : tuple
+        (output file, plot function, array names, keyword arguments), see
+        catalog_plot_tasks.
+    arrays : dict
+        Arrays referenced by the task.
+    outdir : str
+        Output folder.
+
+    Returns:
+    -------
+    float
+        Rendering time (in seconds).
+    """
+    from matplotlib.figure import Figure
+    import plots
+
+    filename, function, array_names, kwargs = task
+    start = time.perf_counter()
+    fig = Figure(figsize=(10, 6))
+    ax = fig.add_subplot()
+    arguments = _array_arguments(array_names)
+    args = [arrays[name] for keyword, name in arguments if keyword is None]
+    kwargs = dict(kwargs, **{keyword: arrays[name] for keyword, name in arguments if keyword is not None})
+    getattr(plots, function)(*args, ax=ax, **kwargs)
+    fig.savefig(os.path.join(outdir, filename), format="pdf", dpi=300)
+    return time.perf_counter() - start
+
+
+def shared_buffer(size):
+    """
+    Allocates memory the plot workers can read without a copy: a memory-mapped
+    temporary file in SHARED_DIR. Lay the catalog out in it from the start
+    (pipeline.allocate_catalog(..., buffer=buffer)), pass it to render_plots as
+    `shared` and call release_shared_buffer once the plots are rendered.
+
+    Unlike a SharedMemory block, the mapping is never closed explicitly: it stays
+    valid as long as any view of the catalog (e.g. the returned DataFrame) exists.
+
+    Parameters:
+    ----------
+    size : int
+        Size in bytes (see pipeline.catalog_layout).
+
+    Returns:
+    -------
+    np.memmap
+        Writable uint8 buffer.
+    """
+    fd, path = tempfile.mkstemp(prefix="MC_Catalog_", suffix=".buf", dir=SHARED_DIR)
+    os.close(fd)
+    return np.memmap(path, dtype=np.uint8, mode="w+", shape=(max(size, 1),))
+
+
+def release_shared_buffer(buffer):
+    """
+    Removes the file of a shared_buffer. The memory is freed when the last view of
+    the buffer is (on Windows the file cannot be removed while it is mapped and is
+    left in the temporary folder).
+    """
+    try:
+        os.remove(buffer.filename)
+    except OSError:
+        pass
+
+
+def _shared_location(values, shared):
+    """
+    Byte offset of an array in a shared_buffer, or None if it is not a contiguous
+    view of it.
+    """
+    if shared is None or not values.flags.c_contiguous:
+        return None
+    offset = values.ctypes.data - shared.ctypes.data
+    return offset if 0 <= offset and offset + values.nbytes <= shared.nbytes else None
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def _render_shared(task, descriptors, outdir):
+    """
+    Renders a plot in a worker, reading the arrays from shared memory without copying.
+    """
+    arrays = {}
+    for _, name in _array_arguments(task[2]):
+        kind, location, offset, dtype, shape = descriptors[name]
+        if location not in _ATTACHED:
+            if kind == "file":
+                _ATTACHED[location] = np.memmap(location, dtype=np.uint8, mode="r")
+            else:
+                _ATTACHED[location] = shared_memory.SharedMemory(name=location)
+        buffer = _ATTACHED[location] if kind == "file" else _ATTACHED[location].buf
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+    return render_plot(task, arrays, outdir)
+
+
+def render_plots(arrays, tasks, outdir="Plots", workers=None, report=True, shared=None):
+    """
+    Renders the plots concurrently in a process pool with a headless backend. The
+    workers map the arrays that are views of the `shared` buffer without copying
+    them; the other arrays are copied once into SharedMemory blocks (for a catalog,
+    as much memory again as the plotted columns).
+
+    Parameters:
+    ----------
+    arrays : dict
+        Arrays referenced by the tasks (e.g. the catalog chunk from the pipeline).
+    tasks : list of tuple
+        Plots to render (see catalog_plot_tasks).
+    outdir : str
+        Output folder.
+    workers : int, optional
+        Number of rendering processes. Defaults to one per plot, up to the number of
+        CPUs. With 1 the plots are rendered in the calling process.
+    report : bool
+        Print the rendering time of every plot.
+    shared : np.memmap, optional
+        shared_buffer the catalog was allocated in.
+
+    Returns:
+    -------
+    dict
+        Rendering time (in seconds) of every output file.
+    """
+    workers = workers or min(len(tasks), os.cpu_count() or 1)
+    start = time.perf_counter()
+    os.makedirs(outdir, exist_ok=True)
+
+    if workers <= 1:
+        timings = {task[0]: render_plot(task, arrays, outdir) for task in tasks}
+    else:
+        segments = []
+        try:
+            descriptors = {}
+            for name in {name for task in tasks for _, name in _array_arguments(task[2])}:
+                values = np.asarray(arrays[name])
+                offset = _shared_location(values, shared)
+                if offset is not None:
+                    descriptors[name] = ("file", shared.filename, offset, values.dtype.str, values.shape)
+                    continue
+                values = np.ascontiguousarray(values)
+                shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+                segments.append(shm)
+                np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[...] = values
+                descriptors[name] = ("shm", shm.name, 0, values.dtype.str, values.shape)
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                futures = {task[0]: executor.submit(_render_shared, task, descriptors, outdir) for task in tasks}
+                timings = {filename: future.result() for filename, future in futures.items()}
+        finally:
+            for shm in segments:
+                shm.close()
+                shm.unlink()
+
+    if report:
+        for filename, seconds in timings.items():
+            print(f"Plot {filename} rendered in {seconds:.2f} s")
+        print(f"{len(tasks)} plots rendered in {time.perf_counter() - start:.2f} s with {workers} worker(s)")
+    return timings
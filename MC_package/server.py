@@ -0,0 +1,622 @@
+import argparse
+import collections
+import functools
+import http.client
+import http.server
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import threading
+import time
+import numpy as np
+from aggregates import CatalogAggregates
+from catalog_io import StreamCatalogWriter, read_catalog_stream
+from counter_rng import StarStream
+from galaxy import parse_galaxy
+from pipeline import (BLOCK_SIZE, RNG_MODES, block_rng, block_sizes, catalog_columns, generate_block,
+                      make_block_buffers)
+from sfh import parse_sfh
+
+# Default address of the server (TCP on the loopback interface only)
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Parameters of a generation or aggregate request and their defaults (as in main.py).
+# start and stop select a range of stars of a counter-mode run instead of the N_p stars
+REQUEST_DEFAULTS = {
+    "N_p": None, "seed": 0, "mass_min": 0.08, "mass_max": 100, "sampler": "inverse", "sfh": "constant",
+    "rng_mode": "block", "galaxy": None, "compact": False, "start": None, "stop": None,
+}
+
+SAMPLERS = ("inverse", "rejection", "stratified")
+
+# Galaxy models kept built between requests (the SFHs are cached by parse_sfh)
+GALAXY_CACHE_SIZE = 32
+
+# Latencies kept per endpoint for the percentiles of the metrics
+METRICS_WINDOW = 4096
+
+# Content type of the generation responses (see catalog_io.StreamCatalogWriter)
+STREAM_CONTENT_TYPE = "application/x-mc-catalog-stream"
+
+_parse_galaxy = functools.lru_cache(maxsize=GALAXY_CACHE_SIZE)(parse_galaxy)
+
+
+class ServerBusy(RuntimeError):
+    """
+    Raised when no generation slot frees up in time (HTTP 503 on the wire).
+    """
+
+
+def _integer(value, name):
+    """
+    Integer value of a request parameter (JSON numbers such as 1e6 are accepted).
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != int(value):
+        raise ValueError(f"{name} must be an integer, not {value!r}.")
+    return int(value)
+
+
+class LatencyMetrics:
+    """
+    Thread-safe request counters and latency percentiles of the server, per endpoint:
+    requests, batched items, stars, errors and rejections, plus the mean, median,
+    90th and 99th percentiles and maximum of the total latency and of the wait for a
+    generation slot over the last `window` requests.
+
+    Parameters
+    ----------
+    window : int
+        Number of recent requests the percentiles are computed over.
+    """
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(collections.Counter)
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._waits = collections.defaultdict(lambda: collections.deque(maxlen=window))
+
+    def count(self, endpoint, event, n=1):
+        """
+        Increments a counter of an endpoint (e.g. "rejected" or "bad_requests").
+        """
+        with self._lock:
+            self._counters[endpoint][event] += n
+
+    def record(self, endpoint, latency, wait, items=1, stars=0, failed=False):
+        """
+        Records a served request: its latency and slot wait (in seconds), the number
+        of items of its batch and of stars sent, and whether it failed.
+        """
+        with self._lock:
+            counters = self._counters[endpoint]
+            counters["requests"] += 1
+            counters["items"] += items
+            counters["stars"] += stars
+            counters["errors"] += bool(failed)
+            counters["busy_time"] += latency - wait
+            self._latencies[endpoint].append(latency)
+            self._waits[endpoint].append(wait)
+
+    @staticmethod
+    def _summary(values):
+        if not values:
+            return None
+        p50, p90, p99 = np.percentile(values, [50, 90, 99]) * 1000
+        return {"mean_ms": float(np.mean(values)) * 1000, "p50_ms": p50, "p90_ms": p90, "p99_ms": p99,
+                "max_ms": max(values) * 1000}
+
+    def snapshot(self):
+        """
+        JSON-serializable state of the metrics.
+        """
+        with self._lock:
+            endpoints = {}
+            for endpoint, counters in self._counters.items():
+                data = dict(counters)
+                busy_time = data.pop("busy_time", 0)
+                data["stars_per_second"] = data.get("stars", 0) / busy_time if busy_time else None
+                data["latency"] = self._summary(list(self._latencies[endpoint]))
+                data["slot_wait"] = self._summary(list(self._waits[endpoint]))
+                endpoints[endpoint] = data
+        return {"uptime": time.time() - self.started, "endpoints": endpoints}
+
+
+class GenerationService:
+    """
+    Generation engine of the server, shared by all the connections.
+
+    The modules stay imported, the SFH and galaxy tables built by a request are
+    cached for the next ones, and every generation slot owns a set of block work
+    arrays (make_block_buffers) reused by all the requests it serves, so a request
+    only pays for its stars. At most max_concurrent requests are generated at the
+    same time; up to max_queue more wait (max_wait seconds at most) for a slot and
+    the others are rejected with ServerBusy. A batch (list of requests) is served
+    in a single slot and response.
+
+    Parameters
+    ----------
+    max_concurrent : int, optional
+        Number of generation slots (default: min(4, CPU count)).
+    max_queue : int
+        Number of requests allowed to wait for a slot.
+    max_wait : float
+        Seconds a request waits for a slot before being rejected.
+    max_stars : int
+        Largest number of stars (or IMF trials) of one request.
+    """
+
+    def __init__(self, max_concurrent=None, max_queue=64, max_wait=10.0, max_stars=10**9):
+        self.max_concurrent = max_concurrent or min(4, os.cpu_count() or 1)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_stars = max_stars
+        self.metrics = LatencyMetrics()
+        self._slots = queue.LifoQueue()
+        for _ in range(self.max_concurrent):
+            self._slots.put(make_block_buffers())
+        self._waiting = 0
+        self._lock = threading.Lock()
+
+    def warm_up(self, sfh_specs=(), galaxy_specs=()):
+        """
+        Builds the tables of the given SFH and galaxy specifications and generates a
+        small block with every sampler, so the first requests do not pay for them.
+
+        Returns:
+        -------
+        float
+            Duration of the warm-up (in seconds).
+        """
+        start = time.perf_counter()
+        for spec in sfh_specs:
+            parse_sfh(spec)
+        for spec in galaxy_specs:
+            _parse_galaxy(spec)
+        buffers = self._slots.get()
+        try:
+            for sampler in SAMPLERS:
+                generate_block(1024, block_rng(0, 0), 0.08, 100, sampler, buffers=buffers)
+        finally:
+            self._slots.put(buffers)
+        return time.perf_counter() - start
+
+    def prepare(self, request):
+        """
+        Checks a request, fills in its defaults and builds its SFH and galaxy model.
+
+        Parameters:
+        ----------
+        request : dict
+            Parameters of the request (see REQUEST_DEFAULTS); "sfh" and "galaxy" are
+            specifications as on the command line of main.py.
+
+        Returns:
+        -------
+        dict
+            The 'metadata' of the catalog (as written by main.py, plus 'start' and
+            'stop' for a range), its 'columns' and its 'sfh' and 'galaxy' objects.
+        """
+        if not isinstance(request, dict):
+            raise ValueError("A request is a JSON object, or a list of objects for a batch.")
+        unknown = set(request) - set(REQUEST_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown request parameters: {', '.join(sorted(unknown))} "
+                             f"(use {', '.join(REQUEST_DEFAULTS)})")
+        params = dict(REQUEST_DEFAULTS, **request)
+        if params["sampler"] not in SAMPLERS:
+            raise ValueError(f"Unknown sampler: {params['sampler']} (use one of {', '.join(SAMPLERS)})")
+        if params["rng_mode"] not in RNG_MODES:
+            raise ValueError(f"Unknown random number mode: {params['rng_mode']} (use one of {', '.join(RNG_MODES)})")
+        if params["rng_mode"] == "counter" and params["sampler"] != "inverse":
+            raise ValueError(f"Counter-based generation needs the inverse sampler, not {params['sampler']}.")
+        mass_min, mass_max = float(params["mass_min"]), float(params["mass_max"])
+        if not 0 < mass_min < mass_max:
+            raise ValueError("The mass limits must satisfy 0 < mass_min < mass_max.")
+
+        metadata = {"N_p": None, "seed": _integer(params["seed"], "seed"), "mass_min": mass_min,
+                    "mass_max": mass_max, "sampler": params["sampler"], "compact": bool(params["compact"])}
+        if params["start"] is not None or params["stop"] is not None:
+            if params["rng_mode"] != "counter":
+                raise ValueError("Ranges of stars (start, stop) need the counter random number mode.")
+            start, stop = _integer(params["start"], "start"), _integer(params["stop"], "stop")
+            if not 0 <= start <= stop:
+                raise ValueError("The range of stars must satisfy 0 <= start <= stop.")
+            metadata.update(start=start, stop=stop)
+            n = stop - start
+        else:
+            if params["N_p"] is None:
+                raise ValueError("N_p (or a start-stop range in counter mode) is required.")
+            n = _integer(params["N_p"], "N_p")
+            if n < 0:
+                raise ValueError("N_p must be non-negative.")
+        if n > self.max_stars:
+            raise ValueError(f"At most {self.max_stars} stars per request.")
+        if params["N_p"] is not None:
+            metadata["N_p"] = _integer(params["N_p"], "N_p")
+
+        sfh = None if params["sfh"] == "constant" else parse_sfh(params["sfh"])
+        galaxy = None if params["galaxy"] is None else _parse_galaxy(params["galaxy"])
+        metadata.update(sfh="constant" if sfh is None else sfh.name, rng_mode=params["rng_mode"],
+                        galaxy=None if galaxy is None else galaxy.name)
+        return {"metadata": metadata, "columns": catalog_columns(params["sampler"], galaxy), "sfh": sfh,
+                "galaxy": galaxy}
+
+    def prepare_batch(self, payload):
+        """
+        Prepares a request or a batch (list) of requests (see prepare).
+        """
+        requests = payload if isinstance(payload, list) else [payload]
+        if not requests:
+            raise ValueError("Empty batch.")
+        return [self.prepare(request) for request in requests]
+
+    def acquire(self, endpoint):
+        """
+        Waits for a free generation slot and returns its work arrays.
+        """
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                rejected = True
+            else:
+                rejected = False
+                self._waiting += 1
+        if not rejected:
+            try:
+                return self._slots.get(timeout=self.max_wait)
+            except queue.Empty:
+                pass
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+        self.metrics.count(endpoint, "rejected")
+        raise ServerBusy(f"All {self.max_concurrent} generation slots are busy, retry later.")
+
+    def release(self, buffers):
+        """
+        Returns the work arrays of a slot taken with acquire.
+        """
+        self._slots.put(buffers)
+
+    def status(self):
+        """
+        Metrics of the server plus the state of the slots.
+        """
+        status = self.metrics.snapshot()
+        with self._lock:
+            waiting = self._waiting
+        status.update(max_concurrent=self.max_concurrent, busy_slots=self.max_concurrent - self._slots.qsize(),
+                      waiting=waiting)
+        return status
+
+    @staticmethod
+    def _chunks(job, buffers, galaxy=None):
+        """
+        Generates the stars of a prepared request one block at a time, with the work
+        arrays of a slot (every chunk is only valid until the next one).
+        """
+        p = job["metadata"]
+        if "start" in p:
+            blocks = ((min(BLOCK_SIZE, p["stop"] - first), StarStream(p["seed"], first))
+                      for first in range(p["start"], p["stop"], BLOCK_SIZE))
+        else:
+            blocks = ((n, block_rng(p["seed"], block, p["rng_mode"]))
+                      for block, n in enumerate(block_sizes(p["N_p"])))
+        for n, rng in blocks:
+            yield generate_block(n, rng, p["mass_min"], p["mass_max"], p["sampler"], buffers=buffers,
+                                 sfh=job["sfh"], galaxy=galaxy)
+
+    def stream_catalogs(self, jobs, file, buffers):
+        """
+        Generates prepared requests and streams their catalogs, one after the other,
+        in the catalog stream format. A failed request ends with an "error" record
+        and the next ones are still served.
+
+        Returns:
+        -------
+        tuple
+            Number of stars sent and whether a request failed.
+        """
+        stars, failed = 0, False
+        for job in jobs:
+            writer = StreamCatalogWriter(file, job["metadata"], job["columns"], job["metadata"]["compact"])
+            try:
+                for chunk in self._chunks(job, buffers, job["galaxy"]):
+                    writer.write(chunk)
+            except ConnectionError:
+                # The client is gone
+                raise
+            except Exception as error:
+                writer.close(error)
+                failed = True
+                continue
+            writer.close()
+            stars += writer.n_rows
+        return stars, failed
+
+    def aggregate(self, jobs, buffers):
+        """
+        Generates prepared requests in aggregate-only mode (the positions are not
+        drawn, they do not change the aggregates).
+
+        Returns:
+        -------
+        list of dict
+            'metadata' and 'aggregates' (CatalogAggregates.to_dict) of every request.
+        """
+        results = []
+        for job in jobs:
+            p = job["metadata"]
+            aggregates = CatalogAggregates(p["mass_min"], p["mass_max"])
+            for chunk in self._chunks(job, buffers):
+                aggregates.update(chunk)
+            results.append({"metadata": p, "aggregates": aggregates.to_dict()})
+        return results
+
+
+class _ChunkedStream:
+    """
+    Writes to an HTTP response with the chunked transfer encoding.
+    """
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, data):
+        if data:
+            self.wfile.write(b"%X\r\n" % len(data))
+            self.wfile.write(data)
+            self.wfile.write(b"\r\n")
+
+    def close(self):
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class ServiceHandler(http.server.BaseHTTPRequestHandler):
+    """
+    HTTP/1.1 endpoints of the server (keep-alive connections):
+
+    - POST /generate: JSON request or batch, answered with the catalog stream
+    - POST /aggregate: JSON request or batch, answered with the aggregates in JSON
+    - GET /metrics: counters and latencies (GenerationService.status)
+    - GET /health
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "MC_StarGen"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "local"
+
+    def _send_json(self, data, status=200, headers=()):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send_json(self.server.service.status())
+        elif self.path == "/health":
+            self._send_json({"status": "ok"})
+        else:
+            self._send_json({"error": f"Unknown endpoint: {self.path}"}, 404)
+
+    def do_POST(self):
+        received = time.perf_counter()
+        service = self.server.service
+        endpoint = self.path
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if endpoint not in ("/generate", "/aggregate"):
+            self._send_json({"error": f"Unknown endpoint: {endpoint}"}, 404)
+            return
+        try:
+            payload = json.loads(body or b"{}")
+            jobs = service.prepare_batch(payload)
+        except (ValueError, OSError) as error:
+            service.metrics.count(endpoint, "bad_requests")
+            self._send_json({"error": str(error)}, 400)
+            return
+        try:
+            buffers = service.acquire(endpoint)
+        except ServerBusy as error:
+            self._send_json({"error": str(error)}, 503, [("Retry-After", "1")])
+            return
+
+        wait = time.perf_counter() - received
+        stars, failed = 0, True
+        try:
+            if endpoint == "/generate":
+                self.send_response(200)
+                self.send_header("Content-Type", STREAM_CONTENT_TYPE)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                stream = _ChunkedStream(self.wfile)
+                stars, failed = service.stream_catalogs(jobs, stream, buffers)
+                stream.close()
+            else:
+                try:
+                    results = service.aggregate(jobs, buffers)
+                except Exception as error:
+                    self._send_json({"error": str(error)}, 500)
+                else:
+                    self._send_json(results if isinstance(payload, list) else results[0])
+                    stars, failed = sum(int(np.sum(result["aggregates"]["class_counts"])) for result in results), False
+        except OSError:
+            # The client closed the connection during the response
+            self.close_connection = True
+        finally:
+            service.release(buffers)
+            service.metrics.record(endpoint, time.perf_counter() - received, wait, len(jobs), stars, failed)
+
+
+class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, verbose=False):
+    """
+    Creates the HTTP server of a GenerationService, one thread per connection.
+
+    Parameters:
+    ----------
+    service : GenerationService
+        Engine serving the requests.
+    host, port : str, int
+        TCP address (the loopback interface by default; port 0 picks a free port).
+    socket_path : str, optional
+        Listen on this Unix socket (readable by the current user only) instead.
+    verbose : bool
+        Log every request on stderr.
+
+    Returns:
+    -------
+    socketserver.BaseServer
+        Server to run with serve_forever().
+    """
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = _UnixHTTPServer(socket_path, ServiceHandler)
+        os.chmod(socket_path, 0o600)
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), ServiceHandler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def request(address, path, payload=None, timeout=None):
+    """
+    Sends a request to a running server.
+
+    Parameters:
+    ----------
+    address : str
+        "HOST:PORT", "PORT" or "unix:PATH".
+    path : str
+        Endpoint, e.g. "/generate" (POST with a payload) or "/metrics" (GET).
+    payload : dict or list, optional
+        JSON request or batch.
+    timeout : float, optional
+        Socket timeout (in seconds).
+
+    Returns:
+    -------
+    http.client.HTTPResponse
+        Response with status 200, read as it arrives.
+    """
+    if address.startswith("unix:"):
+        connection = _UnixConnection(address[len("unix:"):], timeout)
+    else:
+        host, _, port = address.rpartition(":")
+        connection = http.client.HTTPConnection(host or DEFAULT_HOST, int(port), timeout=timeout)
+    if payload is None:
+        connection.request("GET", path)
+    else:
+        connection.request("POST", path, json.dumps(payload), {"Content-Type": "application/json"})
+    response = connection.getresponse()
+    if response.status != 200:
+        error = json.loads(response.read() or b"{}").get("error", response.reason)
+        connection.close()
+        raise (ServerBusy if response.status == 503 else RuntimeError)(f"HTTP {response.status}: {error}")
+    return response
+
+
+def fetch_catalogs(address, requests, timeout=None):
+    """
+    Generates catalogs on a running server.
+
+    Returns:
+    -------
+    tuple or list of tuple
+        (columns, metadata) of the catalog, or of every catalog of a batch (list of
+        requests), as returned by catalog_io.read_catalog.
+    """
+    with request(address, "/generate", requests, timeout) as response:
+        catalogs = read_catalog_stream(response)
+    return catalogs if isinstance(requests, list) else catalogs[0]
+
+
+def fetch_aggregates(address, requests, timeout=None):
+    """
+    Computes the aggregates of runs on a running server.
+
+    Returns:
+    -------
+    CatalogAggregates or list of CatalogAggregates
+        Aggregates of the run, or of every run of a batch (list of requests).
+    """
+    with request(address, "/aggregate", requests, timeout) as response:
+        results = json.load(response)
+    if isinstance(requests, list):
+        return [CatalogAggregates.from_dict(result["aggregates"]) for result in results]
+    return CatalogAggregates.from_dict(results["aggregates"])
+
+
+def _terminate(signum, frame):
+    # Stop serve_forever on SIGTERM as on Ctrl-C, so the socket file is removed
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve MC_StarGen catalogs and aggregates from a warm process.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"TCP interface (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"TCP port (default: {DEFAULT_PORT})")
+    parser.add_argument("--socket", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--max-concurrent", type=int, help="requests generated at the same time "
+                                                           "(default: min(4, CPU count))")
+    parser.add_argument("--max-queue", type=int, default=64, help="requests waiting for a slot (default: 64)")
+    parser.add_argument("--max-wait", type=float, default=10.0, help="seconds a request waits for a slot (default: 10)")
+    parser.add_argument("--max-stars", type=float, default=1e9, help="stars per request (default: 1e9)")
+    parser.add_argument("--warm-sfh", nargs="+", default=[], metavar="SPEC", help="SFHs to build at startup")
+    parser.add_argument("--warm-galaxy", nargs="+", default=[], metavar="SPEC",
+                        help="galaxy models to build at startup")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    service = GenerationService(args.max_concurrent, args.max_queue, args.max_wait, int(args.max_stars))
+    warm_up_time = service.warm_up(args.warm_sfh, args.warm_galaxy)
+    server = make_server(service, args.host, args.port, args.socket, args.verbose)
+    address = f"unix:{args.socket}" if args.socket else "%s:%d" % server.server_address[:2]
+    print(f"Serving on {address} with {service.max_concurrent} generation slots "
+          f"(warm-up {warm_up_time:.2f} s)", flush=True)
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket:
+            os.remove(args.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,286 @@
+import functools
+import hashlib
+import os
+import numpy as np
+from aggregates import GALAXY_AGE
+
+# Number of points of the cumulative tables of the analytic and tabulated SFHs
+SFH_GRID_SIZE = 4097
+
+# Bins of the guide table of the inverse-CDF lookup (uniform bins of the quantiles)
+GUIDE_SIZE = 2**16
+
+# Points added around every burst of burst_sfh, over +- BURST_SPAN widths
+BURST_GRID_SIZE = 257
+BURST_SPAN = 6
+
+
+class StarFormationHistory:
+    """
+    Star formation history SFR(t) over [0, GALAXY_AGE] Myr (t = 0 is the birth of
+    the galaxy), linear between the points of a time grid.
+
+    The cumulative distribution of the birth times is tabulated once, on
+    construction, so birth times are drawn in batch by inverse-CDF lookup: the grid
+    cell of every uniform draw is found in the table and the time is interpolated
+    linearly inside the cell. A guide table over GUIDE_SIZE uniform quantile bins gives
+    the cell directly for the draws falling in a bin without cell boundary; only the
+    others are binary searched (np.searchsorted). The cost hardly depends on the
+    shape of the SFH.
+
+    Parameters
+    ----------
+    times : array-like
+        Increasing grid times (in Myr), covering the part of [0, GALAXY_AGE] where
+        stars form. The SFR is zero outside the grid.
+    rates : array-like
+        SFR at the grid times (any units, >= 0).
+    name : str
+        Description of the SFH (stored in the run metadata).
+    """
+
+    def __init__(self, times, rates, name="tabulated"):
+        times = np.asarray(times, dtype=np.float64)
+        rates = np.asarray(rates, dtype=np.float64)
+        if times.ndim != 1 or times.shape != rates.shape or len(times) < 2:
+            raise ValueError("The SFH needs 1-D times and rates of the same length (at least 2 points).")
+        if np.any(np.diff(times) <= 0) or times[0] < 0 or times[-1] > GALAXY_AGE:
+            raise ValueError(f"The SFH times must be increasing within [0, {GALAXY_AGE}] Myr.")
+        if not np.all(np.isfinite(rates)) or np.any(rates < 0):
+            raise ValueError("The SFR must be finite and non-negative.")
+
+        # Trapezoidal integral of the piecewise-linear SFR
+        cumulative = np.concatenate(([0.0], np.cumsum(np.diff(times) * (rates[1:] + rates[:-1]) / 2)))
+        if cumulative[-1] <= 0:
+            raise ValueError("The SFR integrates to zero.")
+        self.name = name
+        self.times = times
+        self.rates = rates / cumulative[-1]
+        self.cdf = cumulative / cumulative[-1]
+        # Inverse slope of every cell (zero in cells without star formation, never
+        # used, and in cells of negligible SFR, whose draws go to the cell start)
+        dc = np.diff(self.cdf)
+        with np.errstate(over="ignore"):
+            slopes = np.divide(np.diff(times), dc, out=np.zeros_like(dc), where=dc > 0)
+        self._slopes = np.where(np.isfinite(slopes), slopes, 0.0)
+        # Cell of the quantiles of every bin [k, k + 1) / GUIDE_SIZE, or -1 for the
+        # bins containing a cell boundary
+        guide = self._cells(np.linspace(0, 1, GUIDE_SIZE + 1))
+        self._guide = np.where(guide[:-1] == guide[1:], guide[:-1], -1)
+
+    def __repr__(self):
+        return f"StarFormationHistory({self.name!r}, {len(self.times)} points)"
+
+    def pdf(self, t):
+        """
+        Normalized birth time density (per Myr) at the times t.
+        """
+        return np.interp(t, self.times, self.rates, left=0.0, right=0.0)
+
+    def cdf_at(self, t):
+        """
+        Fraction of the stars born before the times t.
+        """
+        return np.interp(t, self.times, self.cdf, left=0.0, right=1.0)
+
+    def _cells(self, u):
+        """
+        Cell j of the quantiles u, with cdf[j] <= u < cdf[j + 1] (so the cell has a
+        non-zero SFR).
+        """
+        return np.searchsorted(self.cdf, u, side="right").clip(1, len(self.cdf) - 1) - 1
+
+    def ppf(self, u):
+        """
+        Birth times of the quantiles u in [0, 1).
+        """
+        u = np.asarray(u, dtype=np.float64)
+        j = self._guide.take(np.minimum(u * GUIDE_SIZE, GUIDE_SIZE - 1).astype(np.intp))
+        search = np.flatnonzero(j < 0)
+        j[search] = self._cells(u[search])
+        return self.times[j] + (u - self.cdf[j]) * self._slopes[j]
+
+    def sample(self, n, rng=None):
+        """
+        Draws n birth times (in Myr).
+
+        Parameters:
+        ----------
+        n : int
+            Number of stars.
+        rng : np.random.Generator, optional
+            Random generator to draw from. Defaults to the global np.random state.
+
+        Returns:
+        -------
+        np.ndarray
+            Birth times, one uniform draw per star.
+        """
+        rng = np.random if rng is None else rng
+        return self.ppf(rng.uniform(0, 1, n))
+
+    def digest(self):
+        """
+        Hash of the cumulative table, identifying the SFH in cache keys.
+        """
+        return hashlib.sha256(self.times.tobytes() + self.cdf.tobytes()).hexdigest()[:16]
+
+
+def _grid(extra=()):
+    """
+    Time grid of SFH_GRID_SIZE points over [0, GALAXY_AGE] plus the extra points
+    inside it.
+    """
+    extra = np.asarray(extra, dtype=np.float64)
+    return np.union1d(np.linspace(0, GALAXY_AGE, SFH_GRID_SIZE), extra[(extra > 0) & (extra < GALAXY_AGE)])
+
+
+@functools.lru_cache(maxsize=None)
+def constant_sfh():
+    """
+    Constant SFR: uniform birth times, the default of generate_times. The table has
+    only the two end points, so the draws are identical to rng.uniform(0, GALAXY_AGE).
+    """
+    return StarFormationHistory([0.0, GALAXY_AGE], [1.0, 1.0], "constant")
+
+
+@functools.lru_cache(maxsize=None)
+def exponential_sfh(tau):
+    """
+    Exponentially declining SFR, exp(-t / tau) (rising for tau < 0).
+
+    Parameters:
+    ----------
+    tau : float
+        e-folding time (in Myr), non-zero.
+    """
+    if tau == 0 or not np.isfinite(tau):
+        raise ValueError(f"The e-folding time of an exponential SFH must be finite and non-zero (got {tau}).")
+    t = _grid()
+    # Normalize at the SFR peak (t = 0, or GALAXY_AGE when rising) to avoid overflows
+    t_peak = GALAXY_AGE if tau < 0 else 0.0
+    return StarFormationHistory(t, np.exp(-(t - t_peak) / tau), f"exponential:{tau:g}")
+
+
+@functools.lru_cache(maxsize=None)
+def delayed_sfh(tau):
+    """
+    Delayed exponential SFR, t exp(-t / tau), peaking at t = tau.
+
+    Parameters:
+    ----------
+    tau : float
+        e-folding time (in Myr), positive.
+    """
+    if not 0 < tau < np.inf:
+        raise ValueError(f"The e-folding time of a delayed SFH must be finite and positive (got {tau}).")
+    t = _grid()
+    return StarFormationHistory(t, t / tau * np.exp(-t / tau), f"delayed:{tau:g}")
+
+
+@functools.lru_cache(maxsize=None)
+def burst_sfh(bursts, base=1.0):
+    """
+    Bursty SFR: a constant base rate plus Gaussian bursts. The grid is refined around
+    every burst, so bursts narrower than the default grid spacing are resolved.
+
+    Parameters:
+    ----------
+    bursts : tuple of (time, width, amplitude)
+        Center and standard deviation of every burst (in Myr) and its peak SFR in
+        units of the base rate.
+    base : float
+        Constant SFR between the bursts (0 for bursts only).
+
+    Returns:
+    -------
+    StarFormationHistory
+    """
+    extra = [np.linspace(center - BURST_SPAN * width, center + BURST_SPAN * width, BURST_GRID_SIZE)
+             for center, width, _ in bursts]
+    t = _grid(np.concatenate(extra) if extra else ())
+    rates = np.full_like(t, base)
+    for center, width, amplitude in bursts:
+        rates += amplitude * np.exp(-0.5 * ((t - center) / width) ** 2)
+    spec = ",".join(f"{center:g}/{width:g}/{amplitude:g}" for center, width, amplitude in bursts)
+    return StarFormationHistory(t, rates, f"burst:{spec}" + ("" if base == 1.0 else f":{base:g}"))
+
+
+def tabulated_sfh(times, rates, name="tabulated"):
+    """
+    SFH from a user-supplied table of SFR(t), linear between the points and zero
+    outside them. The table is resampled on the SFH_GRID_SIZE grid (keeping its own
+    points) and clipped to [0, GALAXY_AGE].
+
+    Parameters:
+    ----------
+    times : array-like
+        Increasing times (in Myr).
+    rates : array-like
+        SFR at those times (any units, >= 0).
+    name : str
+        Description of the SFH.
+
+    Returns:
+    -------
+    StarFormationHistory
+    """
+    times = np.asarray(times, dtype=np.float64)
+    rates = np.asarray(rates, dtype=np.float64)
+    if times.ndim != 1 or times.shape != rates.shape or np.any(np.diff(times) <= 0):
+        raise ValueError("The SFR table needs increasing times and one rate per time.")
+    t = _grid(times)
+    return StarFormationHistory(t, np.interp(t, times, rates, left=0.0, right=0.0), name)
+
+
+@functools.lru_cache(maxsize=None)
+def _table_sfh(path, mtime):
+    times, rates = np.loadtxt(path, ndmin=2, unpack=True)[:2]
+    sfh = tabulated_sfh(times, rates)
+    sfh.name = f"table:{sfh.digest()}"
+    return sfh
+
+
+def parse_sfh(spec):
+    """
+    Builds an SFH from a command line specification:
+
+    - "constant"
+    - "exponential:TAU" (TAU in Myr, non-zero, negative for a rising SFR)
+    - "delayed:TAU" (TAU in Myr, positive)
+    - "burst:T/W/A[,T/W/A...][:BASE]" (Gaussian bursts at T Myr of width W Myr and
+      peak A times the base rate, BASE = 1 by default)
+    - "table:PATH" (text file with two columns, time in Myr and SFR)
+
+    The SFHs and their cumulative tables are cached, so repeated runs in the same
+    process build them once.
+
+    Parameters:
+    ----------
+    spec : str
+        Specification of the SFH.
+
+    Returns:
+    -------
+    StarFormationHistory
+    """
+    kind, _, args = spec.partition(":")
+    try:
+        if kind == "constant":
+            return constant_sfh()
+        if kind == "exponential":
+            return exponential_sfh(float(args))
+        if kind == "delayed":
+            return delayed_sfh(float(args))
+        if kind == "burst":
+            bursts, _, base = args.partition(":")
+            bursts = tuple(tuple(float(x) for x in burst.split("/")) for burst in bursts.split(","))
+            if any(len(burst) != 3 for burst in bursts):
+                raise ValueError
+            return burst_sfh(bursts, float(base) if base else 1.0)
+    except ValueError as error:
+        detail = f". {error}" if str(error) else ""
+        raise ValueError(f"Invalid SFH specification: {spec!r}{detail}") from error
+    if kind == "table":
+        return _table_sfh(args, os.path.getmtime(args))
+    raise ValueError(f"Unknown SFH: {spec!r} (constant, exponential, delayed, burst or table)")
@@ -0,0 +1,220 @@
+import numpy as np
+
+# Maximum number of stars in a leaf of the tree
+LEAF_SIZE = 256
+
+# Bits of the quantized coordinates interleaved into the Morton codes (3 x 21 <= 64)
+MORTON_BITS = 21
+
+# Position of a tree node relative to a query region
+OUTSIDE, CROSSING, INSIDE = 0, 1, 2
+
+
+def _ranges(starts, stops):
+    """
+    Concatenation of the integer ranges [starts[i], stops[i]).
+    """
+    lengths = stops - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+
+
+def _spread_bits(v):
+    """
+    Spreads the MORTON_BITS low bits of v (uint64) two zero bits apart.
+    """
+    for shift, mask in ((32, 0x1F00000000FFFF), (16, 0x1F0000FF0000FF), (8, 0x100F00F00F00F00F),
+                        (4, 0x10C30C30C30C30C3), (2, 0x1249249249249249)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def morton_order(coords):
+    """
+    Permutation sorting points along the Z-order (Morton) curve of a cubic grid of
+    2**MORTON_BITS cells per axis over their bounding box.
+
+    Parameters:
+    ----------
+    coords : np.ndarray
+        (3, n) coordinates.
+
+    Returns:
+    -------
+    np.ndarray
+        Indices of the points in curve order.
+    """
+    low = coords.min(axis=1, keepdims=True)
+    # Same cell size on all axes, so that the cells (and tree nodes) stay compact
+    scale = (2**MORTON_BITS - 1) / max(float(np.max(coords.max(axis=1, keepdims=True) - low)), 1e-300)
+    codes = np.zeros(coords.shape[1], dtype=np.uint64)
+    for axis in range(3):
+        cells = ((coords[axis] - low[axis]) * scale).astype(np.uint64)
+        codes |= _spread_bits(cells) << np.uint64(axis)
+    return np.argsort(codes)
+
+
+class SpatialIndex:
+    """
+    Bounding box tree over the positions of the stars, answering sphere, box and cone
+    queries without scanning the catalog.
+
+    The stars are sorted once along a Z-order (Morton) curve, which keeps neighbours
+    in space close in memory, and cut into leaves of leaf_size consecutive stars. A
+    complete binary tree over the leaves (node i has children 2i + 1 and 2i + 2)
+    stores the bounding box of the stars of every node, computed bottom-up in
+    vectorized passes, so building costs one sort. A query walks the tree one level
+    at a time, vectorized over the nodes of the level: nodes outside the region are
+    dropped, nodes inside it are returned whole, and only the stars of the leaves
+    crossing its boundary are tested, so the cost grows with the number of stars
+    found rather than with the catalog size.
+
+    Parameters
+    ----------
+    x, y, z : array-like
+        Positions of the stars (e.g. the 'X', 'Y' and 'Z' catalog columns, in kpc).
+    leaf_size : int
+        Number of stars per leaf.
+    """
+
+    def __init__(self, x, y, z, leaf_size=LEAF_SIZE):
+        coords = np.array([x, y, z], dtype=np.float64).reshape(3, -1)
+        n = coords.shape[1]
+        self.order = morton_order(coords) if n else np.arange(0)
+        self.points = np.ascontiguousarray(coords[:, self.order].T)
+
+        # Complete binary tree of depth d over 2**d >= n / leaf_size leaves; the
+        # leaves past the last star are empty
+        depth = max(0, int(np.ceil(np.log2(max(1, -(-n // leaf_size))))))
+        leaf_starts = np.minimum(np.arange(2**depth) * leaf_size, n)
+        leaf_stops = np.minimum(leaf_starts + leaf_size, n)
+        filled = leaf_stops > leaf_starts
+        lows = np.full((2**depth, 3), np.inf)
+        highs = np.full((2**depth, 3), -np.inf)
+        if filled.any():
+            lows[filled] = np.minimum.reduceat(self.points, leaf_starts[filled], axis=0)
+            highs[filled] = np.maximum.reduceat(self.points, leaf_starts[filled], axis=0)
+
+        # Levels from the leaves up; the nodes of every level follow those above it
+        levels = [(leaf_starts, leaf_stops, lows, highs)]
+        while len(levels[0][0]) > 1:
+            starts, stops, lows, highs = levels[0]
+            levels.insert(0, (starts[::2], stops[1::2], np.minimum(lows[::2], lows[1::2]),
+                              np.maximum(highs[::2], highs[1::2])))
+        self.starts, self.stops, self.lows, self.highs = (np.concatenate(arrays) for arrays in zip(*levels))
+        n_nodes = len(self.starts)
+        self.children = np.where(np.arange(n_nodes) < n_nodes // 2, 2 * np.arange(n_nodes) + 1, -1)
+
+    @classmethod
+    def from_columns(cls, columns, leaf_size=LEAF_SIZE):
+        """
+        Builds the index from catalog columns with 'X', 'Y' and 'Z' arrays (e.g.
+        Catalog.columns, so the found positions can be passed to Catalog.take).
+        """
+        return cls(columns["X"], columns["Y"], columns["Z"], leaf_size)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _query(self, classify, contains):
+        """
+        Positions (in the input order, sorted) of the stars of a region.
+
+        Parameters:
+        ----------
+        classify : callable
+            classify(lows, highs) gives OUTSIDE, CROSSING or INSIDE for every node
+            of the bounding boxes (m, 3) arrays.
+        contains : callable
+            contains(points) gives the mask of the (m, 3) points inside the region.
+        """
+        found = []
+        nodes = np.zeros(1, dtype=np.intp)
+        while len(nodes):
+            nodes = nodes[self.stops[nodes] > self.starts[nodes]]
+            state = classify(self.lows[nodes], self.highs[nodes])
+            inside = nodes[state == INSIDE]
+            found.append(self.order[_ranges(self.starts[inside], self.stops[inside])])
+            crossing = nodes[state == CROSSING]
+            leaves = crossing[self.children[crossing] < 0]
+            candidates = _ranges(self.starts[leaves], self.stops[leaves])
+            found.append(self.order[candidates[contains(self.points[candidates])]])
+            inner = self.children[crossing[self.children[crossing] >= 0]]
+            nodes = np.concatenate((inner, inner + 1))
+        return np.sort(np.concatenate(found))
+
+    def sphere(self, center, radius):
+        """
+        Positions of the stars within radius of center (e.g. galaxy.SUN).
+        """
+        center = np.asarray(center, dtype=np.float64)
+        r2 = radius**2
+
+        def classify(lows, highs):
+            nearest = np.maximum(np.maximum(lows - center, center - highs), 0)
+            farthest = np.maximum(np.abs(center - lows), np.abs(center - highs))
+            return np.where(np.sum(nearest**2, axis=1) > r2, OUTSIDE,
+                            np.where(np.sum(farthest**2, axis=1) <= r2, INSIDE, CROSSING))
+
+        return self._query(classify, lambda points: np.sum((points - center)**2, axis=1) <= r2)
+
+    def box(self, low, high):
+        """
+        Positions of the stars with low <= position <= high on every axis.
+        """
+        low, high = np.asarray(low, dtype=np.float64), np.asarray(high, dtype=np.float64)
+
+        def classify(lows, highs):
+            disjoint = np.any((highs < low) | (lows > high), axis=1)
+            contained = np.all((lows >= low) & (highs <= high), axis=1)
+            return np.where(disjoint, OUTSIDE, np.where(contained, INSIDE, CROSSING))
+
+        return self._query(classify, lambda points: np.all((points >= low) & (points <= high), axis=1))
+
+    def cone(self, apex, direction, angle, max_distance=np.inf):
+        """
+        Positions of the stars inside a cone, e.g. a sky cone around a line of sight
+        seen from the Sun: index.cone(galaxy.SUN, galaxy.sky_direction(l, b), 2).
+
+        Parameters:
+        ----------
+        apex : array-like
+            Vertex of the cone (observer position).
+        direction : array-like
+            Axis of the cone.
+        angle : float
+            Half opening angle (in degrees).
+        max_distance : float
+            Largest distance from the apex.
+
+        Returns:
+        -------
+        np.ndarray
+            Sorted positions of the stars.
+        """
+        apex = np.asarray(apex, dtype=np.float64)
+        axis = np.asarray(direction, dtype=np.float64)
+        axis = axis / np.linalg.norm(axis)
+        half_angle = np.radians(angle)
+
+        def classify(lows, highs):
+            # Bounding sphere of every box, seen from the apex
+            offset = (lows + highs) / 2 - apex
+            radius = np.linalg.norm(highs - lows, axis=1) / 2
+            distance = np.linalg.norm(offset, axis=1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                theta = np.arccos(np.clip(offset @ axis / distance, -1, 1))
+                spread = np.arcsin(np.clip(radius / distance, 0, 1))
+            around_apex = distance <= radius
+            outside = ~around_apex & ((theta - spread > half_angle) | (distance - radius > max_distance))
+            inside = ~around_apex & (theta + spread <= half_angle) & (distance + radius <= max_distance)
+            return np.where(outside, OUTSIDE, np.where(inside, INSIDE, CROSSING))
+
+        def contains(points):
+            offset = points - apex
+            distance = np.linalg.norm(offset, axis=1)
+            return (offset @ axis >= distance * np.cos(half_angle)) & (distance <= max_distance)
+
+        return self._query(classify, contains)
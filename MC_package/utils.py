@@ -1,22 +1,28 @@
 import numpy as np
 
-def remnant_classifier(masses, t_out_ms):
+def remnant_classifier(masses, t_out_ms, out=None):
     """
     Classifies initial masses into WD, NS, or BH, according the initial mass.
 
     Parameters:
         masses (array-like): Array or list of initial stellar masses.
-        indicators (array-like): Array or list of compact object indicators.
+        t_out_ms (array-like): Time out of the main sequence of every star (Myr).
+        out (np.ndarray, optional): Preallocated array (e.g. a catalog column)
+        filled in place with the indicators.
         
     Returns:
-        np.ndarray: Array with indicators for each remnant;
+        np.ndarray: uint8 array (or out) with indicators for each remnant;
          - 0: Main Sequence
          - 1: White Dwarf
          - 2: Neutro Star
          - 3: Black Hole
     """
     
-    indicators = np.zeros_like(masses, dtype=int)
+    if out is None:
+        indicators = np.zeros_like(masses, dtype=np.uint8)
+    else:
+        indicators = out
+        indicators[...] = 0
 
     stars_out_ms = t_out_ms > 0
 
@@ -30,13 +36,206 @@ def remnant_classifier(masses, t_out_ms):
 
 
 
-def remnant_mass(masses,indicators):
+# Final mass relations of every remnant branch (Kalirai 2008, Raithel 2018)
+def _wd_mass(m, rng):
+    return 0.109 * m + 0.394
+
+def _ns1_mass(m, rng):
+    return 2.24 + 0.508 * (m - 14.75) + 0.125 * (m - 14.75) ** 2 + 0.011 * (m - 14.75) ** 3
+
+def _ns2_mass(m, rng):
+    return 0.123 + 0.112 * m
+
+def _ns3_mass(m, rng):
+    return 0.996 + 0.0384 * m
+
+def _ns4_mass(m, rng):
+    return -0.020 + 0.10 * m
+
+def _ns5_mass(m, rng):
+    return rng.normal(1.6, 0.158, size=len(m))
+
+def _ns6_mass(m, rng):
+    return 3232.29 - 409.429 * (m - 2.619) + 17.2867 * (m - 2.619) ** 2 - 0.24315 * (m - 2.619) ** 3
+
+def _ns7_mass(m, rng):
+    return rng.normal(1.78, 0.02, size=len(m))
+
+def _bh1_mass(m, rng):
+    M_BH_core_low = -2.049 + 0.4140 * m
+    M_BH_all = 15.52 - 0.3294 * (m - 25.97) - 0.02121 * (m - 25.97) ** 2 + 0.003120 * (m - 25.97) ** 3
+    return 0.9 * M_BH_core_low + (1 - 0.9) * M_BH_all
+
+def _bh2_mass(m, rng):
+    return 5.697 + 7.8598 * 10**8 * m ** -4.858
+
+def _ms_mass(m, rng):
+    return m
+
+
+# Remnant branches: (indicator, initial mass condition, final mass relation).
+# The stochastic branches draw in this order, so NS5 always draws before NS7.
+REMNANT_BRANCHES = [
+    (1, lambda m: m < 8, _wd_mass),
+    (2, lambda m: (8 <= m) & (m <= 13), _ns1_mass),
+    (2, lambda m: (13 < m) & (m < 15), _ns2_mass),
+    (2, lambda m: (15 <= m) & (m < 17.8), _ns3_mass),
+    (2, lambda m: (17.8 <= m) & (m < 18.5), _ns4_mass),
+    (2, lambda m: (18.5 <= m) & (m < 21.7), _ns5_mass),
+    (2, lambda m: (25.2 <= m) & (m < 27.5), _ns6_mass),
+    (2, lambda m: (60 <= m) & (m <= 120), _ns7_mass),
+    (3, lambda m: (15 <= m) & (m <= 42.5), _bh1_mass),
+    (3, lambda m: (42.5 < m) & (m <= 120), _bh2_mass),
+    (0, lambda m: np.ones_like(m, dtype=bool), _ms_mass),
+]
+
+# Union of the mass limits of all branches. Inclusive upper limits are moved to the
+# next float, so every interval [edge_i, edge_i+1) lies inside a single branch.
+_BRANCH_EDGES = np.array([8, np.nextafter(13, np.inf), 15, 17.8, 18.5, 21.7, 25.2, 27.5,
+                          np.nextafter(42.5, np.inf), 60, np.nextafter(120, np.inf)])
+
+
+def _branch_table():
+    """
+    Tabulates the branch code (1 + position in REMNANT_BRANCHES, 0 for no branch)
+    of every (indicator, mass interval) pair.
+    """
+    representatives = np.concatenate(([1.0], _BRANCH_EDGES))
+    table = np.zeros((4, len(representatives)), dtype=np.uint8)
+    for code, (indicator, condition, _) in reversed(list(enumerate(REMNANT_BRANCHES, start=1))):
+        table[indicator][condition(representatives)] = code
+    return table
+
+
+_BRANCH_TABLE = _branch_table()
+
+
+def remnant_branches(masses, indicators, out=None):
+    """
+    Classifies each star into its final mass branch in a single pass.
+
+    Parameters:
+        masses (array-like): Array or list with initial masses
+        indicators (array-like): Array or list with remanent indicator (0-3)
+        out (np.ndarray, optional): Preallocated uint8 array for the result.
+
+    Returns:
+        np.ndarray: uint8 array with 1 + the index of the branch in REMNANT_BRANCHES,
+        or 0 for stars that fall in no branch.
+    """
+    n_bins = _BRANCH_TABLE.shape[1]
+    bins = np.searchsorted(_BRANCH_EDGES, masses, side="right")
+    bins += np.asarray(indicators, dtype=np.intp) * n_bins
+    return np.take(_BRANCH_TABLE.ravel(), bins, out=out)
+
+
+# Coefficients (highest degree first) of the rational approximations of Wichura (1988),
+# Algorithm AS241, the same ones statistics.NormalDist.inv_cdf evaluates star by star
+_AS241_CENTRAL = (
+    (2.5090809287301226727e+3, 3.3430575583588128105e+4, 6.7265770927008700853e+4,
+     4.5921953931549871457e+4, 1.3731693765509461125e+4, 1.9715909503065514427e+3,
+     1.3314166789178437745e+2, 3.3871328727963666080e+0),
+    (5.2264952788528545610e+3, 2.8729085735721942674e+4, 3.9307895800092710610e+4,
+     2.1213794301586595867e+4, 5.3941960214247511077e+3, 6.8718700749205790830e+2,
+     4.2313330701600911252e+1, 1.0),
+)
+_AS241_INTERMEDIATE = (
+    (7.7454501427834140764e-4, 2.2723844989269184583e-2, 2.4178072517745061177e-1,
+     1.2704582524523683826e+0, 3.6478483247632046050e+0, 5.7694972214606914055e+0,
+     4.6303378461565452959e+0, 1.4234371107496835773e+0),
+    (1.0507500716444168432e-9, 5.4759380849953449460e-4, 1.5198666563616457197e-2,
+     1.4810397642748007459e-1, 6.8976733498510000455e-1, 1.6763848301838038494e+0,
+     2.0531916266377588219e+0, 1.0),
+)
+_AS241_TAIL = (
+    (2.0103343992922881327e-7, 2.7115555687434875782e-5, 1.2426609473880784386e-3,
+     2.6532189526576123093e-2, 2.9656057182850489123e-1, 1.7848265399172913358e+0,
+     5.4637849111641143699e+0, 6.6579046435011037772e+0),
+    (2.0442631033899397856e-15, 1.4215117583164458887e-7, 1.8463183175100546818e-5,
+     7.8686913114561325910e-4, 1.4875361290850614853e-2, 1.3692988092273580531e-1,
+     5.9983220655588793769e-1, 1.0),
+)
+
+
+def _rational(coefficients, r, factor=None):
+    """
+    Evaluates the ratio of the two polynomials of coefficients at r (Horner scheme),
+    with the numerator multiplied by factor first when given.
+    """
+    num_coefficients, den_coefficients = coefficients
+    num = np.full_like(r, num_coefficients[0])
+    den = np.full_like(r, den_coefficients[0])
+    for a, b in zip(num_coefficients[1:], den_coefficients[1:]):
+        num = num * r + a
+        den = den * r + b
+    if factor is not None:
+        num = num * factor
+    return num / den
+
+
+def normal_quantile(p, loc=0.0, scale=1.0):
+    """
+    Vectorized inverse of the normal cumulative distribution: the rational
+    approximations of NormalDist(loc, scale).inv_cdf (AS241), on whole arrays.
+
+    Parameters:
+        p (array-like): Probabilities, strictly inside (0, 1).
+        loc (float): Mean of the distribution.
+        scale (float): Standard deviation of the distribution.
+
+    Returns:
+        np.ndarray: float64 array with the quantiles of p.
+    """
+    p = np.asarray(p, dtype=np.float64)
+    q = p - 0.5
+    x = np.empty_like(p)
+
+    central = np.abs(q) <= 0.425
+    qc = q[central]
+    x[central] = _rational(_AS241_CENTRAL, 0.180625 - qc * qc, qc)
+
+    tails = ~central
+    qt = q[tails]
+    r = np.sqrt(-np.log(np.where(qt <= 0.0, p[tails], 1.0 - p[tails])))
+    far = r > 5.0
+    xt = np.empty_like(r)
+    xt[~far] = _rational(_AS241_INTERMEDIATE, r[~far] - 1.6)
+    xt[far] = _rational(_AS241_TAIL, r[far] - 5.0)
+    x[tails] = np.where(qt < 0.0, -xt, xt)
+    return loc + x * scale
+
+
+# Largest float64 below 1, upper bound of the quantiles of the counter-mode draws
+_LAST_QUANTILE = np.nextafter(1.0, 0.0)
+
+
+class _QuantileDraws:
+    """
+    Stands for the random generator of the stochastic relations when the stars carry
+    their own uniform draws (counter-based generation): rng.normal returns the normal
+    quantiles of the draws of the stars idx.
+    """
+
+    def __init__(self, uniforms, idx):
+        self.uniforms, self.idx = uniforms, idx
+
+    def normal(self, loc, scale, size):
+        # The draws are moved half a bin up so that 0 stays inside (0, 1); the last
+        # draw (1 - 2**-53) would round to 1, so the quantiles stop below 1
+        quantiles = np.minimum(self.uniforms[self.idx[:size]] + 2.0**-54, _LAST_QUANTILE)
+        return normal_quantile(quantiles, loc, scale)
+
+
+def remnant_mass(masses,indicators,rng=None,out=None,branch_out=None,uniforms=None):
     """
     Caluclate de final mass of the remanent based in the initial mass, using 
     the studys of:
     - Kalirai (2008) - https://arxiv.org/abs/0706.3894
     - Raithel (2018) - https://iopscience.iop.org/article/10.3847/1538-4357/aab09b
 
+    Each star is classified into its branch once (remnant_branches) and only the
+    relation of that branch is evaluated, on the stars of the branch.
+
     Parameters:
         masses (array-like): Array or list with initial masses
         indicators (array-like): Array or list with remanent indicator;
@@ -44,54 +243,35 @@ def remnant_mass(masses,indicators):
         - 1: White Dwarf
         - 2: Neutro Star
         - 3: Black Hole
+        rng (np.random.Generator, optional): Random generator used for the
+        stochastic NS branches. Defaults to the global np.random state.
+        out (np.ndarray, optional): Preallocated array for the final masses (float64,
+        or float32 for a compact catalog).
+        branch_out (np.ndarray, optional): Preallocated uint8 work array for the
+        branch codes.
+        uniforms (array-like, optional): Uniform draw in [0, 1) of every star, used
+        instead of rng by the stochastic NS branches (normal inverse CDF), so the
+        final mass of a star only depends on its own draw (counter-based generation).
         
     Returns:
-        np.ndarray: Array with final masses. Stars that are not yet remanent (indicator = 0) are assigned a value of -1.
+        np.ndarray: float64 array (or out) with final masses. Stars that are not yet remanent
+        (indicator = 0) keep their initial mass; remnants whose initial mass falls
+        outside every relation (e.g. NS with 21.7-25.2 Msun) are NaN.
     """
-    masses = np.asarray(masses)
-    final_masses = np.full_like(masses, None, dtype=object)  # Inicializar array con None
-
-    # White Dwarf (WD)
-    cond_WD = (masses < 8) & (indicators==1)
-    final_masses[cond_WD] = 0.109 * masses[cond_WD] + 0.394
-
-    # Neutron Star (NS)
-    NS_type = (indicators==2) 
-    cond_NS1 = (8 <= masses) & (masses <= 13) & NS_type
-    final_masses[cond_NS1] = (
-        2.24 + 0.508 * (masses[cond_NS1] - 14.75)
-        + 0.125 * (masses[cond_NS1] - 14.75) ** 2
-        + 0.011 * (masses[cond_NS1] - 14.75) ** 3
-    )
-
-    cond_NS2 = (13 < masses) & (masses < 15)& NS_type
-    final_masses[cond_NS2] = 0.123 + 0.112 * masses[cond_NS2]
-
-    cond_NS3 = (15 <= masses) & (masses < 17.8)& NS_type
-    final_masses[cond_NS3] = 0.996 + 0.0384 * masses[cond_NS3]
-
-    cond_NS4 = (17.8 <= masses) & (masses < 18.5)& NS_type
-    final_masses[cond_NS4] = -0.020 + 0.10 * masses[cond_NS4]
-
-    cond_NS5 = (18.5 <= masses) & (masses < 21.7)& NS_type
-    final_masses[cond_NS5] = np.random.normal(1.6, 0.158, size=np.sum(cond_NS5))
-
-    cond_NS6 = (25.2 <= masses) & (masses < 27.5)& NS_type
-    final_masses[cond_NS6] = ( 3232.29 - 409.429*(masses[cond_NS6] - 2.619) + 17.2867*(masses[cond_NS6] - 2.619)**2 - 0.24315*(masses[cond_NS6] - 2.619)**3 )
-
-    cond_NS7 = (60 <= masses) & (masses <= 120) & NS_type
-    final_masses[cond_NS7] = np.random.normal(1.78, 0.02, size=np.sum(cond_NS7))
+    masses = np.asarray(masses, dtype=np.float64)
+    rng = np.random if rng is None else rng
+    final_masses = np.empty(len(masses)) if out is None else out
 
-    # Black Hole (BH)
-    BH_type = (indicators==3) 
-    cond_BH1 = (15 <= masses) & (masses <= 42.5) & BH_type
-    M_BH_core_low = -2.049 + 0.4140*masses[cond_BH1]
-    M_BH_all = (15.52 - 0.3294*(masses[cond_BH1] - 25.97) - 0.02121*(masses[cond_BH1] - 25.97)**2 + 0.003120*(masses[cond_BH1] - 25.97)**3 )
-    final_masses[cond_BH1] = 0.9*M_BH_core_low + (1 - 0.9)*M_BH_all
+    branches = remnant_branches(masses, indicators, out=branch_out)
 
-    cond_BH2 = (42.5 < masses) & (masses <= 120) & BH_type
-    final_masses[cond_BH2] = 5.697 + 7.8598 * 10**8 * (masses[cond_BH2])**-4.858
+    # Group the stars by branch (stable radix sort keeps each group in index order)
+    order = np.argsort(branches, kind="stable")
+    bounds = np.cumsum(np.bincount(branches, minlength=len(REMNANT_BRANCHES) + 1))
 
-    final_masses[indicators==0] = masses[indicators==0]
+    final_masses[order[:bounds[0]]] = np.nan
+    for code, (_, _, relation) in enumerate(REMNANT_BRANCHES, start=1):
+        idx = order[bounds[code - 1]:bounds[code]]
+        draws = rng if uniforms is None else _QuantileDraws(uniforms, idx)
+        final_masses[idx] = relation(masses[idx], draws)
 
     return final_masses
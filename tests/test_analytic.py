@@ -0,0 +1,27 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "MC_package"))
+
+from analytic import check_aggregates  # noqa: E402
+from pipeline import run_aggregates  # noqa: E402
+
+
+@pytest.mark.parametrize("sampler, n_trials, rng_mode, mass_min, mass_max", [
+    ("inverse", 10**6, "block", 0.08, 100),
+    ("inverse", 10**6, "counter", 0.08, 100),
+    ("inverse", 10**6, "block", 0.5, 50),
+    ("rejection", 2 * 10**7, "block", 0.08, 100),
+])
+def test_monte_carlo_matches_analytic(sampler, n_trials, rng_mode, mass_min, mass_max):
+    aggregates = run_aggregates(n_trials, 1, mass_min=mass_min, mass_max=mass_max, sampler=sampler,
+                                rng_mode=rng_mode)
+    result = check_aggregates(aggregates)
+    assert result["passed"], result
+
+
+def test_oracle_detects_biased_class_counts():
+    aggregates = run_aggregates(10**6, 1)
+    aggregates.class_counts[1] *= 1.02
+    assert not check_aggregates(aggregates)["passed"]
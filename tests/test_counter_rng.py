@@ -0,0 +1,60 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "MC_package"))
+
+from counter_rng import StarStream  # noqa: E402
+from pipeline import BLOCK_SIZE, CATALOG_COLUMNS, allocate_catalog, fill_catalog, generate_range  # noqa: E402
+from utils import remnant_mass  # noqa: E402
+
+SEED = 11
+N_STARS = 3 * BLOCK_SIZE + 1000
+
+
+@pytest.fixture(scope="module")
+def full_run():
+    catalog = allocate_catalog(N_STARS)
+    fill_catalog(catalog, N_STARS, SEED, rng_mode="counter")
+    return catalog
+
+
+def test_star_stream_slices_match_full_stream():
+    full = StarStream(SEED).uniforms(1000)
+    for start, stop in [(0, 1), (1, 17), (500, 1000)]:
+        np.testing.assert_array_equal(StarStream(SEED, start).uniforms(stop - start), full[start:stop])
+
+
+@pytest.mark.parametrize("start, stop", [
+    (0, 10),
+    (BLOCK_SIZE - 5, BLOCK_SIZE + 7),
+    (12345, 2 * BLOCK_SIZE + 999),
+    (N_STARS - 3, N_STARS),
+])
+def test_ranges_match_full_run(full_run, start, stop):
+    stars = generate_range(SEED, start, stop)
+    for column in CATALOG_COLUMNS:
+        np.testing.assert_array_equal(stars[column], full_run[column][start:stop], err_msg=column)
+
+
+def test_counter_final_masses_are_finite(full_run):
+    masses, objects, final_masses = full_run["Mass_i"], full_run["Object"], full_run["Mass_f"]
+    # NS with 21.7-25.2 Msun fall outside every relation (NaN by design)
+    gap = (objects == 2) & (masses >= 21.7) & (masses < 25.2)
+    stochastic = (objects == 2) & (((masses >= 18.5) & (masses < 21.7)) | (masses >= 60))
+    assert stochastic.any()
+    assert np.isfinite(final_masses[~gap]).all()
+
+
+def test_extreme_draws_give_finite_stochastic_masses():
+    # NS5 (18.5-21.7 Msun) and NS7 (60-120 Msun) stars with the smallest and largest
+    # draws of Generator.random
+    masses = np.array([20.0, 20.0, 80.0, 80.0])
+    indicators = np.full(4, 2, dtype=np.uint8)
+    uniforms = np.array([0.0, 1 - 2.0**-53, 0.0, 1 - 2.0**-53])
+    with np.errstate(all="raise"):
+        final_masses = remnant_mass(masses, indicators, uniforms=uniforms)
+    assert np.isfinite(final_masses).all()
+    assert final_masses[0] < 1.6 < final_masses[1]
+    assert final_masses[2] < 1.78 < final_masses[3]